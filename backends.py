@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Backends used by the bot to run tools.
+
+Both backends expose the same ``run(tool, files=None, data=None, json=None,
+timeout=None, on_progress=None)`` coroutine, mirroring the server's tool
+routes, and return a ToolResponse. With ``on_progress`` the tool's progress is
+passed to that coroutine as (fraction, stage), and cancelling the calling task
+cancels the tool run itself.
+
+RemoteBackend talks to the tools server over a shared, keep-alive
+``httpx.AsyncClient`` so a slow tool never blocks the bot's event loop.
+Uploads are streamed from the given file objects and responses are streamed
+into a spooled temporary file that can be handed straight to Telegram.
+
+Progress-tracked remote runs go through the server's job API: the job is
+polled for progress and deleted if the caller is cancelled.
+
+LocalBackend skips the HTTP hop for single-box deployments: it calls the
+tools' ``process_<tool>`` functions directly in a thread pool, reading the
+bot's input files in place when they are on disk.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+import asyncio
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import httpx
+
+from registry import get_spec
+
+logger = logging.getLogger(__name__)
+
+# Responses larger than this are spooled to disk instead of memory.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+CROP_KEYS = ('left', 'top', 'right', 'bottom')
+
+
+class BackendError(Exception):
+    """Raised when a backend cannot run a tool at all (e.g. server unreachable)."""
+
+
+class ToolResponse:
+    """The outcome of a tool call: a status code, a readable body and its file name."""
+
+    def __init__(self, status_code, body, filename=None):
+        self.status_code = status_code
+        self.body = body
+        self.filename = filename
+
+    @property
+    def ok(self):
+        return self.status_code == 200
+
+    @property
+    def error(self):
+        """The server's error message, if the body is a JSON error."""
+        self.body.seek(0)
+        try:
+            return json.load(self.body).get('error')
+        except (ValueError, AttributeError):
+            return None
+        finally:
+            self.body.seek(0)
+
+    def close(self):
+        self.body.close()
+
+
+class RemoteBackend:
+    """Runs tools on the Flask server through a pooled async HTTP client."""
+
+    def __init__(self, base_url, default_timeout=60, max_connections=20, poll_interval=1.0):
+        self.base_url = base_url
+        self.default_timeout = default_timeout
+        self.max_connections = max_connections
+        self.poll_interval = poll_interval
+        self._client = None
+
+    @property
+    def client(self):
+        # Created lazily so it binds to the running event loop.
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(self.default_timeout, connect=10),
+            )
+        return self._client
+
+    @staticmethod
+    def _filename(response):
+        """The file name from the response's Content-Disposition header, if any."""
+        header = response.headers.get('content-disposition')
+        if not header:
+            return None
+        message = Message()
+        message['content-disposition'] = header
+        return message.get_filename()
+
+    async def run(self, tool, files=None, data=None, json=None, timeout=None, on_progress=None):
+        """Runs the tool on the server and returns the streamed ToolResponse."""
+        timeout = httpx.Timeout(timeout or self.default_timeout, connect=10)
+        if on_progress is not None:
+            return await self._run_job(tool, files, data, json, timeout, on_progress)
+        return await self._stream('POST', f"/{tool}", timeout, files=files, data=data, json=json)
+
+    async def _run_job(self, tool, files, data, json, timeout, on_progress):
+        """Runs the tool as a server job, reporting its progress until it finishes."""
+        try:
+            response = await self.client.post(f"/jobs/{tool}", files=files, data=data, json=json, timeout=timeout)
+        except httpx.HTTPError as e:
+            raise BackendError(str(e)) from e
+        if response.status_code != 202:
+            return ToolResponse(response.status_code, io.BytesIO(response.content))
+
+        job_id = response.json()['job_id']
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout.read
+        interval = min(0.25, self.poll_interval)
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.poll_interval)
+                status = (await self.client.get(f"/jobs/{job_id}")).json()
+                if status['status'] not in ('queued', 'running'):
+                    break
+                if status.get('progress') is not None:
+                    await on_progress(status['progress'], status.get('stage'))
+                if loop.time() > deadline:
+                    raise BackendError(f"Job {job_id} timed out")
+            return await self._stream('GET', f"/jobs/{job_id}/result", timeout)
+        except httpx.HTTPError as e:
+            await asyncio.shield(self._cancel_job(job_id))
+            raise BackendError(str(e)) from e
+        except BaseException:
+            # Also on cancellation by the caller: free the server's worker.
+            await asyncio.shield(self._cancel_job(job_id))
+            raise
+
+    async def _cancel_job(self, job_id):
+        try:
+            await self.client.delete(f"/jobs/{job_id}")
+        except httpx.HTTPError as e:
+            logger.error(f"Could not cancel job {job_id}: {e}")
+
+    async def _stream(self, method, url, timeout, **kwargs):
+        """Sends a request and streams its response body into a ToolResponse."""
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        try:
+            async with self.client.stream(method, url, timeout=timeout, **kwargs) as response:
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    body.write(chunk)
+        except httpx.HTTPError as e:
+            body.close()
+            raise BackendError(str(e)) from e
+        except BaseException:
+            body.close()
+            raise
+        body.seek(0)
+        return ToolResponse(response.status_code, body, self._filename(response))
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class LocalBackend:
+    """Runs tools in-process on a thread pool, without going through the server."""
+
+    def __init__(self, max_workers=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tool')
+
+    @staticmethod
+    def _path(file, input_dir):
+        """
+        Returns a path for an upload given as a file object or (name, file)
+        tuple. The tools work on paths, so in-memory uploads are spilled.
+        """
+        name = None
+        if isinstance(file, tuple):
+            name, file = file
+        path = getattr(file, 'name', None)
+        if isinstance(path, str) and os.path.isfile(path):
+            return path
+        from tools.workspace import unique_path
+        os.makedirs(input_dir, exist_ok=True)
+        path = unique_path(input_dir, os.path.basename(name or 'upload'))
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(file, f)
+        return path
+
+    def _build_call(self, tool, files, data, json):
+        """Translates route-style arguments into a process_<tool> (source, params) pair."""
+        data = data or {}
+        json = json or {}
+        params = {key: float(data[key]) for key in CROP_KEYS if key in data}
+        spec = get_spec(tool)
+        for name in (spec.params if spec else ()):
+            value = data.get(name, json.get(name))
+            if value not in (None, ''):
+                params[name] = value
+        if isinstance(files, dict):
+            source = files['file']
+        elif files:
+            source = [file for _, file in files]
+        else:
+            source = data.get('filepath') or json.get('url') or json.get('text')
+        return source, params
+
+    def _run_sync(self, tool, source, params, reporter=None):
+        from jobs import execute_tool
+        from tools import ToolError, progress
+        output_dir = tempfile.mkdtemp(prefix='tool_')
+        input_dir = os.path.join(output_dir, 'input')
+        try:
+            if isinstance(source, list):
+                source = [self._path(file, input_dir) for file in source]
+            elif not isinstance(source, str):
+                source = self._path(source, input_dir)
+            with progress.tracking(reporter):
+                output_path = execute_tool(tool, source, output_dir, params)
+            # The open handle stays readable after the directory is removed.
+            return ToolResponse(200, open(output_path, 'rb'), os.path.basename(output_path))
+        except ToolError as e:
+            return ToolResponse(e.status_code, io.BytesIO(json.dumps({"error": e.message}).encode('utf-8')))
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    async def run(self, tool, files=None, data=None, json=None, timeout=None, on_progress=None):
+        # Tools run to completion in-process; timeout only applies to the remote backend.
+        source, params = self._build_call(tool, files, data, json)
+        if not source:
+            return ToolResponse(400, io.BytesIO(b'{"error": "No input provided"}'))
+        loop = asyncio.get_running_loop()
+        reporter = None
+        cancelled = threading.Event()
+        if on_progress is not None:
+            from tools import progress
+
+            def publish(fraction, stage):
+                asyncio.run_coroutine_threadsafe(on_progress(fraction, stage), loop)
+            reporter = progress.Reporter(publish, cancelled.is_set)
+        try:
+            return await loop.run_in_executor(self._executor, self._run_sync, tool, source, params, reporter)
+        except asyncio.CancelledError:
+            # The tool stops at its next progress report and frees the thread.
+            cancelled.set()
+            raise
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def create_backend():
+    """Builds the backend selected by TOOL_BACKEND in config.py."""
+    from config import TOOL_BACKEND, SERVER_HOST, SERVER_PORT, SERVER_TIMEOUT, SERVER_MAX_CONNECTIONS, LOCAL_WORKERS
+    from config import JOB_POLL_INTERVAL
+    if TOOL_BACKEND == 'local':
+        return LocalBackend(LOCAL_WORKERS)
+    if TOOL_BACKEND == 'remote':
+        return RemoteBackend(f"http://{SERVER_HOST}:{SERVER_PORT}", SERVER_TIMEOUT, SERVER_MAX_CONNECTIONS,
+                             JOB_POLL_INTERVAL)
+    raise ValueError(f"Unknown TOOL_BACKEND: {TOOL_BACKEND}")
@@ -6,16 +6,27 @@ This bot provides a user-friendly interface for a variety of tools,
 including image manipulation, video downloading, and file management.
 """
 
+import asyncio
+import functools
+import io
 import logging
-import requests
+import math
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, InputMediaPhoto
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters, ConversationHandler
-from config import BOT_TOKEN, SERVER_HOST, SERVER_PORT
+from config import BOT_TOKEN, SERVER_HOST, SERVER_PORT, MEDIA_SPOOL_MAX_SIZE, TOOLS_RELOAD_INTERVAL, CROP_PREVIEW_DEBOUNCE
+from config import PROGRESS_EDIT_INTERVAL, CROP_FOLDER
+from config import USAGE_LOG_DIR, USAGE_LOG_SEGMENT_MAX_BYTES, USAGE_LOG_BATCH_SIZE, USAGE_LOG_FLUSH_INTERVAL
+from backends import create_backend, BackendError
+from config import FAVORITES_FLUSH_INTERVAL, FAVORITES_DIRTY_THRESHOLD
+from config import RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL_RATE, RATE_LIMIT_IDLE_TTL, NAVIGATION_COST, MAX_HEAVY_IN_FLIGHT
+from storage import UsageLog, FavoritesStore
+from ratelimit import RateLimiter, AdmissionLimit
+from catalog import ToolCatalog
 import os
 import json
-import time
+import tempfile
 from datetime import datetime
-from PIL import Image
+import time
 
 # Enable logging
 logging.basicConfig(
@@ -27,62 +38,111 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
+STARTED_AT = time.perf_counter()
 
 # --- Data Loading ---
 try:
-    with open('tools.json', 'r', encoding='utf-8') as f:
-        TOOLS = json.load(f)
-    with open('user_logs.json', 'r', encoding='utf-8') as f:
-        USER_LOGS = json.load(f)
-    with open('user_favorites.json', 'r', encoding='utf-8') as f:
-        USER_FAVORITES = json.load(f)
+    CATALOG = ToolCatalog('tools.json', TOOLS_RELOAD_INTERVAL)
     with open('last_tools.json', 'r', encoding='utf-8') as f:
         LAST_TOOLS = json.load(f)
 except FileNotFoundError as e:
     logger.error(f"Error loading data file: {e}. Please ensure all .json files exist.")
     exit()
 
+USAGE_LOG = UsageLog(USAGE_LOG_DIR, USAGE_LOG_SEGMENT_MAX_BYTES, USAGE_LOG_BATCH_SIZE, USAGE_LOG_FLUSH_INTERVAL)
+USAGE_LOG.import_json('user_logs.json')
+FAVORITES = FavoritesStore('user_favorites.json', FAVORITES_FLUSH_INTERVAL, FAVORITES_DIRTY_THRESHOLD)
+
+
+# Runs the tools, either on the server or in-process (see TOOL_BACKEND in config.py)
+backend = create_backend()
+
 
 # --- Conversation States ---
 (
-    CHOOSING_CATEGORY, CHOOSING_TOOL, WAITING_FOR_IMAGE, WAITING_FOR_URL,
-    WAITING_FOR_VIDEO_FILE, WAITING_FOR_QR_TEXT, WAITING_FOR_FILES_TO_ZIP,
-    WAITING_FOR_ZIP_TO_UNZIP, WAITING_FOR_IMAGE_UPSCALE, WAITING_FOR_IMAGE_CROP,
+    CHOOSING_CATEGORY, CHOOSING_TOOL, WAITING_FOR_IMAGE_CROP,
     WAITING_FOR_TOOL_DETAILS, MANAGING_FAVORITES, WAITING_FOR_CROP_DIMS,
     INTERACTIVE_CROP
-) = range(14)
+) = range(7)
+
+# One "waiting for input" state per tools.json input type, with the messages it accepts.
+# Crop has its own interactive flow and links need no input.
+INPUT_FILTERS = {
+    'photo': filters.PHOTO,
+    'video': filters.VIDEO,
+    'zip': filters.Document.ZIP,
+    'url': filters.TEXT & ~filters.COMMAND,
+    'text': filters.TEXT & ~filters.COMMAND,
+    'files': filters.Document.ALL | (filters.TEXT & ~filters.COMMAND),
+}
+INPUT_STATES = {input_type: INTERACTIVE_CROP + 1 + i for i, input_type in enumerate(INPUT_FILTERS)}
 
 
 # --- Helper Functions ---
 
-user_timestamps = {}
-SPAM_LIMIT = 3  # seconds
+RATE_LIMITER = RateLimiter(RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL_RATE, RATE_LIMIT_IDLE_TTL)
+HEAVY_ADMISSION = AdmissionLimit(MAX_HEAVY_IN_FLIGHT)
+
+async def is_rate_limited(update: Update, tool_key: str = None) -> bool:
+    """
+    Charges the user for an action: navigation costs NAVIGATION_COST, a tool
+    its "cost" from tools.json. If the user is out of tokens, tells them how
+    long to wait and returns True.
+    """
+    spec = CATALOG.spec(tool_key) if tool_key else None
+    cost = spec.cost if spec else NAVIGATION_COST
+    wait = RATE_LIMITER.acquire(update.effective_user.id, cost)
+    if wait <= 0:
+        return False
+    await reply_busy(update, wait)
+    return True
+
+async def reply_busy(update: Update, wait: float) -> None:
+    """Tells the user to retry in a few seconds."""
+    text = f"⏳ الخادم مشغول، حاول مرة أخرى بعد {math.ceil(wait)} ث."
+    if update.callback_query:
+        await update.callback_query.answer(text)
+    else:
+        await update.message.reply_text(text)
 
-def is_spam(user_id: int) -> bool:
+def admission_controlled(handler):
     """
-    Checks if a user is spamming the bot.
-    Returns True if the user is spamming, False otherwise.
+    Limits how many runs of heavy tools (marked "heavy" in tools.json) are in
+    flight at once, for handlers running the user's selected tool. When all
+    slots are busy the user is asked to retry and the conversation stays in
+    the same state.
     """
-    current_time = time.time()
-    if user_id in user_timestamps and current_time - user_timestamps.get(user_id, 0) < SPAM_LIMIT:
-        return True
-    user_timestamps[user_id] = current_time
-    return False
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        spec = CATALOG.spec(context.user_data.get('selected_tool'))
+        if spec is None or not spec.heavy:
+            return await handler(update, context)
+        token = HEAVY_ADMISSION.try_acquire()
+        if token is None:
+            await reply_busy(update, HEAVY_ADMISSION.retry_after())
+            return None
+        try:
+            return await handler(update, context)
+        finally:
+            HEAVY_ADMISSION.release(token)
+    return wrapper
 
 def log_tool_usage(user_id: int, tool_key: str) -> None:
     """Logs the usage of a tool by a user."""
-    user_id_str = str(user_id)
-    if user_id_str not in USER_LOGS:
-        USER_LOGS[user_id_str] = []
-
-    log_entry = {
-        "tool": tool_key,
-        "timestamp": datetime.now().isoformat()
-    }
-    USER_LOGS[user_id_str].append(log_entry)
+    USAGE_LOG.log(user_id, tool_key, datetime.now().isoformat())
 
-    with open('user_logs.json', 'w', encoding='utf-8') as f:
-        json.dump(USER_LOGS, f, indent=4)
+async def download_media(telegram_file):
+    """
+    Downloads a Telegram file into memory, or into an anonymous temporary
+    file above MEDIA_SPOOL_MAX_SIZE. The returned buffer is rewound.
+    """
+    if telegram_file.file_size and telegram_file.file_size > MEDIA_SPOOL_MAX_SIZE:
+        media = tempfile.TemporaryFile()
+    else:
+        media = io.BytesIO()
+    await telegram_file.download_to_memory(media)
+    media.seek(0)
+    return media
 
 def add_message_to_delete_list(context: ContextTypes.DEFAULT_TYPE, message_id: int):
     """Adds a message ID to the list of messages to be deleted."""
@@ -95,63 +155,78 @@ def add_message_to_delete_list(context: ContextTypes.DEFAULT_TYPE, message_id: i
 
 def get_category_keyboard(user_id: int) -> InlineKeyboardMarkup:
     """Generates the main menu keyboard with tool categories."""
-    keyboard = []
-    user_id_str = str(user_id)
-    if user_id_str in USER_FAVORITES and USER_FAVORITES[user_id_str]:
-        keyboard.append([InlineKeyboardButton("⭐ المفضلة", callback_data='favorites')])
-
-    for category_key, category_data in TOOLS.items():
-        keyboard.append([InlineKeyboardButton(category_data["name"], callback_data=f"category_{category_key}")])
-
-    keyboard.append([InlineKeyboardButton("⚙️ إدارة المفضلة", callback_data='manage_favorites')])
-    keyboard.append([InlineKeyboardButton("ℹ️ تفاصيل الأداة", callback_data='tool_details'), InlineKeyboardButton("🤖 حول البوت", callback_data='about')])
-    keyboard.append([InlineKeyboardButton("🔔 تحديثات المشروع", callback_data='updates')])
-    keyboard.append([InlineKeyboardButton("🗑️ مسح المحادثة", callback_data='clear_chat')])
-    return InlineKeyboardMarkup(keyboard)
+    has_favorites = bool(FAVORITES.get(user_id))
+
+    def build():
+        keyboard = []
+        if has_favorites:
+            keyboard.append([InlineKeyboardButton("⭐ المفضلة", callback_data='favorites')])
+
+        for category_key, category_data in CATALOG.tools.items():
+            keyboard.append([InlineKeyboardButton(category_data["name"], callback_data=f"category_{category_key}")])
+
+        keyboard.append([InlineKeyboardButton("⚙️ إدارة المفضلة", callback_data='manage_favorites')])
+        keyboard.append([InlineKeyboardButton("ℹ️ تفاصيل الأداة", callback_data='tool_details'), InlineKeyboardButton("🤖 حول البوت", callback_data='about')])
+        keyboard.append([InlineKeyboardButton("🔔 تحديثات المشروع", callback_data='updates')])
+        keyboard.append([InlineKeyboardButton("🗑️ مسح المحادثة", callback_data='clear_chat')])
+        return InlineKeyboardMarkup(keyboard)
+
+    return CATALOG.keyboard(('category', has_favorites), build)
 
 
 def get_favorites_keyboard(user_id: int) -> InlineKeyboardMarkup:
     """Generates the keyboard for the user's favorite tools."""
-    keyboard = []
-    user_id_str = str(user_id)
-    if user_id_str in USER_FAVORITES:
-        for tool_key in USER_FAVORITES[user_id_str]:
-            for category_data in TOOLS.values():
-                if tool_key in category_data["tools"]:
-                    keyboard.append([InlineKeyboardButton(category_data["tools"][tool_key]["name"], callback_data=f"tool_{tool_key}")])
-                    break
-    keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data='start')])
-    return InlineKeyboardMarkup(keyboard)
+    def build():
+        keyboard = []
+        for tool_key in FAVORITES.get(user_id):
+            tool_info = CATALOG.tool(tool_key)
+            if tool_info:
+                keyboard.append([InlineKeyboardButton(tool_info["name"], callback_data=f"tool_{tool_key}")])
+        keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data='start')])
+        return InlineKeyboardMarkup(keyboard)
+
+    return CATALOG.user_keyboard('favorites', str(user_id), FAVORITES.version(user_id), build)
 
 
 def get_favorites_management_keyboard(user_id: int) -> InlineKeyboardMarkup:
     """Generates the keyboard for managing favorite tools."""
-    keyboard = []
-    user_id_str = str(user_id)
-    for category_key, category_data in TOOLS.items():
-        for tool_key, tool_info in category_data["tools"].items():
-            is_favorite = user_id_str in USER_FAVORITES and tool_key in USER_FAVORITES[user_id_str]
+    def build():
+        keyboard = []
+        favorites = FAVORITES.get(user_id)
+        for category_key, tool_key, tool_info in CATALOG.iter_tools():
+            is_favorite = tool_key in favorites
             button_text = f"{tool_info['name']} {'⭐' if is_favorite else '☆'}"
             keyboard.append([InlineKeyboardButton(button_text, callback_data=f"fav_{tool_key}")])
-    keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data='start')])
-    return InlineKeyboardMarkup(keyboard)
+        keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data='start')])
+        return InlineKeyboardMarkup(keyboard)
+
+    return CATALOG.user_keyboard('manage_favorites', str(user_id), FAVORITES.version(user_id), build)
 
 def get_tool_details_keyboard() -> InlineKeyboardMarkup:
     """Generates the keyboard for viewing tool details."""
-    keyboard = []
-    for category_key, category_data in TOOLS.items():
-        for tool_key, tool_info in category_data["tools"].items():
+    def build():
+        keyboard = []
+        for category_key, tool_key, tool_info in CATALOG.iter_tools():
             keyboard.append([InlineKeyboardButton(tool_info["name"], callback_data=f"details_{tool_key}")])
-    keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data='start')])
-    return InlineKeyboardMarkup(keyboard)
+        keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data='start')])
+        return InlineKeyboardMarkup(keyboard)
+
+    return CATALOG.keyboard('tool_details', build)
 
 def get_tool_keyboard(category_key):
-    tools = TOOLS[category_key]["tools"]
-    keyboard = []
-    for tool_key, tool_data in tools.items():
-        keyboard.append([InlineKeyboardButton(tool_data["name"], callback_data=f"tool_{tool_key}")])
-    keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data='start')])
-    return InlineKeyboardMarkup(keyboard)
+    def build():
+        tools = CATALOG.tools[category_key]["tools"]
+        keyboard = []
+        for tool_key, tool_data in tools.items():
+            keyboard.append([InlineKeyboardButton(tool_data["name"], callback_data=f"tool_{tool_key}")])
+        keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data='start')])
+        return InlineKeyboardMarkup(keyboard)
+
+    return CATALOG.keyboard(('category_tools', category_key), build)
+
+def get_cancel_keyboard() -> InlineKeyboardMarkup:
+    """The cancel button shown under the status message of a running tool."""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("❌ إلغاء", callback_data="cancel_tool")]])
 
 def get_crop_keyboard(left, top, right, bottom):
     """Generates the keyboard for interactive cropping."""
@@ -181,7 +256,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     Can be triggered by /start command or a callback query.
     """
     user_id = update.effective_user.id
-    if is_spam(user_id):
+    if await is_rate_limited(update):
         return CHOOSING_CATEGORY
 
     if update.callback_query:
@@ -204,7 +279,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def select_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles category selection from the main menu."""
     user_id = update.effective_user.id
-    if is_spam(user_id):
+    if await is_rate_limited(update):
         return CHOOSING_CATEGORY
 
     query = update.callback_query
@@ -220,7 +295,7 @@ async def select_category(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     logger.error(f"Could not delete message {msg_id}: {e}")
             context.user_data['messages_to_delete'] = []
         message = await query.message.reply_text("تم مسح المحادثة.")
-        time.sleep(2)
+        await asyncio.sleep(2)
         await context.bot.delete_message(chat_id=query.message.chat_id, message_id=message.message_id)
         return await start(update, context)
 
@@ -251,7 +326,7 @@ async def select_category(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     if data == 'updates':
         new_tools = []
-        for category_key, category_data in TOOLS.items():
+        for category_key, category_data in CATALOG.tools.items():
             if category_key not in LAST_TOOLS or not LAST_TOOLS[category_key]:
                 new_tools.extend(category_data["tools"].values())
             else:
@@ -266,7 +341,7 @@ async def select_category(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
             # Update last_tools.json
             with open('last_tools.json', 'w', encoding='utf-8') as f:
-                json.dump(TOOLS, f, indent=4)
+                json.dump(CATALOG.tools, f, indent=4)
             message_text += "\n استمتع بالتحديثات الجديدة!"
         else:
             message_text = "✅ أنت تستخدم أحدث إصدار. لا توجد تحديثات جديدة في الوقت الحالي."
@@ -275,11 +350,11 @@ async def select_category(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         add_message_to_delete_list(context, message.message_id)
         return CHOOSING_CATEGORY
 
-    category_key = data.split("_")[1]
+    category_key = data.split("_", 1)[1]
     context.user_data['selected_category'] = category_key
 
     message = await query.edit_message_text(
-        text=f"اختر أداة من فئة: {TOOLS[category_key]['name']}",
+        text=f"اختر أداة من فئة: {CATALOG.tools[category_key]['name']}",
         reply_markup=get_tool_keyboard(category_key)
     )
     add_message_to_delete_list(context, message.message_id)
@@ -287,291 +362,131 @@ async def select_category(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
 async def select_tool(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handles tool selection and prompts the user for input."""
+    """Handles tool selection and prompts the user for the tool's input."""
     user_id = update.effective_user.id
-    if is_spam(user_id):
+    if await is_rate_limited(update):
         return CHOOSING_TOOL
 
     query = update.callback_query
     await query.answer()
-    tool = query.data.split("_")[1]
-
+    tool = query.data.split("_", 1)[1]
+    spec = CATALOG.spec(tool)
     log_tool_usage(user_id, tool)
 
-    if tool == 'start':
-        return await start(update, context)
-
-    if tool == 'remove_bg':
-        message = await query.edit_message_text(text="أرسل لي صورة لإزالة خلفيتها.")
-        add_message_to_delete_list(context, message.message_id)
-        return WAITING_FOR_IMAGE
-    elif tool == 'download_video':
-        message = await query.edit_message_text(text="أرسل لي رابط الفيديو الذي تريد تحميله.")
-        add_message_to_delete_list(context, message.message_id)
-        return WAITING_FOR_URL
-    elif tool == 'to_mp3':
-        message = await query.edit_message_text(text="أرسل لي ملف الفيديو لتحويله إلى MP3.")
-        add_message_to_delete_list(context, message.message_id)
-        return WAITING_FOR_VIDEO_FILE
-    elif tool == 'generate_qr':
-        message = await query.edit_message_text(text="أرسل لي النص أو الرابط الذي تريد تحويله إلى QR code.")
-        add_message_to_delete_list(context, message.message_id)
-        return WAITING_FOR_QR_TEXT
-    elif tool == 'zip_file':
-        message = await query.edit_message_text(text="أرسل لي الملفات التي تريد ضغطها. أرسل 'تم' عند الانتهاء.")
-        add_message_to_delete_list(context, message.message_id)
-        context.user_data['files_to_zip'] = []
-        return WAITING_FOR_FILES_TO_ZIP
-    elif tool == 'unzip_file':
-        message = await query.edit_message_text(text="أرسل لي ملف ZIP لفك ضغطه.")
-        add_message_to_delete_list(context, message.message_id)
-        return WAITING_FOR_ZIP_TO_UNZIP
-    elif tool == 'upscale_4k':
-        message = await query.edit_message_text(text="أرسل لي صورة لتحسينها بدقة 4K.")
-        add_message_to_delete_list(context, message.message_id)
-        return WAITING_FOR_IMAGE_UPSCALE
-    elif tool == 'crop_image':
-        message = await query.edit_message_text(text="أرسل لي الصورة التي تريد قصها.")
-        add_message_to_delete_list(context, message.message_id)
-        return WAITING_FOR_IMAGE_CROP
-    elif tool == 'snake_game':
-        game_url = f"http://{SERVER_HOST}:{SERVER_PORT}/game"
-        message = await query.edit_message_text(text=f"اضغط على الرابط لبدء لعبة الدودة: {game_url}")
+    if spec is not None and spec.input == 'link':
+        url = f"http://{SERVER_HOST}:{SERVER_PORT}/{spec.endpoint}"
+        message = await query.edit_message_text(text=spec.prompt.format(url=url))
         add_message_to_delete_list(context, message.message_id)
         return CHOOSING_CATEGORY
-    else:
-        message = await query.edit_message_text(text=f"تم اختيار أداة: {tool}. هذه الميزة قيد التطوير.", reply_markup=get_tool_keyboard(context.user_data['selected_category']))
-        add_message_to_delete_list(context, message.message_id)
-        return CHOOSING_TOOL
-
-async def image_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if is_spam(update.effective_user.id): return WAITING_FOR_IMAGE
-    add_message_to_delete_list(context, update.message.message_id)
-    photo_file = await update.message.photo[-1].get_file()
-    file_name = f"{photo_file.file_id}.jpg"
-    await photo_file.download_to_drive(file_name)
-
-    message = await update.message.reply_text("جاري معالجة الصورة...")
-    add_message_to_delete_list(context, message.message_id)
-
-    try:
-        with open(file_name, 'rb') as f:
-            response = requests.post(f"http://{SERVER_HOST}:{SERVER_PORT}/remove_bg", files={'file': f})
-
-        if response.status_code == 200:
-            processed_image_path = os.path.join('static', f"processed_{file_name}")
-            with open(processed_image_path, 'wb') as f:
-                f.write(response.content)
 
-            message = await update.message.reply_photo(photo=open(processed_image_path, 'rb'))
-            add_message_to_delete_list(context, message.message_id)
-            os.remove(processed_image_path)
-        else:
-            message = await update.message.reply_text("حدث خطأ أثناء معالجة الصورة.")
-            add_message_to_delete_list(context, message.message_id)
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error connecting to server: {e}")
-        message = await update.message.reply_text("لا يمكن الوصول إلى الخادم حاليًا.")
+    if spec is None or not spec.runnable:
+        category_key = CATALOG.category_of(tool) or context.user_data['selected_category']
+        message = await query.edit_message_text(text=f"تم اختيار أداة: {tool}. هذه الميزة قيد التطوير.", reply_markup=get_tool_keyboard(category_key))
         add_message_to_delete_list(context, message.message_id)
-    finally:
-        os.remove(file_name)
-
-    message = await update.message.reply_text(
-        'اختر أداة أخرى:',
-        reply_markup=get_category_keyboard(update.effective_user.id)
-    )
-    add_message_to_delete_list(context, message.message_id)
-    return CHOOSING_CATEGORY
-
+        return CHOOSING_TOOL
 
-async def url_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if is_spam(update.effective_user.id): return WAITING_FOR_URL
-    add_message_to_delete_list(context, update.message.message_id)
-    video_url = update.message.text
-    message = await update.message.reply_text("جاري تحميل الفيديو...")
+    context.user_data['selected_tool'] = tool
+    context.user_data['tool_files'] = []
+    message = await query.edit_message_text(text=spec.prompt)
     add_message_to_delete_list(context, message.message_id)
+    if spec.input == 'crop':
+        return WAITING_FOR_IMAGE_CROP
+    return INPUT_STATES[spec.input]
 
-    try:
-        response = requests.post(f"http://{SERVER_HOST}:{SERVER_PORT}/download_video", json={'url': video_url})
-
-        if response.status_code == 200:
-            video_path = os.path.join('static', 'downloaded_video.mp4')
-            with open(video_path, 'wb') as f:
-                f.write(response.content)
 
-            message = await update.message.reply_video(video=open(video_path, 'rb'))
-            add_message_to_delete_list(context, message.message_id)
-            os.remove(video_path)
-        else:
-            message = await update.message.reply_text(f"حدث خطأ أثناء تحميل الفيديو: {response.json().get('error')}")
-            add_message_to_delete_list(context, message.message_id)
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error connecting to server: {e}")
-        message = await update.message.reply_text("لا يمكن الوصول إلى الخادم حاليًا.")
+async def read_tool_input(update: Update, spec):
+    """
+    Downloads or reads the input message for a tool and returns the
+    backend.run() keyword arguments for it.
+    """
+    if spec.input == 'url':
+        return {'json': {'url': update.message.text}}
+    if spec.input == 'text':
+        return {'json': {'text': update.message.text}}
+    if spec.input == 'photo':
+        telegram_file = await update.message.photo[-1].get_file()
+        file_name = f"{telegram_file.file_id}.jpg"
+    else:
+        media_message = update.message.video if spec.input == 'video' else update.message.document
+        telegram_file = await media_message.get_file()
+        file_name = telegram_file.file_path.split('/')[-1]
+    return {'files': {'file': (file_name, await download_media(telegram_file))}}
+
+async def send_tool_output(update: Update, spec, response):
+    """Replies with a tool's result in the form declared by its "output" type."""
+    filename = response.filename or spec.filename
+    if spec.output == 'photo':
+        return await update.message.reply_photo(photo=response.body)
+    if spec.output == 'video':
+        return await update.message.reply_video(video=response.body, filename=filename)
+    if spec.output == 'audio':
+        return await update.message.reply_audio(audio=response.body, filename=filename)
+    return await update.message.reply_document(document=response.body, filename=filename)
+
+@admission_controlled
+async def tool_input_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Runs the selected tool on the user's input, for every tool declared in tools.json."""
+    spec = CATALOG.spec(context.user_data.get('selected_tool'))
+    state = INPUT_STATES[spec.input]
+
+    if spec.input == 'files' and not (update.message.text and update.message.text.lower() == 'تم'):
+        if await is_rate_limited(update): return state
+        add_message_to_delete_list(context, update.message.message_id)
+        if update.message.document:
+            document = await update.message.document.get_file()
+            file_name = document.file_path.split('/')[-1]
+            context.user_data['tool_files'].append((file_name, await download_media(document)))
+        message = await update.message.reply_text("تم استلام الملف. أرسل المزيد من الملفات أو أرسل 'تم' للضغط.")
         add_message_to_delete_list(context, message.message_id)
+        return state
 
-    message = await update.message.reply_text(
-        'اختر أداة أخرى:',
-        reply_markup=get_category_keyboard(update.effective_user.id)
-    )
-    add_message_to_delete_list(context, message.message_id)
-    return CHOOSING_CATEGORY
-
-async def video_file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if is_spam(update.effective_user.id): return WAITING_FOR_VIDEO_FILE
+    if await is_rate_limited(update, spec.key): return state
     add_message_to_delete_list(context, update.message.message_id)
-    video_file = await update.message.video.get_file()
-    file_name = video_file.file_path.split('/')[-1]
-    await video_file.download_to_drive(file_name)
-
-    message = await update.message.reply_text("جاري تحويل الفيديو إلى MP3...")
-    add_message_to_delete_list(context, message.message_id)
-
-    try:
-        with open(file_name, 'rb') as f:
-            response = requests.post(f"http://{SERVER_HOST}:{SERVER_PORT}/to_mp3", files={'file': f})
-
-        if response.status_code == 200:
-            mp3_path = os.path.join('static', f"converted_{os.path.splitext(file_name)[0]}.mp3")
-            with open(mp3_path, 'wb') as f:
-                f.write(response.content)
-
-            message = await update.message.reply_audio(audio=open(mp3_path, 'rb'))
-            add_message_to_delete_list(context, message.message_id)
-            os.remove(mp3_path)
-        else:
-            message = await update.message.reply_text(f"حدث خطأ أثناء تحويل الفيديو: {response.json().get('error')}")
-            add_message_to_delete_list(context, message.message_id)
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error connecting to server: {e}")
-        message = await update.message.reply_text("لا يمكن الوصول إلى الخادم حاليًا.")
-        add_message_to_delete_list(context, message.message_id)
-    finally:
-        os.remove(file_name)
-
-    message = await update.message.reply_text(
-        'اختر أداة أخرى:',
-        reply_markup=get_category_keyboard(update.effective_user.id)
-    )
-    add_message_to_delete_list(context, message.message_id)
-    return CHOOSING_CATEGORY
+    if spec.input == 'files':
+        tool_input = {'files': [('files', upload) for upload in context.user_data['tool_files']]}
+    else:
+        tool_input = await read_tool_input(update, spec)
 
-async def qr_text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if is_spam(update.effective_user.id): return WAITING_FOR_QR_TEXT
-    add_message_to_delete_list(context, update.message.message_id)
-    text = update.message.text
-    message = await update.message.reply_text("جاري إنشاء رمز QR...")
-    add_message_to_delete_list(context, message.message_id)
+    # Heavy tools report progress and can be cancelled from their status message.
+    status_message = await update.message.reply_text(spec.progress, reply_markup=get_cancel_keyboard() if spec.heavy else None)
+    add_message_to_delete_list(context, status_message.message_id)
+    on_progress = progress_updater(status_message, spec.progress) if spec.heavy else None
 
+    task = asyncio.ensure_future(backend.run(spec.endpoint, timeout=spec.timeout, on_progress=on_progress, **tool_input))
+    context.user_data['tool_task'] = task
     try:
-        response = requests.post(f"http://{SERVER_HOST}:{SERVER_PORT}/generate_qr", json={'text': text})
-
-        if response.status_code == 200:
-            qr_path = os.path.join('static', 'qr_code.png')
-            with open(qr_path, 'wb') as f:
-                f.write(response.content)
-
-            message = await update.message.reply_photo(photo=open(qr_path, 'rb'))
-            add_message_to_delete_list(context, message.message_id)
-            os.remove(qr_path)
-        else:
-            message = await update.message.reply_text(f"حدث خطأ أثناء إنشاء رمز QR: {response.json().get('error')}")
-            add_message_to_delete_list(context, message.message_id)
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error connecting to server: {e}")
-        message = await update.message.reply_text("لا يمكن الوصول إلى الخادم حاليًا.")
-        add_message_to_delete_list(context, message.message_id)
-
-    message = await update.message.reply_text(
-        'اختر أداة أخرى:',
-        reply_markup=get_category_keyboard(update.effective_user.id)
-    )
-    add_message_to_delete_list(context, message.message_id)
-    return CHOOSING_CATEGORY
-
-async def zip_file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if is_spam(update.effective_user.id): return WAITING_FOR_FILES_TO_ZIP
-    add_message_to_delete_list(context, update.message.message_id)
-    if update.message.text and update.message.text.lower() == 'تم':
-        message = await update.message.reply_text("جاري ضغط الملفات...")
-        add_message_to_delete_list(context, message.message_id)
-
-        files_to_send = []
-        for file_path in context.user_data['files_to_zip']:
-            files_to_send.append(('files', (os.path.basename(file_path), open(file_path, 'rb'))))
-
+        response = await task
         try:
-            response = requests.post(f"http://{SERVER_HOST}:{SERVER_PORT}/zip_file", files=files_to_send)
-
-            if response.status_code == 200:
-                zip_path = os.path.join('static', 'archive.zip')
-                with open(zip_path, 'wb') as f:
-                    f.write(response.content)
-
-                message = await update.message.reply_document(document=open(zip_path, 'rb'))
-                add_message_to_delete_list(context, message.message_id)
-                os.remove(zip_path)
+            if response.ok:
+                message = await send_tool_output(update, spec, response)
             else:
-                message = await update.message.reply_text(f"حدث خطأ أثناء ضغط الملفات: {response.json().get('error')}")
-                add_message_to_delete_list(context, message.message_id)
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error connecting to server: {e}")
-            message = await update.message.reply_text("لا يمكن الوصول إلى الخادم حاليًا.")
+                message = await update.message.reply_text(f"{spec.error}: {response.error}")
             add_message_to_delete_list(context, message.message_id)
         finally:
-            for file_path in context.user_data['files_to_zip']:
-                os.remove(file_path)
-            context.user_data['files_to_zip'] = []
-
-
-        message = await update.message.reply_text(
-            'اختر أداة أخرى:',
-            reply_markup=get_category_keyboard(update.effective_user.id)
-        )
-        add_message_to_delete_list(context, message.message_id)
-        return CHOOSING_CATEGORY
-
-    else:
-        document = await update.message.document.get_file()
-        file_name = document.file_path.split('/')[-1]
-        file_path = await document.download_to_drive(file_name)
-        context.user_data['files_to_zip'].append(str(file_path))
-        message = await update.message.reply_text("تم استلام الملف. أرسل المزيد من الملفات أو أرسل 'تم' للضغط.")
+            response.close()
+    except asyncio.CancelledError:
+        if not context.user_data.pop('tool_cancel_requested', False):
+            raise
+        message = await update.message.reply_text("تم إلغاء العملية.")
         add_message_to_delete_list(context, message.message_id)
-        return WAITING_FOR_FILES_TO_ZIP
-
-
-async def unzip_file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if is_spam(update.effective_user.id): return WAITING_FOR_ZIP_TO_UNZIP
-    add_message_to_delete_list(context, update.message.message_id)
-    document = await update.message.document.get_file()
-    file_name = document.file_path.split('/')[-1]
-    file_path = await document.download_to_drive(file_name)
-
-    message = await update.message.reply_text("جاري فك ضغط الملف...")
-    add_message_to_delete_list(context, message.message_id)
-
-    try:
-        with open(file_path, 'rb') as f:
-            response = requests.post(f"http://{SERVER_HOST}:{SERVER_PORT}/unzip_file", files={'file': f})
-
-        if response.status_code == 200:
-            unzipped_path = os.path.join('static', 'unzipped_archive.zip')
-            with open(unzipped_path, 'wb') as f:
-                f.write(response.content)
-
-            message = await update.message.reply_document(document=open(unzipped_path, 'rb'))
-            add_message_to_delete_list(context, message.message_id)
-            os.remove(unzipped_path)
-        else:
-            message = await update.message.reply_text(f"حدث خطأ أثناء فك ضغط الملف: {response.json().get('error')}")
-            add_message_to_delete_list(context, message.message_id)
-    except requests.exceptions.RequestException as e:
+    except BackendError as e:
         logger.error(f"Error connecting to server: {e}")
         message = await update.message.reply_text("لا يمكن الوصول إلى الخادم حاليًا.")
         add_message_to_delete_list(context, message.message_id)
     finally:
-        os.remove(str(file_path))
+        context.user_data.pop('tool_task', None)
+        context.user_data.pop('tool_cancel_requested', None)
+        if spec.heavy:
+            try:
+                await status_message.edit_reply_markup(reply_markup=None)
+            except Exception as e:
+                logger.warning(f"Could not remove the cancel button: {e}")
+        uploads = tool_input.get('files') or ()
+        if isinstance(uploads, dict):
+            uploads = uploads.items()
+        for _, (_, media) in uploads:
+            media.close()
+        context.user_data['tool_files'] = []
 
     message = await update.message.reply_text(
         'اختر أداة أخرى:',
@@ -580,50 +495,46 @@ async def unzip_file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     add_message_to_delete_list(context, message.message_id)
     return CHOOSING_CATEGORY
 
-async def upscale_image_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if is_spam(update.effective_user.id): return WAITING_FOR_IMAGE_UPSCALE
-    add_message_to_delete_list(context, update.message.message_id)
-    photo_file = await update.message.photo[-1].get_file()
-    file_name = f"{photo_file.file_id}.jpg"
-    await photo_file.download_to_drive(file_name)
-
-    message = await update.message.reply_text("جاري تحسين الصورة...")
-    add_message_to_delete_list(context, message.message_id)
-
-    try:
-        with open(file_name, 'rb') as f:
-            response = requests.post(f"http://{SERVER_HOST}:{SERVER_PORT}/upscale_4k", files={'file': f})
-
-        if response.status_code == 200:
-            processed_image_path = os.path.join('static', f"upscaled_{file_name}")
-            with open(processed_image_path, 'wb') as f:
-                f.write(response.content)
-
-            message = await update.message.reply_photo(photo=open(processed_image_path, 'rb'))
-            add_message_to_delete_list(context, message.message_id)
-            os.remove(processed_image_path)
-        else:
-            message = await update.message.reply_text(f"حدث خطأ أثناء تحسين الصورة: {response.json().get('error')}")
-            add_message_to_delete_list(context, message.message_id)
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error connecting to server: {e}")
-        message = await update.message.reply_text("لا يمكن الوصول إلى الخادم حاليًا.")
-        add_message_to_delete_list(context, message.message_id)
-    finally:
-        os.remove(file_name)
-
-    message = await update.message.reply_text(
-        'اختر أداة أخرى:',
-        reply_markup=get_category_keyboard(update.effective_user.id)
-    )
-    add_message_to_delete_list(context, message.message_id)
-    return CHOOSING_CATEGORY
+def progress_updater(message, text: str):
+    """
+    Returns an on_progress callback that shows a progress bar in message,
+    editing it at most every PROGRESS_EDIT_INTERVAL seconds so Telegram does
+    not rate-limit the bot.
+    """
+    last = {'time': 0, 'percent': None}
+
+    async def on_progress(fraction: float, stage: str = None) -> None:
+        percent = int(fraction * 100)
+        now = time.monotonic()
+        if percent == last['percent'] or now - last['time'] < PROGRESS_EDIT_INTERVAL:
+            return
+        last.update(time=now, percent=percent)
+        filled = percent // 10
+        try:
+            await message.edit_text(f"{text}\n{'▓' * filled}{'░' * (10 - filled)} {percent}%",
+                                    reply_markup=get_cancel_keyboard())
+        except Exception as e:
+            logger.warning(f"Could not update progress message: {e}")
+    return on_progress
+
+async def cancel_tool_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Cancels the tool run in progress; the backend stops the underlying work."""
+    query = update.callback_query
+    task = context.user_data.get('tool_task')
+    if task is None or task.done():
+        await query.answer()
+        return None
+    context.user_data['tool_cancel_requested'] = True
+    task.cancel()
+    await query.answer("جاري الإلغاء...")
+    return None
 
 async def crop_image_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    from PIL import Image  # only the crop flow needs Pillow
     add_message_to_delete_list(context, update.message.message_id)
     photo_file = await update.message.photo[-1].get_file()
-    file_name = f"{photo_file.file_id}.jpg"
-    file_path = await photo_file.download_to_drive(file_name)
+    os.makedirs(CROP_FOLDER, exist_ok=True)
+    file_path = await photo_file.download_to_drive(os.path.join(CROP_FOLDER, f"{photo_file.file_id}.jpg"))
 
     img = Image.open(file_path)
     width, height = img.size
@@ -645,11 +556,47 @@ async def crop_image_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     add_message_to_delete_list(context, message.message_id)
     return INTERACTIVE_CROP
 
+def cancel_crop_preview(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Cancels the pending or in-flight crop preview, if any."""
+    task = context.user_data.pop('crop_preview_task', None)
+    if task is not None and not task.done():
+        task.cancel()
+
+async def render_crop_preview(query, context: ContextTypes.DEFAULT_TYPE, version: int) -> None:
+    """
+    Renders the crop preview once the user stops pressing buttons for
+    CROP_PREVIEW_DEBOUNCE seconds. A newer press cancels this task, so only
+    the latest crop box is rendered and uploaded.
+    """
+    await asyncio.sleep(CROP_PREVIEW_DEBOUNCE)
+    dims = dict(context.user_data['crop_dims'])
+    file_path = context.user_data['crop_file_path']
+    try:
+        response = await backend.run('preview_crop', data={'filepath': file_path, **dims})
+        try:
+            if response.ok and context.user_data.get('crop_version') == version:
+                await query.edit_message_media(
+                    media=InputMediaPhoto(media=response.body),
+                    reply_markup=get_crop_keyboard(**dims)
+                )
+        finally:
+            response.close()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Error updating crop preview: {e}")
+
 async def interactive_crop_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
 
     data = query.data
+    if data == 'start':
+        cancel_crop_preview(context)
+        os.remove(context.user_data.pop('crop_file_path'))
+        context.user_data.pop('crop_dims', None)
+        return await start(update, context)
+
     step = int(data.split("_")[-1]) if "_" in data else 0
     dims = context.user_data['crop_dims']
 
@@ -665,29 +612,24 @@ async def interactive_crop_handler(update: Update, context: ContextTypes.DEFAULT
         dims['right'] += step; dims['bottom'] += step
 
     if "done" in data:
+        cancel_crop_preview(context)
         file_path = context.user_data['crop_file_path']
-        file_name = os.path.basename(file_path)
 
         await query.edit_message_caption(caption="جاري قص الصورة...")
 
         try:
             with open(file_path, 'rb') as f:
                 data = dims
-                response = requests.post(f"http://{SERVER_HOST}:{SERVER_PORT}/crop_image", files={'file': f}, data=data)
-
-            if response.status_code == 200:
-                processed_image_path = os.path.join('static', f"cropped_{file_name}")
-                with open(processed_image_path, 'wb') as f:
-                    f.write(response.content)
+                response = await backend.run('crop_image', files={'file': f}, data=data)
 
+            if response.ok:
                 await context.bot.delete_message(chat_id=query.message.chat_id, message_id=query.message.message_id)
-                message = await context.bot.send_photo(chat_id=query.message.chat_id, photo=open(processed_image_path, 'rb'))
+                message = await context.bot.send_photo(chat_id=query.message.chat_id, photo=response.body)
                 add_message_to_delete_list(context, message.message_id)
-                os.remove(processed_image_path)
             else:
-                message = await query.message.reply_text(f"حدث خطأ أثناء قص الصورة: {response.json().get('error')}")
+                message = await query.message.reply_text(f"حدث خطأ أثناء قص الصورة: {response.error}")
                 add_message_to_delete_list(context, message.message_id)
-        except requests.exceptions.RequestException as e:
+        except BackendError as e:
             logger.error(f"Error connecting to server: {e}")
             message = await query.message.reply_text("لا يمكن الوصول إلى الخادم حاليًا.")
             add_message_to_delete_list(context, message.message_id)
@@ -703,41 +645,28 @@ async def interactive_crop_handler(update: Update, context: ContextTypes.DEFAULT
         add_message_to_delete_list(context, message.message_id)
         return CHOOSING_CATEGORY
 
-    # Update the preview
-    file_path = context.user_data['crop_file_path']
-    try:
-        data = dims
-        response = requests.post(f"http://{SERVER_HOST}:{SERVER_PORT}/preview_crop", data={'filepath': file_path, **data})
-        if response.status_code == 200:
-            preview_path = os.path.join('static', f"preview_{os.path.basename(file_path)}")
-            with open(preview_path, 'wb') as f:
-                f.write(response.content)
-
-            await query.edit_message_media(
-                media=InputMediaPhoto(media=open(preview_path, 'rb')),
-                reply_markup=get_crop_keyboard(**dims)
-            )
-            os.remove(preview_path)
-    except Exception as e:
-        logger.error(f"Error updating crop preview: {e}")
-
+    # Presses only accumulate into crop_dims; the preview is rendered once
+    # they stop, superseding any render that is still pending or in flight.
+    cancel_crop_preview(context)
+    version = context.user_data.get('crop_version', 0) + 1
+    context.user_data['crop_version'] = version
+    context.user_data['crop_preview_task'] = context.application.create_task(
+        render_crop_preview(query, context, version), update=update)
     return INTERACTIVE_CROP
 
 
 async def tool_details_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if is_spam(update.effective_user.id): return WAITING_FOR_TOOL_DETAILS
+    if await is_rate_limited(update): return WAITING_FOR_TOOL_DETAILS
     query = update.callback_query
     await query.answer()
-    tool_key = query.data.split("_")[1]
-
-    if tool_key == 'start':
+    if query.data == 'start':
         return await start(update, context)
 
-    for category_data in TOOLS.values():
-        if tool_key in category_data["tools"]:
-            message = await query.edit_message_text(category_data["tools"][tool_key]["desc"], reply_markup=get_tool_details_keyboard())
-            add_message_to_delete_list(context, message.message_id)
-            break
+    tool_key = query.data.split("_", 1)[1]
+    tool_info = CATALOG.tool(tool_key)
+    if tool_info:
+        message = await query.edit_message_text(tool_info["desc"], reply_markup=get_tool_details_keyboard())
+        add_message_to_delete_list(context, message.message_id)
 
     return WAITING_FOR_TOOL_DETAILS
 
@@ -751,18 +680,11 @@ async def manage_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         add_message_to_delete_list(context, message.message_id)
         return MANAGING_FAVORITES
 
-    tool_key = query.data.split("_")[1]
-
-    if user_id not in USER_FAVORITES:
-        USER_FAVORITES[user_id] = []
-
-    if tool_key in USER_FAVORITES[user_id]:
-        USER_FAVORITES[user_id].remove(tool_key)
-    else:
-        USER_FAVORITES[user_id].append(tool_key)
+    if query.data == 'start':
+        return await start(update, context)
 
-    with open('user_favorites.json', 'w', encoding='utf-8') as f:
-        json.dump(USER_FAVORITES, f, indent=4)
+    tool_key = query.data.split("_", 1)[1]
+    FAVORITES.toggle(user_id, tool_key)
 
     message = await query.edit_message_text("تم تحديث المفضلة.", reply_markup=get_favorites_management_keyboard(user_id))
     add_message_to_delete_list(context, message.message_id)
@@ -779,7 +701,6 @@ async def crop_dims_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return WAITING_FOR_CROP_DIMS
 
     file_path = context.user_data['crop_file_path']
-    file_name = os.path.basename(file_path)
 
     message = await update.message.reply_text("جاري قص الصورة...")
     add_message_to_delete_list(context, message.message_id)
@@ -787,20 +708,15 @@ async def crop_dims_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     try:
         with open(file_path, 'rb') as f:
             data = {'left': left, 'top': top, 'right': right, 'bottom': bottom}
-            response = requests.post(f"http://{SERVER_HOST}:{SERVER_PORT}/crop_image", files={'file': f}, data=data)
+            response = await backend.run('crop_image', files={'file': f}, data=data)
 
-        if response.status_code == 200:
-            processed_image_path = os.path.join('static', f"cropped_{file_name}")
-            with open(processed_image_path, 'wb') as f:
-                f.write(response.content)
-
-            message = await update.message.reply_photo(photo=open(processed_image_path, 'rb'))
+        if response.ok:
+            message = await update.message.reply_photo(photo=response.body)
             add_message_to_delete_list(context, message.message_id)
-            os.remove(processed_image_path)
         else:
-            message = await update.message.reply_text(f"حدث خطأ أثناء قص الصورة: {response.json().get('error')}")
+            message = await update.message.reply_text(f"حدث خطأ أثناء قص الصورة: {response.error}")
             add_message_to_delete_list(context, message.message_id)
-    except requests.exceptions.RequestException as e:
+    except BackendError as e:
         logger.error(f"Error connecting to server: {e}")
         message = await update.message.reply_text("لا يمكن الوصول إلى الخادم حاليًا.")
         add_message_to_delete_list(context, message.message_id)
@@ -816,29 +732,35 @@ async def crop_dims_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return CHOOSING_CATEGORY
 
 
+async def on_shutdown(application: Application) -> None:
+    """Flushes buffered data and releases the backend on shutdown."""
+    USAGE_LOG.flush()
+    FAVORITES.flush()
+    await backend.close()
+
+
 def main() -> None:
     """Initializes and runs the bot."""
     print("Initializing application...")
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_shutdown(on_shutdown).build()
     print("Application initialized.")
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start), CallbackQueryHandler(start, pattern='^start$')],
         states={
             CHOOSING_CATEGORY: [CallbackQueryHandler(select_category)],
-            CHOOSING_TOOL: [CallbackQueryHandler(select_tool, pattern="^tool_")],
-            WAITING_FOR_IMAGE: [MessageHandler(filters.PHOTO, image_handler)],
-            WAITING_FOR_URL: [MessageHandler(filters.TEXT & ~filters.COMMAND, url_handler)],
-            WAITING_FOR_VIDEO_FILE: [MessageHandler(filters.VIDEO, video_file_handler)],
-            WAITING_FOR_QR_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, qr_text_handler)],
-            WAITING_FOR_FILES_TO_ZIP: [MessageHandler(filters.Document.ALL | (filters.TEXT & ~filters.COMMAND), zip_file_handler)],
-            WAITING_FOR_ZIP_TO_UNZIP: [MessageHandler(filters.Document.ZIP, unzip_file_handler)],
-            WAITING_FOR_IMAGE_UPSCALE: [MessageHandler(filters.PHOTO, upscale_image_handler)],
+            CHOOSING_TOOL: [CallbackQueryHandler(select_tool, pattern="^tool_"), CallbackQueryHandler(start, pattern='^start$')],
             WAITING_FOR_IMAGE_CROP: [MessageHandler(filters.PHOTO, crop_image_handler)],
             WAITING_FOR_CROP_DIMS: [MessageHandler(filters.TEXT & ~filters.COMMAND, crop_dims_handler)],
             INTERACTIVE_CROP: [CallbackQueryHandler(interactive_crop_handler)],
             WAITING_FOR_TOOL_DETAILS: [CallbackQueryHandler(tool_details_handler)],
             MANAGING_FAVORITES: [CallbackQueryHandler(manage_favorites)],
+            # Tool runs do not block the bot, so the cancel button is handled
+            # (in the WAITING state) while they run. File collection stays
+            # blocking so files sent together are all received.
+            **{state: [MessageHandler(INPUT_FILTERS[input_type], tool_input_handler, block=input_type == 'files')]
+               for input_type, state in INPUT_STATES.items()},
+            ConversationHandler.WAITING: [CallbackQueryHandler(cancel_tool_handler, pattern='^cancel_tool$')],
         },
         fallbacks=[CommandHandler('start', start)],
     )
@@ -847,6 +769,7 @@ def main() -> None:
     application.add_handler(conv_handler)
     print("Conversation handler added.")
 
+    logger.info(f"Bot initialized in {time.perf_counter() - STARTED_AT:.2f}s")
     print("Starting polling...")
     application.run_polling()
     print("Polling stopped.")
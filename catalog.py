@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Tool catalog for the bot.
+
+Loads tools.json once, builds its tool registry (see registry.py) and caches the
+inline keyboards built from it. Shared keyboards are built once per catalog
+version; per-user keyboards are cached in a bounded LRU keyed on the user's
+favorites version. tools.json is reloaded without a restart when its mtime
+changes.
+"""
+
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+import time
+
+from registry import build_registry
+
+logger = logging.getLogger(__name__)
+
+
+class ToolCatalog:
+    """Indexed, hot-reloadable view of tools.json with a keyboard cache."""
+
+    def __init__(self, path, check_interval=2, max_user_keyboards=10000):
+        self.path = path
+        self.check_interval = check_interval
+        self.max_user_keyboards = max_user_keyboards
+        self.version = 0
+        self._lock = threading.Lock()
+        self._keyboards = {}
+        self._user_keyboards = OrderedDict()
+        self._checked_at = 0
+        self._load()
+
+    def _load(self):
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, 'r', encoding='utf-8') as f:
+            tools = json.load(f)
+        specs = build_registry(tools)
+        with self._lock:
+            self.tools = tools
+            self._specs = specs
+            self._mtime = mtime
+            self._keyboards = {}
+            self._user_keyboards = OrderedDict()
+            self.version += 1
+
+    def refresh(self):
+        """Reloads tools.json if it changed; checks at most every check_interval seconds."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            if os.path.getmtime(self.path) != self._mtime:
+                self._load()
+                logger.info(f"Reloaded {self.path} (catalog version {self.version})")
+        except (OSError, ValueError) as e:
+            # Keep serving the last good catalog, e.g. while the file is being edited.
+            logger.error(f"Could not reload {self.path}: {e}")
+
+    def category_of(self, tool_key):
+        """Returns the category key of a tool, or None."""
+        spec = self._specs.get(tool_key)
+        return spec.category if spec else None
+
+    def spec(self, tool_key):
+        """Returns the ToolSpec of a tool, or None."""
+        return self._specs.get(tool_key)
+
+    def tool(self, tool_key):
+        """Returns the tools.json entry for a tool key, or an empty dict."""
+        category_key = self.category_of(tool_key)
+        return self.tools[category_key]["tools"][tool_key] if category_key else {}
+
+    def iter_tools(self):
+        """Yields (category_key, tool_key, tool_info) for every tool."""
+        for category_key, category_data in self.tools.items():
+            for tool_key, tool_info in category_data["tools"].items():
+                yield category_key, tool_key, tool_info
+
+    def keyboard(self, key, build):
+        """Returns the shared keyboard for key, building it once per catalog version."""
+        self.refresh()
+        markup = self._keyboards.get(key)
+        if markup is None:
+            markup = build()
+            with self._lock:
+                self._keyboards[key] = markup
+        return markup
+
+    def user_keyboard(self, key, user_id, favorites_version, build):
+        """Returns a per-user keyboard, rebuilt only when the user's favorites change."""
+        self.refresh()
+        cache_key = (key, user_id)
+        with self._lock:
+            entry = self._user_keyboards.get(cache_key)
+            if entry is not None and entry[0] == favorites_version:
+                self._user_keyboards.move_to_end(cache_key)
+                return entry[1]
+        markup = build()
+        with self._lock:
+            self._user_keyboards[cache_key] = (favorites_version, markup)
+            self._user_keyboards.move_to_end(cache_key)
+            while len(self._user_keyboards) > self.max_user_keyboards:
+                self._user_keyboards.popitem(last=False)
+        return markup
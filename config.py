@@ -6,3 +6,109 @@ BOT_TOKEN = "8361252280:AAET5GYvG3GnW7JXdO-NckCD8Tsrj0UmxzY"
 # Server Configuration
 SERVER_HOST = "0.0.0.0"
 SERVER_PORT = 8080
+
+# Bot -> server HTTP client: default read timeout (seconds); tools that take
+# longer declare their own "timeout" in tools.json
+SERVER_TIMEOUT = 60
+SERVER_MAX_CONNECTIONS = 20  # keep-alive connection pool size
+JOB_POLL_INTERVAL = 1  # seconds between job status polls for progress-tracked tools
+PROGRESS_EDIT_INTERVAL = 3  # minimum seconds between edits of the bot's progress message
+
+# How the bot runs tools: "remote" posts to the server (process isolation),
+# "local" calls tools/* directly in a thread pool (lowest latency, one box).
+TOOL_BACKEND = "remote"
+LOCAL_WORKERS = None  # threads for the local backend, None = Python's default
+
+# Telegram media is downloaded into memory, or into a temp file above this size
+MEDIA_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Job Engine Configuration
+JOB_WORKERS = None  # worker processes, None = one per CPU core
+JOB_MAX_PENDING = 32  # unfinished jobs accepted before /jobs answers 503
+JOB_TTL = 600  # seconds a finished job's result is kept
+
+# Server Startup: tool modules (rembg, yt_dlp, ffmpeg...) are imported on first
+# use; with TOOLS_PRELOAD they are also imported in the background at startup
+TOOLS_PRELOAD = True
+
+# Background Removal Configuration
+REMBG_MODEL = "u2net"  # one of: u2net, u2netp, silueta, isnet
+REMBG_THREADS = None  # onnxruntime threads per session, None = onnxruntime default
+REMBG_PRELOAD = True  # load and warm the model in every worker at startup
+REMBG_BATCH_SIZE = 8  # images per ONNX forward pass in /remove_bg_batch
+
+# Super-Resolution Configuration (upscale_4k)
+UPSCALE_BACKEND = "auto"  # "ncnn" (realesrgan-ncnn-vulkan, GPU), "onnx" (CPU) or "auto"
+UPSCALE_MODEL_PATH = "models/realesrgan-x4plus.onnx"  # Real-ESRGAN ONNX model for the onnx backend
+UPSCALE_MODEL_SCALE = 4  # the model's native scale factor
+UPSCALE_TILE_SIZE = 256  # tile edge in input pixels; bounds peak memory
+UPSCALE_TILE_OVERLAP = 16  # context pixels around each tile, hides seams
+UPSCALE_WORKERS = None  # tiles upscaled in parallel, None = one per CPU core
+UPSCALE_TARGET_SIZE = 3840  # longest side of the result when no target_size is given
+UPSCALE_MAX_TARGET_SIZE = 7680
+
+# Video Download Configuration
+VIDEO_MAX_BYTES = 50 * 1024 * 1024  # largest format download_video picks (Telegram's bot upload limit)
+VIDEO_MAX_HEIGHT = 720  # when no format size is known, the best format up to this height is downloaded
+DOWNLOAD_CACHE_DIR = "static/download_cache"  # shared by all processes; one download per video at a time
+DOWNLOAD_CACHE_TTL = 6 * 60 * 60  # seconds a downloaded video is served from the cache
+DOWNLOAD_CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024  # least recently used videos are evicted above this
+DOWNLOAD_CACHE_ERROR_TTL = 60  # seconds a failed download is reported to waiters without retrying
+
+# MP3 Conversion Configuration (to_mp3)
+MP3_BITRATE = None  # constant bitrate such as "192k"; None encodes VBR at MP3_VBR_QUALITY
+MP3_VBR_QUALITY = 2  # libmp3lame VBR preset, 0 (best) to 9 (smallest); 2 is ~190 kbit/s
+MP3_THREADS = 0  # ffmpeg threads for decoding and encoding, 0 = one per CPU core
+MP3_STREAMING = True  # POST /to_mp3 pipes the upload through ffmpeg and streams the MP3 back without temp files
+# (direct HTTP clients only: the bot converts through the job API, with the cache and segmented encoder)
+MP3_SEGMENT_THRESHOLD = 20 * 60  # inputs at least this many seconds long are encoded in parallel segments; None disables
+MP3_SEGMENT_SECONDS = 5 * 60  # length of each segment
+MP3_SEGMENT_WORKERS = None  # segments encoded at once, None = one per CPU core
+MP3_SEGMENT_PREROLL = 3  # frames each segment is encoded ahead of the part that is kept
+
+# Archive Configuration (zip_file, unzip_file)
+ZIP_COMPRESS_LEVEL = 6  # deflate level, 1 (fastest) to 9 (smallest); already-compressed formats are stored
+ZIP_WORKERS = None  # members compressed in parallel, None = one per CPU core
+ZIP_SPOOL_SIZE = 8 * 1024 * 1024  # a compressed member is kept in memory up to this size, then spilled to disk
+UNZIP_MAX_MEMBERS = 10000  # unzip_file rejects archives with more files than this
+UNZIP_MAX_BYTES = 2 * 1024 * 1024 * 1024  # ... or whose chosen members unpack to more than this
+UNZIP_MAX_RATIO = 200  # ... or with a member over 1 MB compressed more than this many times (zip bombs)
+
+# QR Code Configuration (generate_qr)
+QR_CACHE_ITEMS = 256  # rendered codes kept in memory per process
+QR_BULK_MAX_CODES = 1000  # most codes one /generate_qr/bulk request may ask for
+QR_BULK_WORKERS = None  # processes rendering bulk requests, None = one per CPU core
+
+# Crop Preview Configuration
+CROP_FOLDER = "static/crop"  # the bot downloads photos to crop here; /preview_crop only reads from it and the workspaces
+PREVIEW_MAX_SIDE = 640  # longest side of the decoded proxy used for crop previews
+PREVIEW_QUALITY = 70  # JPEG quality of the previews
+PREVIEW_CACHE_ITEMS = 32  # decoded proxies kept in memory per process
+CROP_PREVIEW_DEBOUNCE = 0.5  # seconds without crop button presses before the bot renders a preview
+
+# Result Cache Configuration
+CACHE_ENABLED = True
+CACHE_DIR = "static/cache"
+CACHE_MAX_BYTES = 1024 * 1024 * 1024  # disk tier size before LRU eviction
+CACHE_MEMORY_MAX_BYTES = 64 * 1024 * 1024  # memory tier size per process
+CACHE_MEMORY_ITEM_MAX_BYTES = 512 * 1024  # larger outputs are only cached on disk
+
+# Usage Log Configuration (append-only JSON Lines segments)
+USAGE_LOG_DIR = "user_logs"
+USAGE_LOG_SEGMENT_MAX_BYTES = 16 * 1024 * 1024  # rotate to a new segment above this size
+USAGE_LOG_BATCH_SIZE = 50  # events buffered before a write
+USAGE_LOG_FLUSH_INTERVAL = 5  # seconds before a partial batch is written
+
+# Favorites Store Configuration (write-behind snapshots of user_favorites.json)
+FAVORITES_FLUSH_INTERVAL = 5  # seconds before pending changes are written
+FAVORITES_DIRTY_THRESHOLD = 20  # pending changes that trigger an immediate write
+
+# Rate Limiting Configuration (per-user token buckets, tool costs in tools.json)
+RATE_LIMIT_CAPACITY = 10  # tokens a user can spend in a burst
+RATE_LIMIT_REFILL_RATE = 0.5  # tokens regained per second
+RATE_LIMIT_IDLE_TTL = 600  # seconds before an idle user's bucket is dropped
+NAVIGATION_COST = 0.2  # menu/button callbacks
+MAX_HEAVY_IN_FLIGHT = 4  # concurrent runs of tools marked "heavy" in tools.json
+
+# Tool Catalog Configuration
+TOOLS_RELOAD_INTERVAL = 2  # seconds between tools.json mtime checks (hot reload)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous job engine for the tools server.
+
+Jobs are submitted from HTTP requests and executed on a bounded process pool,
+so long-running tools (upscaling, video downloads, conversions) no longer tie
+up a request thread and several jobs can run in parallel across all cores.
+Running jobs publish their progress into their directory and can be
+cancelled, see tools/progress.py.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from registry import load_registry
+from tools import cache, loader, progress
+
+logger = logging.getLogger(__name__)
+
+# tool name -> (module, function) of the tool's process_* entry point:
+# every runnable tool in tools.json, plus endpoints that are not in the menu.
+JOB_TOOLS = {
+    'remove_bg_batch': ('tools.image', 'process_remove_bg_batch'),
+    'preview_crop': ('tools.image', 'process_preview_crop'),
+    'generate_qr_bulk': ('tools.other', 'process_generate_qr_bulk'),
+}
+JOB_TOOLS.update({key: (f"tools.{spec.module}", f"process_{key}")
+                  for key, spec in load_registry().items() if spec.runnable})
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+
+class JobQueueFull(Exception):
+    """Raised when the number of unfinished jobs reaches the configured limit."""
+
+
+def execute_tool(tool, source, output_dir, params):
+    """Runs a tool inside a worker process and returns its output path."""
+    module_name, function_name = JOB_TOOLS[tool]
+    function = getattr(loader.load(module_name), function_name)
+    return function(source, output_dir, **params)
+
+
+def _init_worker(counters, initializer):
+    """
+    Worker-process initializer: shares the server's cache counters and runs
+    `initializer`. A failing initializer would break the whole pool, so its
+    error is logged and the worker starts anyway: the warm-up is only an
+    optimisation, e.g. rembg then loads its session on first use.
+    """
+    cache.share_counters(counters)
+    if initializer is None:
+        return
+    try:
+        initializer()
+    except Exception as e:
+        logger.error(f"Worker initializer failed in process {os.getpid()}: {e}")
+
+
+def run_job(tool, source, work_dir, params):
+    """Runs a job's tool in a worker process, publishing progress to its directory."""
+    with progress.tracking(progress.DirectoryReporter(work_dir)):
+        return execute_tool(tool, source, work_dir, params)
+
+
+class Job:
+    """A single tool invocation tracked by the JobManager."""
+
+    def __init__(self, tool, work_dir):
+        self.id = uuid.uuid4().hex
+        self.tool = tool
+        self.work_dir = work_dir
+        self.future = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def status(self):
+        if self.future.cancelled():
+            return CANCELLED
+        if not self.future.done():
+            return RUNNING if self.future.running() else QUEUED
+        if self.future.exception():
+            return CANCELLED if isinstance(self.future.exception(), progress.Cancelled) else FAILED
+        return DONE
+
+    @property
+    def error(self):
+        if self.status != FAILED:
+            return None
+        exc = self.future.exception()
+        return getattr(exc, 'message', None) or str(exc) or type(exc).__name__
+
+    @property
+    def result_path(self):
+        return self.future.result() if self.status == DONE else None
+
+    def to_dict(self):
+        status = self.status
+        published = progress.read(self.work_dir) if status == RUNNING else {"progress": None, "stage": None}
+        if status == DONE:
+            published["progress"] = 1.0
+        return {
+            "job_id": self.id,
+            "tool": self.tool,
+            "status": status,
+            "progress": published["progress"],
+            "stage": published["stage"],
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """Submits tool jobs to a process pool and keeps track of their state."""
+
+    def __init__(self, root, max_workers=None, max_pending=32, ttl=600, initializer=None):
+        self.root = root
+        self.max_pending = max_pending
+        self.ttl = ttl
+        # Spawned rather than forked: the server's threads (requests, the
+        # warm-up importing modules and building sessions) could leave a
+        # forked worker with an import or session lock held forever.
+        self._executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker,
+                                             initargs=(cache.counters(), initializer))
+        self._jobs = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def create(self, tool):
+        """Reserves a job and its working directory before inputs are saved."""
+        if tool not in JOB_TOOLS:
+            raise KeyError(tool)
+        self.cleanup()
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job.future is None or not job.future.done())
+            if pending >= self.max_pending:
+                raise JobQueueFull()
+            job = Job(tool, None)
+            job.work_dir = os.path.join(self.root, job.id)
+            os.makedirs(job.work_dir)
+            self._jobs[job.id] = job
+        return job
+
+    def start(self, job, source, params=None):
+        """Hands a created job to the worker pool."""
+        job.future = self._executor.submit(run_job, job.tool, source, job.work_dir, params or {})
+        job.future.add_done_callback(lambda _: self._finished(job))
+        return job
+
+    def discard(self, job):
+        """Forgets a created job whose inputs could not be prepared."""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.future is not None else None
+
+    def cancel(self, job_id):
+        """
+        Cancels a job. A queued job is dropped; a running job stops at its next
+        progress report, which kills its subprocess and frees the worker.
+        Returns False if the job is unknown or already finished.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return False
+        if job.future.cancel():
+            return True
+        if job.future.done():
+            return False
+        progress.request_cancel(job.work_dir)
+        return True
+
+    def cleanup(self):
+        """Removes finished jobs (and their files) older than the TTL."""
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values()
+                       if job.finished_at is not None and now - job.finished_at > self.ttl]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finished(self, job):
+        job.finished_at = time.time()
+        try:
+            if job.future.exception() and job.status != CANCELLED:
+                logger.error(f"Job {job.id} ({job.tool}) failed: {job.future.exception()}")
+        except CancelledError:
+            pass
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Rate limiting for the bot.
+
+RateLimiter gives every user a token bucket: cheap actions such as menu
+navigation cost little, expensive tools cost more (see "cost" in tools.json).
+Buckets of idle users are dropped, so memory stays bounded.
+
+AdmissionLimit caps how many heavy tool runs are in flight at once across
+all users, and estimates when the next slot will free up.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class RateLimiter:
+    """Per-user token buckets that expire when idle."""
+
+    def __init__(self, capacity=10, refill_rate=1.0, idle_ttl=600, max_users=100000):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        # user_id -> (tokens, last update), least recently active first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, user_id, cost=1):
+        """
+        Takes cost tokens from the user's bucket.
+        Returns 0 if allowed, otherwise the seconds to wait before retrying.
+        """
+        cost = min(cost, self.capacity)
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            tokens, updated = self._buckets.pop(user_id, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost - tokens) / self.refill_rate
+            self._buckets[user_id] = (tokens, now)
+        return wait
+
+    def _prune(self, now):
+        while self._buckets:
+            user_id, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < self.idle_ttl and len(self._buckets) < self.max_users:
+                break
+            del self._buckets[user_id]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionLimit:
+    """A global cap on concurrently running heavy jobs."""
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self._started = {}
+        self._average = None
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Reserves a slot. Returns a token for release(), or None if all slots are busy."""
+        with self._lock:
+            if len(self._started) >= self.max_in_flight:
+                return None
+            token = object()
+            self._started[token] = time.monotonic()
+            return token
+
+    def release(self, token):
+        with self._lock:
+            started = self._started.pop(token, None)
+            if started is None:
+                return
+            duration = time.monotonic() - started
+            self._average = duration if self._average is None else 0.8 * self._average + 0.2 * duration
+
+    def retry_after(self, default=10):
+        """Estimates the seconds until a slot frees up."""
+        with self._lock:
+            if self._average is None or not self._started:
+                return default
+            now = time.monotonic()
+            return max(1, min(self._average - (now - started) for started in self._started.values()))
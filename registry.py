@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative tool registry, sourced from tools.json.
+
+Every tool entry declares how it is run, not just how it is shown:
+
+- ``module``: the tools/ module implementing it (``tools.<module>.<key>`` is the
+  Flask helper, ``tools.<module>.process_<key>`` the worker entry point).
+- ``input``: what the bot waits for (see INPUT_TYPES).
+- ``output``: how the result is sent back to Telegram (see OUTPUT_TYPES).
+- ``endpoint``: the server route, defaults to the tool key.
+- ``params``: optional request parameters passed on to the tool, which
+  validates them.
+- ``cost`` / ``heavy`` / ``timeout`` / ``cache``: rate limiting, admission,
+  HTTP timeout and result caching options.
+- ``prompt`` / ``progress`` / ``error`` / ``filename``: the bot's texts and the
+  default name of the returned file.
+
+The bot generates its conversation states and generic handlers from this,
+and the server generates its tool routes and job table.
+"""
+
+import json
+
+# Input type -> what the bot accepts for it
+INPUT_TYPES = ('photo', 'video', 'zip', 'url', 'text', 'files', 'crop', 'link')
+OUTPUT_TYPES = ('photo', 'video', 'audio', 'document', 'link')
+
+# Inputs sent to the server as a single uploaded file
+FILE_INPUTS = ('photo', 'video', 'zip', 'crop')
+
+
+class ToolSpec:
+    """The declaration of one tool, read from its tools.json entry."""
+
+    def __init__(self, key, category, info):
+        self.key = key
+        self.category = category
+        self.name = info["name"]
+        self.desc = info["desc"]
+        self.module = info.get("module")
+        self.input = info.get("input")
+        self.output = info.get("output")
+        self.endpoint = info.get("endpoint", key)
+        self.params = tuple(info.get("params", ()))
+        self.cost = info.get("cost", 1)
+        self.heavy = info.get("heavy", False)
+        self.timeout = info.get("timeout")
+        self.cache = info.get("cache", True)
+        self.prompt = info.get("prompt")
+        self.progress = info.get("progress")
+        self.error = info.get("error")
+        self.filename = info.get("filename")
+        if self.input is not None and self.input not in INPUT_TYPES:
+            raise ValueError(f"Tool {key}: unknown input type {self.input}")
+        if self.output is not None and self.output not in OUTPUT_TYPES:
+            raise ValueError(f"Tool {key}: unknown output type {self.output}")
+
+    @property
+    def runnable(self):
+        """True if the tool is implemented by a tools/ module and has a server route."""
+        return self.module is not None and self.input != 'link'
+
+
+def build_registry(tools):
+    """Returns {tool_key: ToolSpec} for a parsed tools.json."""
+    registry = {}
+    for category_key, category_data in tools.items():
+        for tool_key, info in category_data["tools"].items():
+            registry[tool_key] = ToolSpec(tool_key, category_key, info)
+    return registry
+
+
+def load_registry(path='tools.json'):
+    """Reads tools.json and returns its registry."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return build_registry(json.load(f))
+
+
+_registry = None
+
+def get_spec(tool_key):
+    """Returns the ToolSpec for a tool in this process, or None for unregistered tools."""
+    global _registry
+    if _registry is None:
+        _registry = load_registry()
+    return _registry.get(tool_key)
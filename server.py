@@ -6,9 +6,15 @@ This server provides the backend functionality for the Telegram bot.
 It handles requests from the bot to process images, videos, and other files.
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, send_file
+from werkzeug.utils import secure_filename
+from werkzeug.datastructures import FileStorage
 import os
-from tools import image, video, file as file_tools, other
+from tools import cache, loader
+from tools.workspace import unique_path
+from registry import load_registry, FILE_INPUTS
+from jobs import JobManager, JobQueueFull, JOB_TOOLS, DONE, FAILED
+from config import JOB_WORKERS, JOB_MAX_PENDING, JOB_TTL, REMBG_PRELOAD, TOOLS_PRELOAD
 import logging
 import traceback
 
@@ -24,6 +30,18 @@ if not os.path.exists(STATIC_FOLDER):
     os.makedirs(STATIC_FOLDER)
 
 app.config['UPLOAD_FOLDER'] = STATIC_FOLDER
+# Per-request scratch directories, see tools/workspace.py
+app.config['WORKSPACE_FOLDER'] = os.path.join(STATIC_FOLDER, 'work')
+
+job_manager = JobManager(os.path.join(STATIC_FOLDER, 'jobs'), max_workers=JOB_WORKERS,
+                         max_pending=JOB_MAX_PENDING, ttl=JOB_TTL,
+                         initializer=loader.warm_up_rembg if REMBG_PRELOAD else None)
+
+REGISTRY = load_registry()
+# Input types of the job tools that are not in tools.json
+EXTRA_INPUT_TYPES = {'remove_bg_batch': 'files', 'preview_crop': 'crop', 'generate_qr_bulk': 'text'}
+# Extra endpoints that take the parameters of a registered tool
+EXTRA_TOOL_PARAMS = {'generate_qr_bulk': 'generate_qr'}
 
 @app.errorhandler(Exception)
 def handle_exception(e):
@@ -32,6 +50,39 @@ def handle_exception(e):
     app.logger.error(traceback.format_exc())
     return jsonify({"error": "An internal server error occurred. The error has been logged."}), 500
 
+def get_request_value(name):
+    """Reads a value from the JSON body or the form data."""
+    data = request.get_json(silent=True) or {}
+    return data.get(name, request.form.get(name, request.args.get(name)))
+
+def get_upload():
+    """
+    Returns the uploaded file: the multipart "file" field or, for any other
+    content type, the raw request body named by the "filename" query
+    parameter. A raw body is read straight from the connection, never spooled to disk.
+    """
+    if 'file' in request.files:
+        return request.files['file']
+    if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded', 'application/json') \
+            or request.content_length == 0:
+        return FileStorage(filename='')
+    return FileStorage(stream=request.stream, filename=request.args.get('filename', 'upload'),
+                       content_type=request.mimetype)
+
+def get_crop_box():
+    """Reads the crop box coordinates from the request."""
+    return {key: float(get_request_value(key)) for key in ('left', 'top', 'right', 'bottom')}
+
+def get_tool_params(tool):
+    """Reads the optional parameters a tool declares in tools.json; the tool validates them."""
+    spec = REGISTRY.get(EXTRA_TOOL_PARAMS.get(tool, tool))
+    params = {}
+    for name in (spec.params if spec else ()):
+        value = get_request_value(name)
+        if value not in (None, ''):
+            params[name] = value
+    return params
+
 @app.route('/')
 def index():
     """Returns a simple greeting message."""
@@ -42,7 +93,150 @@ def game():
     """Serves the snake game."""
     return send_from_directory(os.path.join(app.config['UPLOAD_FOLDER'], 'game'), 'index.html')
 
+@app.route('/startup')
+def startup():
+    """Returns the startup timings: module imports, warm-up phases and whether they finished."""
+    return jsonify(loader.report())
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Returns the result cache hit/miss counters and sizes."""
+    return jsonify(cache.stats())
+
+# --- Synchronous tool routes ---
+
+def read_tool_arguments(spec):
+    """Reads the arguments of a tool's Flask helper for its declared input type and parameters."""
+    kwargs = get_tool_params(spec.key)
+    if spec.input == 'files':
+        return [request.files.getlist('files')], kwargs
+    if spec.input in ('url', 'text'):
+        return [get_request_value(spec.input)], kwargs
+    if spec.input == 'crop':
+        kwargs.update(get_crop_box())
+    return [get_upload()], kwargs
+
+def make_tool_view(spec):
+    """Builds the POST view for a registered tool; its module is imported on first use."""
+    module_name = f"tools.{spec.module}"
+
+    def view():
+        helper = getattr(loader.load(module_name), spec.key)
+        args, kwargs = read_tool_arguments(spec)
+        return helper(app, *args, **kwargs)
+    return view
+
+for spec in REGISTRY.values():
+    if spec.runnable:
+        app.add_url_rule(f"/{spec.endpoint}", endpoint=spec.key, view_func=make_tool_view(spec), methods=['POST'])
+
+# Endpoints that are not tools in the bot's menu
+
+@app.route('/remove_bg_batch', methods=['POST'])
+def remove_bg_batch():
+    return loader.load('tools.image').remove_bg_batch(app, request.files.getlist('files'))
+
+@app.route('/unzip_file/list', methods=['POST'])
+def list_zip():
+    return loader.load('tools.file').list_zip(app, get_upload())
+
+@app.route('/generate_qr/bulk', methods=['POST'])
+def generate_qr_bulk():
+    return loader.load('tools.other').generate_qr_bulk(app, get_upload(), get_request_value('text'),
+                                                      **get_tool_params('generate_qr_bulk'))
+
+@app.route('/preview_crop', methods=['POST'])
+def preview_crop():
+    return loader.load('tools.image').preview_crop(app, get_request_value('filepath'), **get_crop_box())
+
+# --- Job API ---
+
+def save_upload(file, work_dir):
+    """Saves an uploaded file into a job directory and returns its path."""
+    path = unique_path(work_dir, secure_filename(file.filename) or 'upload')
+    file.save(path)
+    return path
+
+def prepare_job_input(tool, work_dir):
+    """Builds the (source, params) pair for a job from the current request."""
+    input_type = REGISTRY[tool].input if tool in REGISTRY else EXTRA_INPUT_TYPES[tool]
+    params = get_tool_params(tool)
+    if input_type == 'crop':
+        params.update(get_crop_box())
+    if input_type in FILE_INPUTS:
+        file = get_upload()
+        if file.filename == '':
+            return None, "No selected file"
+        return save_upload(file, work_dir), params
+    if input_type == 'files':
+        files = [f for f in request.files.getlist('files') if f.filename]
+        if not files:
+            return None, "No selected files"
+        return [save_upload(f, work_dir) for f in files], params
+    if input_type == 'url':
+        url = get_request_value('url')
+        return (url, params) if url else (None, "No URL provided")
+    text = get_request_value('text')
+    return (text, params) if text else (None, "No text provided")
+
+@app.route('/jobs/<tool>', methods=['POST'])
+def submit_job(tool):
+    """Queues a tool run on the worker pool and returns its job id."""
+    if tool not in JOB_TOOLS:
+        return jsonify({"error": f"Unknown tool: {tool}"}), 404
+    try:
+        job = job_manager.create(tool)
+    except JobQueueFull:
+        return jsonify({"error": "Server is busy, try again later."}), 503
+
+    try:
+        source, params = prepare_job_input(tool, job.work_dir)
+    except (TypeError, ValueError):
+        source, params = None, "Invalid crop dimensions"
+    if source is None:
+        job_manager.discard(job)
+        return jsonify({"error": params}), 400
+
+    job_manager.start(job, source, params)
+    return jsonify(job.to_dict()), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Returns the current state of a job."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Sends the output file of a finished job."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job.status == FAILED:
+        return jsonify({"error": job.error}), getattr(job.future.exception(), 'status_code', 500)
+    if job.status != DONE:
+        return jsonify(job.to_dict()), 409
+    return send_file(os.path.abspath(job.result_path), as_attachment=True)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancels a queued or running job."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if not job_manager.cancel(job_id):
+        return jsonify({"error": "Job is already finished", **job.to_dict()}), 409
+    return jsonify({**job.to_dict(), "cancel_requested": True}), 202
+
 
 if __name__ == '__main__':
     from config import SERVER_HOST, SERVER_PORT
-    app.run(host=SERVER_HOST, port=SERVER_PORT)
+    loader.mark('app ready')
+    if TOOLS_PRELOAD or REMBG_PRELOAD:
+        # The routes are served while the tool modules (and the rembg session
+        # used by the synchronous /remove_bg route) load in the background.
+        modules = sorted({f"tools.{spec.module}" for spec in REGISTRY.values() if spec.runnable})
+        loader.warm_up(modules if TOOLS_PRELOAD else [], rembg=REMBG_PRELOAD)
+    app.run(host=SERVER_HOST, port=SERVER_PORT, threaded=True)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent storage for the bot's user data.
+
+UsageLog records tool usage events in append-only JSON Lines segments.
+Events are buffered and written in batches, segments rotate by size, and
+history is only read back lazily, so the cost of logging one event does not
+depend on how much history exists.
+
+FavoritesStore keeps favorites in memory and writes them behind: changes are
+coalesced and persisted on a timer or after a number of changes, as an atomic
+snapshot (temp file + rename) taken under a file lock. Reads reload the
+snapshot when another process has replaced it, and writes re-read it under the
+lock and apply only this process's own changes, so several processes can share
+one file.
+"""
+
+import contextlib
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; snapshots are still atomic.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class UsageLog:
+    """Append-only, batched log of tool usage events."""
+
+    def __init__(self, directory, segment_max_bytes=16 * 1024 * 1024, batch_size=50, flush_interval=5):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._timer = None
+        os.makedirs(directory, exist_ok=True)
+        self._segment = self._latest_segment() or self._new_segment_path()
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'usage-*.jsonl')))
+
+    def _latest_segment(self):
+        segments = self._segments()
+        return segments[-1] if segments else None
+
+    def _new_segment_path(self):
+        now = time.time_ns()
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now / 1e9))
+        return os.path.join(self.directory, f"usage-{stamp}-{now % 10**9:09d}.jsonl")
+
+    def log(self, user_id, tool_key, timestamp):
+        """Buffers one usage event; it is written with the next batch."""
+        event = {"user_id": str(user_id), "tool": tool_key, "timestamp": timestamp}
+        with self._lock:
+            self._buffer.append(json.dumps(event, ensure_ascii=False))
+            if len(self._buffer) >= self.batch_size:
+                self._flush_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Writes all buffered events to the current segment."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buffer:
+            return
+        try:
+            if os.path.exists(self._segment) and os.path.getsize(self._segment) >= self.segment_max_bytes:
+                self._segment = self._new_segment_path()
+            with open(self._segment, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(self._buffer) + '\n')
+            self._buffer = []
+        except OSError as e:
+            logger.error(f"Could not write usage log: {e}")
+
+    def iter_events(self, user_id=None):
+        """Yields logged events, oldest first, reading one segment at a time."""
+        self.flush()
+        user_id = str(user_id) if user_id is not None else None
+        for segment in self._segments():
+            with open(segment, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if user_id is None or event["user_id"] == user_id:
+                        yield event
+
+    def import_json(self, path):
+        """Moves events from the legacy user_logs.json file into the log."""
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+        with self._lock:
+            for user_id, entries in legacy.items():
+                for entry in entries:
+                    event = {"user_id": user_id, "tool": entry["tool"], "timestamp": entry["timestamp"]}
+                    self._buffer.append(json.dumps(event, ensure_ascii=False))
+            self._flush_locked()
+        os.replace(path, path + '.migrated')
+        logger.info(f"Imported legacy usage log {path}")
+
+
+class FavoritesStore:
+    """In-memory favorites index with write-behind, atomic snapshots."""
+
+    def __init__(self, path, flush_interval=5, dirty_threshold=20):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.dirty_threshold = dirty_threshold
+        self._favorites = {}
+        self._versions = {}
+        # user_id -> {tool_key: added}: this process's changes not yet written.
+        self._pending = {}
+        self._dirty_count = 0
+        self._snapshot_id = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        self._refresh()
+
+    def _stat_snapshot(self):
+        """Identifies the snapshot on disk; it changes whenever a process replaces it."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive):
+        with open(self.path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _refresh(self):
+        """Reloads the snapshot if another process has replaced it since it was last read."""
+        if self._stat_snapshot() == self._snapshot_id:
+            return
+        with self._file_lock(exclusive=False):
+            snapshot_id = self._stat_snapshot()
+            on_disk = self._read_snapshot()
+        with self._lock:
+            self._merge_locked(on_disk)
+            self._snapshot_id = snapshot_id
+
+    def _merge_locked(self, on_disk):
+        """Replaces the in-memory favorites with on_disk plus the changes not yet written."""
+        # Users absent from the snapshot have no favorites.
+        for user_id in set(on_disk) | set(self._favorites):
+            tools = list(on_disk.get(user_id, []))
+            for tool_key, added in self._pending.get(user_id, {}).items():
+                if added and tool_key not in tools:
+                    tools.append(tool_key)
+                elif not added and tool_key in tools:
+                    tools.remove(tool_key)
+            if self._favorites.get(user_id, []) != tools:
+                self._favorites[user_id] = tools
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def get(self, user_id):
+        """Returns the user's favorite tool keys, in the order they were added."""
+        self._refresh()
+        return tuple(self._favorites.get(str(user_id), ()))
+
+    def version(self, user_id):
+        """A counter that changes every time the user's favorites change."""
+        self._refresh()
+        return self._versions.get(str(user_id), 0)
+
+    def toggle(self, user_id, tool_key):
+        """Adds or removes a favorite. Returns True if the tool is now a favorite."""
+        user_id = str(user_id)
+        self._refresh()
+        with self._lock:
+            tools = self._favorites.setdefault(user_id, [])
+            if tool_key in tools:
+                tools.remove(tool_key)
+                added = False
+            else:
+                tools.append(tool_key)
+                added = True
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._pending.setdefault(user_id, {})[tool_key] = added
+            self._dirty_count += 1
+            self._schedule_locked()
+        return added
+
+    def _schedule_locked(self):
+        if self._timer is not None and self._dirty_count < self.dirty_threshold:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        # Flushing always happens off the caller's thread, so toggles stay O(1).
+        delay = 0 if self._dirty_count >= self.dirty_threshold else self.flush_interval
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """
+        Writes a snapshot. The file is re-read under the lock and only this
+        process's own changes are applied to it, per user and per tool, so
+        changes other processes made in the meantime are kept.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._pending:
+                    return
+                self._dirty_count = 0
+            try:
+                written = self._write_snapshot()
+            except OSError as e:
+                logger.error(f"Could not save favorites: {e}")
+                return
+            with self._lock:
+                # Changes made while the snapshot was written stay pending.
+                for user_id, changes in written.items():
+                    remaining = self._pending.get(user_id, {})
+                    for tool_key, added in changes.items():
+                        if remaining.get(tool_key) == added:
+                            del remaining[tool_key]
+                    if not remaining:
+                        self._pending.pop(user_id, None)
+
+    def _write_snapshot(self):
+        """Writes the snapshot on disk plus the pending changes; returns the changes written."""
+        with self._file_lock(exclusive=True):
+            on_disk = self._read_snapshot()
+            with self._lock:
+                self._merge_locked(on_disk)
+                written = {user_id: dict(changes) for user_id, changes in self._pending.items()}
+                snapshot = {user_id: list(tools) for user_id, tools in self._favorites.items() if tools}
+
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(prefix='.favorites-', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, indent=4, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self._snapshot_id = self._stat_snapshot()
+        return written
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures: a Flask test client whose workspaces and result cache live
+in a temporary directory.
+"""
+
+from collections import OrderedDict
+import pytest
+
+import config
+import server
+from tools import cache
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(cache, '_memory', OrderedDict())
+    monkeypatch.setitem(server.app.config, 'WORKSPACE_FOLDER', str(tmp_path / 'work'))
+    server.app.config['TESTING'] = True
+    return server.app.test_client()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Tests for the hot-reloadable tool catalog."""
+
+import json
+import os
+
+from catalog import ToolCatalog
+
+
+def tools_json(name):
+    return {"file_tools": {"name": "Files", "tools": {
+        "zip_file": {"name": name, "desc": "Zips files.", "module": "file", "input": "files", "output": "document"},
+    }}}
+
+
+def write(path, data, mtime):
+    path.write_text(data if isinstance(data, str) else json.dumps(data), encoding='utf-8')
+    os.utime(path, (mtime, mtime))
+
+
+def test_catalog_reloads_when_tools_json_changes(tmp_path):
+    path = tmp_path / 'tools.json'
+    write(path, tools_json('Zip'), 1000)
+    catalog = ToolCatalog(str(path), check_interval=0)
+    builds = []
+    assert catalog.keyboard('main', lambda: builds.append(1) or 'first') == 'first'
+    catalog.refresh()
+    assert catalog.keyboard('main', lambda: 'unused') == 'first'
+
+    write(path, tools_json('Zip it'), 2000)
+    version = catalog.version
+    assert catalog.keyboard('main', lambda: 'second') == 'second'
+    assert catalog.version == version + 1
+    assert catalog.tool('zip_file')['name'] == 'Zip it'
+    assert builds == [1]
+
+
+def test_catalog_keeps_the_last_good_version_on_a_bad_edit(tmp_path):
+    path = tmp_path / 'tools.json'
+    write(path, tools_json('Zip'), 1000)
+    catalog = ToolCatalog(str(path), check_interval=0)
+    version = catalog.version
+
+    write(path, '{"file_tools": {', 2000)
+    catalog.refresh()
+    assert catalog.version == version
+    assert catalog.tool('zip_file')['name'] == 'Zip'
+
+    bad_input = tools_json('Zip')
+    bad_input['file_tools']['tools']['zip_file']['input'] = 'carrier pigeon'
+    write(path, bad_input, 3000)
+    catalog.refresh()
+    assert catalog.spec('zip_file').input == 'files'
+
+    # Once the edit is fixed, it is picked up.
+    write(path, tools_json('Zip it'), 4000)
+    catalog.refresh()
+    assert catalog.tool('zip_file')['name'] == 'Zip it'
+
+
+def test_catalog_checks_the_file_at_most_every_interval(tmp_path):
+    path = tmp_path / 'tools.json'
+    write(path, tools_json('Zip'), 1000)
+    catalog = ToolCatalog(str(path), check_interval=3600)
+    catalog.refresh()
+    write(path, tools_json('Zip it'), 2000)
+    catalog.refresh()
+    assert catalog.tool('zip_file')['name'] == 'Zip'
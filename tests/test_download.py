@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Tests for download_video's format choice."""
+
+import pytest
+
+video = pytest.importorskip('tools.video')
+
+MB = 1024 * 1024
+
+
+def fmt(format_id, size=None, height=None, vcodec=None, acodec=None, ext='mp4', **fields):
+    result = dict(format_id=format_id, filesize=size, height=height, ext=ext, **fields)
+    if vcodec is not None:
+        result['vcodec'] = vcodec
+    if acodec is not None:
+        result['acodec'] = acodec
+    return result
+
+
+def test_formats_without_codec_fields_count_as_combined():
+    info = {'formats': [fmt('360', 1 * MB, 360), fmt('720', 3 * MB, 720), fmt('1080', 80 * MB, 1080)]}
+    assert video.choose_format(info, 50 * MB) == '720'
+
+
+def test_prefers_the_highest_fitting_resolution():
+    info = {'formats': [
+        fmt('18', 10 * MB, 360, 'avc1', 'mp4a'),
+        fmt('137', 30 * MB, 1080, 'avc1', 'none'),
+        fmt('136', 15 * MB, 720, 'avc1', 'none'),
+        fmt('140', 4 * MB, None, 'none', 'mp4a', ext='m4a', abr=128),
+        fmt('251', 5 * MB, None, 'none', 'opus', ext='webm', abr=160),
+    ]}
+    assert video.choose_format(info, 40 * MB) == '137+251'
+    assert video.choose_format(info, 19 * MB) == '136+140'
+    assert video.choose_format(info, 12 * MB) == '18'
+    assert video.choose_format(info, 1 * MB) is None
+
+
+def test_audio_only_picks_the_best_fitting_audio():
+    info = {'formats': [
+        fmt('18', 10 * MB, 360, 'avc1', 'mp4a'),
+        fmt('140', 4 * MB, None, 'none', 'mp4a', ext='m4a', abr=128),
+        fmt('251', 5 * MB, None, 'none', 'opus', ext='webm', abr=160),
+    ]}
+    assert video.choose_format(info, 50 * MB, audio_only=True) == '251'
+    assert video.choose_format(info, 4 * MB, audio_only=True) == '140'
+
+
+def test_sizes_are_estimated_from_the_bitrate():
+    info = {'duration': 60, 'formats': [fmt('hd', height=720, tbr=4000), fmt('sd', height=360, tbr=1000)]}
+    # 4000 kbit/s for a minute is 30 MB, 1000 kbit/s 7.5 MB.
+    assert video.choose_format(info, 20 * MB) == 'sd'
+
+
+def test_unknown_sizes_get_the_best_format_under_the_height_cap():
+    info = {'formats': [fmt('720', height=720), fmt('1080', height=1080)]}
+    assert video.choose_format(info, 50 * MB) is None
+    assert video.unknown_size_format(False, 720) == 'best[height<=720]/bestvideo[height<=720]+bestaudio/best'
+    assert video.unknown_size_format(True, 720) == 'bestaudio/best'
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Tests for the single-flight download cache."""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+import pytest
+
+import config
+from tools import ToolError, download_cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DOWNLOAD_CACHE_DIR', str(tmp_path / 'downloads'))
+    monkeypatch.setattr(config, 'DOWNLOAD_CACHE_TTL', 60)
+    monkeypatch.setattr(config, 'DOWNLOAD_CACHE_MAX_BYTES', 1024 * 1024)
+    monkeypatch.setattr(config, 'DOWNLOAD_CACHE_ERROR_TTL', 60)
+    return tmp_path / 'downloads'
+
+
+def downloader(calls, data=b'video', delay=0):
+    def download(tmp_dir):
+        calls.append(tmp_dir)
+        time.sleep(delay)
+        path = os.path.join(tmp_dir, 'video.mp4')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+    return download
+
+
+def fetch(tmp_path, name, key, download):
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    return download_cache.fetch(key, str(output_dir), download)
+
+
+def test_concurrent_requests_share_one_download(cache_dir, tmp_path):
+    calls = []
+    download = downloader(calls, delay=0.5)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        paths = list(executor.map(lambda i: fetch(tmp_path, f'out{i}', 'youtube:abc', download), range(4)))
+    assert len(calls) == 1
+    assert [open(path, 'rb').read() for path in paths] == [b'video'] * 4
+    assert os.listdir(cache_dir / 'locks') == []
+
+
+def test_different_keys_do_not_wait_for_each_other(cache_dir, tmp_path):
+    other_done = threading.Event()
+
+    def slow_download(tmp_dir):
+        # Only finishes once the other key's download is done.
+        assert other_done.wait(timeout=10)
+        return downloader([])(tmp_dir)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        slow = executor.submit(fetch, tmp_path, 'slow', 'youtube:slow', slow_download)
+        time.sleep(0.2)
+        # The two keys' hashes agree modulo 256: locks are per key, not per hash bucket.
+        fetch(tmp_path, 'fast', 'youtube:fast286', downloader([]))
+        other_done.set()
+        assert open(slow.result(timeout=10), 'rb').read() == b'video'
+
+
+def test_failures_are_remembered_for_the_error_ttl(cache_dir, tmp_path, monkeypatch):
+    calls = []
+
+    def failing_download(tmp_dir):
+        calls.append(tmp_dir)
+        raise ToolError("Video unavailable", 404)
+
+    for name in ('first', 'second'):
+        with pytest.raises(ToolError) as error:
+            fetch(tmp_path, name, 'youtube:gone', failing_download)
+        assert error.value.status_code == 404
+    assert len(calls) == 1
+
+    monkeypatch.setattr(config, 'DOWNLOAD_CACHE_ERROR_TTL', 0)
+    with pytest.raises(ToolError):
+        fetch(tmp_path, 'third', 'youtube:gone', failing_download)
+    assert len(calls) == 2
+
+
+def test_entries_expire_and_are_evicted_least_recently_used_first(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DOWNLOAD_CACHE_MAX_BYTES', 2500)
+    calls = []
+    for name, key in (('a', 'youtube:a'), ('b', 'youtube:b'), ('a2', 'youtube:a'), ('c', 'youtube:c')):
+        fetch(tmp_path, name, key, downloader(calls, data=b'x' * 1000))
+        time.sleep(0.05)
+    # youtube:a was used again after youtube:b, so b is evicted when c makes it too large.
+    assert len(calls) == 3
+    fetch(tmp_path, 'b2', 'youtube:b', downloader(calls, data=b'x' * 1000))
+    fetch(tmp_path, 'c2', 'youtube:c', downloader(calls, data=b'x' * 1000))
+    assert len(calls) == 4
+
+    monkeypatch.setattr(config, 'DOWNLOAD_CACHE_TTL', 0)
+    fetch(tmp_path, 'c3', 'youtube:c', downloader(calls, data=b'x' * 1000))
+    assert len(calls) == 5
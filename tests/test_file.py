@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Tests for the file tool routes."""
+
+import io
+import zipfile
+import pytest
+
+
+def test_zip_file_route_streams_the_uploads(client):
+    big = b'hello world ' * 100000  # spooled to a temporary file by the form parser
+    data = {'files': [(io.BytesIO(big), 'notes.txt'), (io.BytesIO(b'\xff\xd8 not really a jpeg'), 'photo.jpg')]}
+    response = client.post('/zip_file', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.testzip() is None
+    assert archive.read('notes.txt') == big
+    assert archive.getinfo('notes.txt').compress_type == zipfile.ZIP_DEFLATED
+    assert archive.getinfo('photo.jpg').compress_type == zipfile.ZIP_STORED
+
+
+def test_zip_file_route_keeps_same_named_uploads_apart(client):
+    data = {'files': [(io.BytesIO(b'first'), 'a.txt'), (io.BytesIO(b'second'), 'a.txt'), (io.BytesIO(b'third'), 'a.txt')]}
+    response = client.post('/zip_file', data=data, content_type='multipart/form-data')
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == ['a.txt', '1_a.txt', '2_a.txt']
+    assert [archive.read(name) for name in archive.namelist()] == [b'first', b'second', b'third']
+
+
+def test_zip_file_route_without_files(client):
+    response = client.post('/zip_file', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def test_unzip_file_route_returns_a_chosen_member(client):
+    upload = make_zip({'a.txt': b'first', 'b.txt': b'second'})
+    response = client.post('/unzip_file', data={'file': (upload, 'files.zip'), 'members': 'b.txt'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.data == b'second'
+
+
+def test_unzip_file_list_route(client):
+    upload = make_zip({'a.txt': b'first', 'dir/b.txt': b'second'})
+    response = client.post('/unzip_file/list', data={'file': (upload, 'files.zip')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert [member['name'] for member in response.get_json()['members']] == ['a.txt', 'dir/b.txt']
+
+
+def test_unzip_file_route_rejects_zip_bombs(client):
+    upload = make_zip({'zeros.txt': b'\0' * (8 * 1024 * 1024)})
+    response = client.post('/unzip_file', data={'file': (upload, 'files.zip')}, content_type='multipart/form-data')
+    assert response.status_code == 413
+
+
+@pytest.mark.parametrize('members, status', [('["a.txt"', 400), ('[1, 2]', 400), ('c.txt', 404)])
+def test_unzip_file_route_rejects_bad_member_lists(client, members, status):
+    upload = make_zip({'a.txt': b'first', 'b.txt': b'second'})
+    response = client.post('/unzip_file', data={'file': (upload, 'files.zip'), 'members': members},
+                           content_type='multipart/form-data')
+    assert response.status_code == status
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Tests for the image tool routes."""
+
+from PIL import Image
+import config
+import io
+import pytest
+import zipfile
+
+
+def make_image(size=(100, 80), color='blue', format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format=format)
+    buffer.seek(0)
+    return buffer
+
+
+def test_crop_image_route(client):
+    data = {'file': (make_image(), 'photo.png'), 'left': '10', 'top': '10', 'right': '60', 'bottom': '50'}
+    response = client.post('/crop_image', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert Image.open(io.BytesIO(response.data)).size == (50, 40)
+
+
+def test_crop_image_route_is_cached(client):
+    for _ in range(2):
+        data = {'file': (make_image(), 'photo.png'), 'left': '0', 'top': '0', 'right': '20', 'bottom': '30'}
+        response = client.post('/crop_image', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert Image.open(io.BytesIO(response.data)).size == (20, 30)
+    assert client.get('/cache/stats').get_json()['memory_hits'] >= 1
+
+
+@pytest.mark.parametrize('names', [('first.png', 'second.png'), ('e.png', 'photo.png'), ('c.png', 'crop.png')])
+def test_cached_crop_is_named_after_the_current_upload(client, names):
+    for name in names:
+        data = {'file': (make_image(), name), 'left': '0', 'top': '0', 'right': '20', 'bottom': '30'}
+        response = client.post('/crop_image', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert f"cropped_{name}" in response.headers['Content-Disposition']
+
+
+def test_remove_bg_batch_keeps_results_with_the_same_stem_apart(client, monkeypatch):
+    from tools import sessions
+    monkeypatch.setattr(sessions, 'remove_batch', lambda images: [img.convert('RGBA') for img in images])
+    data = {'files': [(make_image(color='red'), 'a.png'), (make_image(color='blue', format='JPEG'), 'a.jpg')]}
+    response = client.post('/remove_bg_batch', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == ['removed_bg_a.png', '1_removed_bg_a.png']
+    colors = [Image.open(archive.open(name)).getpixel((0, 0))[:3] for name in archive.namelist()]
+    assert colors[0] == (255, 0, 0) and colors[1][2] > 200
+
+
+def test_preview_crop_route(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CROP_FOLDER', str(tmp_path / 'crop'))
+    (tmp_path / 'crop').mkdir()
+    path = tmp_path / 'crop' / 'photo.jpg'
+    path.write_bytes(make_image(format='JPEG').getvalue())
+    data = {'filepath': str(path), 'left': 0, 'top': 0, 'right': 50, 'bottom': 40}
+    response = client.post('/preview_crop', json=data)
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+
+
+def test_preview_crop_route_rejects_other_paths(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CROP_FOLDER', str(tmp_path / 'crop'))
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(make_image(format='JPEG').getvalue())
+    for filepath in (str(path), str(tmp_path / 'crop' / '..' / 'photo.jpg')):
+        data = {'filepath': filepath, 'left': 0, 'top': 0, 'right': 50, 'bottom': 40}
+        assert client.post('/preview_crop', json=data).status_code == 403
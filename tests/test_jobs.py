@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Tests for the job engine and its routes."""
+
+from PIL import Image
+import io
+import os
+import time
+import pytest
+
+import server
+from jobs import DONE, JobManager
+
+
+def failing_warm_up():
+    raise RuntimeError("model download failed")
+
+
+def slow_warm_up():
+    time.sleep(2)
+
+
+def make_manager(tmp_path, monkeypatch, initializer=None):
+    manager = JobManager(str(tmp_path / 'jobs'), max_workers=1, initializer=initializer)
+    monkeypatch.setattr(server, 'job_manager', manager)
+    return manager
+
+
+@pytest.fixture
+def jobs(client, tmp_path, monkeypatch):
+    manager = make_manager(tmp_path, monkeypatch)
+    yield client
+    manager.shutdown()
+
+
+def wait(client, job_id):
+    for _ in range(300):
+        state = client.get(f'/jobs/{job_id}').get_json()
+        if state['status'] not in ('queued', 'running'):
+            return state
+        time.sleep(0.1)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def make_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (100, 80), 'blue').save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def test_failing_initializer_does_not_break_the_pool(tmp_path, monkeypatch):
+    manager = make_manager(tmp_path, monkeypatch, initializer=failing_warm_up)
+    try:
+        for _ in range(2):
+            job = manager.start(manager.create('generate_qr'), 'hello')
+            path = job.future.result(timeout=60)
+            assert job.status == DONE
+            assert os.path.basename(path) == 'qr_code.png'
+    finally:
+        manager.shutdown()
+
+
+def test_submit_status_and_result(jobs):
+    response = jobs.post('/jobs/generate_qr', json={'text': 'hello', 'format': 'svg'})
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    state = wait(jobs, job_id)
+    assert state['status'] == 'done'
+    assert state['progress'] == 1.0
+    result = jobs.get(f'/jobs/{job_id}/result')
+    assert result.status_code == 200
+    assert result.data.startswith(b'<?xml')
+
+
+def test_failed_job_reports_its_error(jobs):
+    job_id = jobs.post('/jobs/generate_qr', json={'text': 'hello', 'box_size': '0'}).get_json()['job_id']
+    state = wait(jobs, job_id)
+    assert state['status'] == 'failed'
+    assert 'box_size' in state['error']
+    assert jobs.get(f'/jobs/{job_id}/result').status_code == 400
+
+
+def test_job_workers_share_the_cache_counters(jobs):
+    def lookups():
+        stats = jobs.get('/cache/stats').get_json()
+        return stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+
+    before = lookups()
+    for _ in range(2):
+        data = {'file': (make_image(), 'photo.png'), 'left': '0', 'top': '0', 'right': '20', 'bottom': '30'}
+        job_id = jobs.post('/jobs/crop_image', data=data, content_type='multipart/form-data').get_json()['job_id']
+        assert wait(jobs, job_id)['status'] == 'done'
+    assert lookups() == before + 2
+
+
+def test_cancel_job(client, tmp_path, monkeypatch):
+    manager = make_manager(tmp_path, monkeypatch, initializer=slow_warm_up)
+    try:
+        text = "\n".join(f"code {i}" for i in range(50))
+        job_id = client.post('/jobs/generate_qr_bulk', json={'text': text}).get_json()['job_id']
+        response = client.delete(f'/jobs/{job_id}')
+        assert response.status_code == 202
+        assert wait(client, job_id)['status'] == 'cancelled'
+        assert client.delete(f'/jobs/{job_id}').status_code == 409
+    finally:
+        manager.shutdown()
+
+
+def test_unknown_job_and_tool(jobs):
+    assert jobs.post('/jobs/no_such_tool', json={'text': 'x'}).status_code == 404
+    assert jobs.post('/jobs/generate_qr', json={}).status_code == 400
+    for response in (jobs.get('/jobs/0123'), jobs.get('/jobs/0123/result'), jobs.delete('/jobs/0123')):
+        assert response.status_code == 404
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Tests for the QR code routes."""
+
+import io
+import multiprocessing
+import zipfile
+import pytest
+
+from tools import other
+
+
+def test_generate_qr_route(client):
+    response = client.post('/generate_qr', json={'text': 'https://example.com'})
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+
+
+def test_generate_qr_route_svg(client):
+    response = client.post('/generate_qr', json={'text': 'https://example.com', 'format': 'svg'})
+    assert response.status_code == 200
+    assert response.mimetype == 'image/svg+xml'
+    assert b'<svg' in response.data
+
+
+@pytest.mark.parametrize('params', [{'box_size': 0}, {'box_size': 'big'}, {'format': 'gif'},
+                                    {'error_correction': 'X'}])
+def test_generate_qr_route_rejects_bad_parameters(client, params):
+    response = client.post('/generate_qr', json=dict(params, text='hello'))
+    assert response.status_code == 400
+
+
+def test_generate_qr_bulk_route(client):
+    text = "\n".join(f"https://example.com/ticket/{i},guest {i}" for i in range(40))
+    response = client.post('/generate_qr/bulk', json={'text': text, 'format': 'svg'})
+    assert response.status_code == 200
+    names = zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+    assert len(names) == 40
+    assert names[0] == '0001_guest_0.svg'
+
+
+def test_bulk_jobs_render_in_process(monkeypatch):
+    monkeypatch.setattr(multiprocessing, 'parent_process', lambda: object())
+    assert other._get_pool() is None
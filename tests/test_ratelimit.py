@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Tests for the per-user rate limiter and the heavy-job admission limit."""
+
+from types import SimpleNamespace
+import asyncio
+import os
+import pytest
+
+import ratelimit
+from catalog import ToolCatalog
+from ratelimit import AdmissionLimit, RateLimiter
+
+TOOLS_JSON = os.path.join(os.path.dirname(__file__), '..', 'tools.json')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake monotonic clock for ratelimit; advance it by setting clock.now."""
+    fake = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(monotonic=lambda: fake.now))
+    return fake
+
+
+def test_token_bucket_refills_over_time(clock):
+    limiter = RateLimiter(capacity=3, refill_rate=0.5)
+    assert [limiter.acquire(1) for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire(1) == pytest.approx(2)
+    clock.now += 1
+    assert limiter.acquire(1) == pytest.approx(1)
+    clock.now += 2
+    assert limiter.acquire(1) == 0
+    # Other users have their own bucket.
+    assert limiter.acquire(2) == 0
+
+
+def test_token_bucket_does_not_refill_past_capacity(clock):
+    limiter = RateLimiter(capacity=2, refill_rate=1)
+    clock.now += 100
+    assert [limiter.acquire(1) for _ in range(2)] == [0, 0]
+    assert limiter.acquire(1) > 0
+
+
+def test_tools_are_charged_their_cost_from_tools_json(clock):
+    catalog = ToolCatalog(TOOLS_JSON)
+    cost = catalog.spec('upscale_4k').cost
+    assert cost > 1
+    limiter = RateLimiter(capacity=cost, refill_rate=1)
+    assert limiter.acquire(1, cost) == 0
+    assert limiter.acquire(1, cost) == pytest.approx(cost)
+    # A cheap action only waits for its own cost.
+    assert limiter.acquire(1, 1) == pytest.approx(1)
+
+
+def test_idle_buckets_are_dropped(clock):
+    limiter = RateLimiter(capacity=1, refill_rate=1, idle_ttl=10)
+    limiter.acquire(1)
+    limiter.acquire(2)
+    clock.now += 11
+    limiter.acquire(3)
+    assert len(limiter) == 1
+
+
+def test_admission_limit_caps_jobs_in_flight(clock):
+    limit = AdmissionLimit(2)
+    first, second = limit.try_acquire(), limit.try_acquire()
+    assert first is not None and second is not None
+    assert limit.try_acquire() is None
+    clock.now += 4
+    limit.release(first)
+    assert limit.try_acquire() is not None
+    # Releasing twice must not free a second slot.
+    limit.release(first)
+    assert limit.try_acquire() is None
+    assert limit.retry_after() == 1
+
+
+def test_admission_is_released_when_the_handler_fails(monkeypatch):
+    pytest.importorskip('telegram')
+    import bot
+
+    limit = AdmissionLimit(1)
+    monkeypatch.setattr(bot, 'HEAVY_ADMISSION', limit)
+    update = SimpleNamespace()
+    context = SimpleNamespace(user_data={'selected_tool': 'upscale_4k'})
+
+    @bot.admission_controlled
+    async def failing(update, context):
+        raise RuntimeError("tool failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(failing(update, context))
+    assert limit.try_acquire() is not None
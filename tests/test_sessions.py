@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Tests for the batched background removal."""
+
+from PIL import Image
+import numpy as np
+import pytest
+
+rembg = pytest.importorskip('rembg')
+from tools import sessions
+
+
+def load_session(model):
+    try:
+        return sessions.get_session(model)
+    except Exception as e:
+        pytest.skip(f"{model} model unavailable: {e}")
+
+
+def make_photo(size, offset):
+    img = Image.new('RGB', size, (230, 230, 230))
+    img.paste((200, 40, 40), (offset, offset, size[0] - offset, size[1] - offset))
+    return img
+
+
+@pytest.mark.parametrize('model', ['u2netp', 'isnet'])
+def test_remove_batch_matches_remove(model):
+    session = load_session(model)
+    images = [make_photo((160, 120), 30), make_photo((90, 140), 20)]
+    expected = [rembg.remove(img, session=session) for img in images]
+    for result, reference in zip(sessions.remove_batch(images, model, batch_size=2), expected):
+        assert result.size == reference.size
+        difference = np.abs(np.asarray(result.getchannel('A'), dtype=int) - np.asarray(reference.getchannel('A'), dtype=int))
+        assert difference.max() <= 2
+
+
+class FakeInput:
+
+    def __init__(self, batch):
+        self.name = 'input'
+        self.shape = [batch, 3, 8, 8]
+
+
+class FakeSession:
+    """Returns every image's mean pixel as its mask and records the batch sizes run."""
+
+    def __init__(self, batch):
+        self.batches = []
+        self.inner_session = self
+        self._input = FakeInput(batch)
+
+    def get_inputs(self):
+        return [self._input]
+
+    def normalize(self, img, mean, std, size):
+        return {'input': np.full((1, 3, 8, 8), np.asarray(img).mean(), dtype=np.float32)}
+
+    def run(self, outputs, feed):
+        batch = feed['input']
+        if isinstance(self._input.shape[0], int):
+            assert len(batch) == self._input.shape[0]
+        self.batches.append(len(batch))
+        return [batch[:, :1]]
+
+
+@pytest.mark.parametrize('batch, runs', [('batch_size', [3]), (1, [1, 1, 1])])
+def test_run_batch_follows_the_model_batch_dimension(batch, runs):
+    session = FakeSession(batch)
+    images = [Image.new('RGB', (8, 8), (value,) * 3) for value in (10, 20, 30)]
+    masks = sessions._run_batch(session, images, None, None, (8, 8))
+    assert session.batches == runs
+    assert [mask[0, 0] for mask in masks] == [10, 20, 30]
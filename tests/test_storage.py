@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Tests for the bot's persistent storage."""
+
+import json
+import multiprocessing
+import os
+
+from storage import FavoritesStore, UsageLog
+
+
+def stores(tmp_path, count=2):
+    """Stores sharing one file, as separate processes would."""
+    path = str(tmp_path / 'favorites.json')
+    return [FavoritesStore(path, flush_interval=60, dirty_threshold=1000) for _ in range(count)]
+
+
+def toggle_in_process(path, user_id, tool_key):
+    store = FavoritesStore(path, flush_interval=60, dirty_threshold=1000)
+    store.toggle(user_id, tool_key)
+    store.flush()
+
+
+def test_favorites_survive_a_restart(tmp_path):
+    first, = stores(tmp_path, 1)
+    first.toggle(1, 'zip_file')
+    first.toggle(1, 'crop_image')
+    first.flush()
+    assert FavoritesStore(first.path).get(1) == ('zip_file', 'crop_image')
+
+
+def test_favorites_reload_changes_from_another_process(tmp_path):
+    first, second = stores(tmp_path)
+    assert second.get(1) == ()
+    version = second.version(1)
+    first.toggle(1, 'zip_file')
+    first.flush()
+    assert second.get(1) == ('zip_file',)
+    assert second.version(1) != version
+
+
+def test_concurrent_edits_to_the_same_user_are_merged(tmp_path):
+    first, second = stores(tmp_path)
+    first.toggle(1, 'zip_file')
+    second.toggle(1, 'crop_image')
+    first.flush()
+    second.flush()
+    assert FavoritesStore(first.path).get(1) == ('zip_file', 'crop_image')
+    assert first.get(1) == ('zip_file', 'crop_image')
+
+
+def test_removals_from_another_process_are_kept(tmp_path):
+    first, second = stores(tmp_path)
+    first.toggle(1, 'zip_file')
+    first.toggle(1, 'crop_image')
+    first.flush()
+    second.toggle(1, 'zip_file')
+    first.toggle(2, 'generate_qr')
+    second.flush()
+    first.flush()
+    with open(first.path, encoding='utf-8') as f:
+        assert json.load(f) == {'1': ['crop_image'], '2': ['generate_qr']}
+
+
+def test_pending_changes_survive_a_reload(tmp_path):
+    first, second = stores(tmp_path)
+    first.toggle(1, 'zip_file')
+    second.toggle(2, 'crop_image')
+    second.flush()
+    # The reload of second's snapshot must not drop first's unwritten change.
+    assert first.get(1) == ('zip_file',)
+    assert first.get(2) == ('crop_image',)
+
+
+def test_favorites_are_shared_between_real_processes(tmp_path):
+    store, = stores(tmp_path, 1)
+    store.toggle(1, 'zip_file')
+    store.flush()
+    context = multiprocessing.get_context('spawn')
+    process = context.Process(target=toggle_in_process, args=(store.path, 1, 'crop_image'))
+    process.start()
+    process.join(60)
+    assert process.exitcode == 0
+    assert store.get(1) == ('zip_file', 'crop_image')
+
+
+def test_usage_log_appends_in_batches(tmp_path):
+    log = UsageLog(str(tmp_path / 'logs'), batch_size=3, flush_interval=60)
+    log.log(1, 'zip_file', 100)
+    log.log(2, 'crop_image', 101)
+    assert os.listdir(tmp_path / 'logs') == []
+    log.log(1, 'generate_qr', 102)
+    segment, = os.listdir(tmp_path / 'logs')
+    with open(tmp_path / 'logs' / segment, encoding='utf-8') as f:
+        assert len(f.readlines()) == 3
+    assert [e['tool'] for e in log.iter_events(user_id=1)] == ['zip_file', 'generate_qr']
+
+
+def test_usage_log_rotates_segments_by_size(tmp_path):
+    log = UsageLog(str(tmp_path / 'logs'), segment_max_bytes=100, batch_size=1, flush_interval=60)
+    for timestamp in range(10):
+        log.log(1, 'zip_file', timestamp)
+    segments = sorted(os.listdir(tmp_path / 'logs'))
+    assert len(segments) > 1
+    assert all(os.path.getsize(tmp_path / 'logs' / s) < 200 for s in segments)
+    assert [e['timestamp'] for e in log.iter_events()] == list(range(10))
+    # A restarted log keeps appending to the newest segment.
+    assert UsageLog(str(tmp_path / 'logs'))._segment.endswith(segments[-1])
+
+
+def test_usage_log_imports_the_legacy_file(tmp_path):
+    legacy = tmp_path / 'user_logs.json'
+    legacy.write_text(json.dumps({'7': [{'tool': 'zip_file', 'timestamp': 5}]}), encoding='utf-8')
+    log = UsageLog(str(tmp_path / 'logs'))
+    log.import_json(str(legacy))
+    assert list(log.iter_events()) == [{'user_id': '7', 'tool': 'zip_file', 'timestamp': 5}]
+    assert not legacy.exists()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""Tests for the upscaling pipeline, with the model replaced by a plain x4 resize."""
+
+from PIL import Image
+import pytest
+
+from tools import upscale
+
+
+@pytest.fixture
+def model_inputs(monkeypatch):
+    inputs = []
+
+    def fake_model(img):
+        inputs.append(img.size)
+        return img.resize((img.width * 4, img.height * 4))
+
+    monkeypatch.setattr(upscale, 'resolve_backend', lambda: 'onnx')
+    monkeypatch.setattr(upscale, '_upscale_onnx', fake_model)
+    return inputs
+
+
+@pytest.mark.parametrize('size, model_input', [((2000, 1000), (960, 480)), ((800, 600), (800, 600))])
+def test_upscale_shrinks_the_input_to_the_target_over_the_model_scale(tmp_path, model_inputs, size, model_input):
+    path = tmp_path / 'photo.png'
+    Image.new('RGBA', size, (10, 20, 30, 128)).save(path)
+    result = upscale.upscale(str(path), 3840)
+    assert model_inputs == [model_input]
+    assert max(result.size) == 3840
+    assert result.mode == 'RGBA'
+    assert result.getpixel((0, 0))[3] == 128
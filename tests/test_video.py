@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Tests for the video tools; skipped where ffmpeg is not installed."""
+
+import io
+import os
+import shutil
+import subprocess
+import numpy as np
+import pytest
+
+import config
+from tools import ToolError
+
+video = pytest.importorskip('tools.video')
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+
+
+def make_video(path, faststart=True):
+    args = ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc=size=160x120:rate=10',
+            '-f', 'lavfi', '-i', 'sine=frequency=440', '-t', '3', '-c:v', 'mpeg4', '-c:a', 'aac']
+    if faststart:
+        args += ['-movflags', '+faststart']
+    subprocess.run(args + [str(path)], check=True)
+    return path
+
+
+class FailingStream(io.BytesIO):
+    """An upload whose reads fail half way through."""
+
+    def read(self, size=-1):
+        if self.tell() > len(self.getbuffer()) // 2:
+            raise OSError("connection reset")
+        return super().read(min(size, 4096) if size and size > 0 else 4096)
+
+
+def test_to_mp3_route_streams_mp3(client, tmp_path):
+    path = make_video(tmp_path / 'clip.mp4')
+    with open(path, 'rb') as f:
+        response = client.post('/to_mp3', data={'file': (f, 'clip.mp4')}, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'audio/mpeg'
+    assert 'clip.mp3' in response.headers['Content-Disposition']
+    assert len(response.data) > 10000
+
+
+def test_stream_mp3_aborts_when_the_upload_cannot_be_read(tmp_path):
+    data = make_video(tmp_path / 'clip.mp4').read_bytes()
+    # Either before the response starts or while it streams, never a truncated 200.
+    with pytest.raises(ToolError):
+        response = video.stream_mp3(FailingStream(data), 'clip.mp4')
+        for _ in response.response:
+            pass
+
+
+class PipeStream(io.RawIOBase):
+    """A non-seekable upload, like a raw request body."""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._data.read(size)
+
+
+@pytest.mark.parametrize('faststart', [True, False])
+@pytest.mark.parametrize('wrap', [io.BytesIO, PipeStream])
+def test_check_pipe_input_finds_the_moov_atom(tmp_path, faststart, wrap):
+    data = make_video(tmp_path / 'clip.mp4', faststart=faststart).read_bytes()
+    stream, needs_seeking = video.check_pipe_input(wrap(data))
+    assert needs_seeking is not faststart
+    # The whole upload can still be read afterwards.
+    assert stream.read() == data
+
+
+def test_check_pipe_input_ignores_other_formats():
+    stream, needs_seeking = video.check_pipe_input(PipeStream(b'\x1aE\xdf\xa3 matroska or anything else'))
+    assert not needs_seeking
+    assert stream.read() == b'\x1aE\xdf\xa3 matroska or anything else'
+
+
+@pytest.mark.skipif(shutil.which('ffprobe') is None, reason="ffprobe is not installed")
+def test_to_mp3_route_converts_videos_indexed_at_the_end(client, tmp_path, monkeypatch):
+    def no_pipe(*args, **kwargs):
+        raise AssertionError("moov-at-end uploads must not be piped")
+    monkeypatch.setattr(video, 'stream_mp3', no_pipe)
+    path = make_video(tmp_path / 'clip.mp4', faststart=False)
+    with open(path, 'rb') as f:
+        response = client.post('/to_mp3', data={'file': (f, 'clip.mp4')}, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert len(response.data) > 10000
+
+
+@pytest.mark.parametrize('params', [{'bitrate': 'fast'}, {'quality': 'best'}, {'quality': '12'}])
+def test_to_mp3_route_rejects_bad_parameters(client, params):
+    data = dict(params, file=(io.BytesIO(b'not checked'), 'clip.mp4'))
+    response = client.post('/to_mp3', data=data, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def test_to_mp3_works_without_ffprobe(client, tmp_path, monkeypatch):
+    path = make_video(tmp_path / 'clip.mp4')
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'ffmpeg').symlink_to(shutil.which('ffmpeg'))
+    monkeypatch.setenv('PATH', str(bin_dir))
+    assert video.probe_duration(str(path)) is None
+    output_path = video.process_to_mp3(str(path), str(tmp_path))
+    assert output_path.endswith('clip.mp3')
+    assert os.path.getsize(output_path) > 10000
+
+
+def decode(path):
+    pcm = subprocess.run(['ffmpeg', '-loglevel', 'error', '-i', str(path), '-f', 's16le', '-ac', '1', '-'],
+                         capture_output=True, check=True).stdout
+    return np.frombuffer(pcm, np.int16).astype(int)
+
+
+@pytest.mark.parametrize('sample_rate, channels', [(44100, 1), (48000, 2)])
+def test_segmented_mp3_is_gapless(client, tmp_path, monkeypatch, sample_rate, channels):
+    path = tmp_path / 'lecture.wav'
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate={sample_rate}',
+                    '-ac', str(channels), '-t', '9', str(path)], check=True)
+    monkeypatch.setattr(config, 'MP3_SEGMENT_THRESHOLD', 1)
+    monkeypatch.setattr(config, 'MP3_SEGMENT_SECONDS', 2)
+    monkeypatch.setattr(video, 'probe_duration', lambda input_path: 9.0)
+    monkeypatch.setattr(video, 'probe_sample_rate', lambda input_path: sample_rate)
+    encoded, encode_segment = [], video._encode_segment
+    monkeypatch.setattr(video, '_encode_segment', lambda *args: encoded.append(args) or encode_segment(*args))
+
+    output_path = video.process_to_mp3(str(path), str(tmp_path))
+    assert len(encoded) == 5
+    samples, reference = decode(output_path), decode(path)
+    # 9.00 s in, 9.00 s out: no encoder delay or padding at the joins.
+    assert len(samples) == len(reference) == 9 * sample_rate
+    assert np.abs(samples - reference).max() < 200
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""Tests for the per-request workspaces."""
+
+from werkzeug.datastructures import FileStorage
+import io
+import os
+
+from tools.workspace import Workspace
+
+
+def test_same_named_uploads_do_not_overwrite_each_other(tmp_path):
+    with Workspace(str(tmp_path)) as workspace:
+        paths = [workspace.save(FileStorage(io.BytesIO(data), filename='photo.jpg')) for data in (b'a', b'b', b'c')]
+        assert [os.path.basename(p) for p in paths] == ['photo.jpg', '1_photo.jpg', '2_photo.jpg']
+        assert [open(p, 'rb').read() for p in paths] == [b'a', b'b', b'c']
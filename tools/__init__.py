@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+Tool backends for the Telegram bot.
+
+Each tool module exposes two layers:
+- ``process_<tool>(source, output_dir, **params)``: the actual work. It takes
+  a path (or URL/text), writes its result into ``output_dir`` and returns the
+  output path. It has no Flask dependency so it can run in worker processes.
+- ``<tool>(app, ...)``: the Flask view helper used by ``server.py``.
+"""
+
+
+class ToolError(Exception):
+    """Raised by a tool when the input cannot be processed."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+    def __reduce__(self):
+        # Keep the status code when the error crosses a process boundary.
+        return (ToolError, (self.message, self.status_code))
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming ZIP writer.
+
+``stream`` yields a ZIP archive chunk by chunk, so a response can start
+before the last member has been compressed and no archive file is written.
+The compression is picked per member: formats that are already compressed
+(JPEG, PNG, MP4, ZIP, ...) are stored, everything else is deflated at
+ZIP_COMPRESS_LEVEL. Members are compressed ahead of the writer on a thread
+pool (zlib releases the GIL), each into a buffer that spills to disk above
+ZIP_SPOOL_SIZE, and are written in their original order. Archives or
+members above 4 GiB get ZIP64 records.
+
+Members of an existing archive can be copied with ``copy_members``: their
+compressed bytes are passed through as they are, without being inflated and
+deflated again.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+
+CHUNK_SIZE = 1024 * 1024
+
+# Extensions whose contents deflate gains nothing on
+STORED_EXTENSIONS = frozenset((
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'avif',
+    'mp4', 'mkv', 'webm', 'mov', 'avi', 'm4v',
+    'mp3', 'm4a', 'aac', 'ogg', 'opus', 'flac',
+    'zip', 'gz', 'tgz', 'bz2', 'xz', '7z', 'rar', 'zst',
+    'docx', 'xlsx', 'pptx', 'apk', 'jar', 'epub',
+))
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+UTF8_FLAG = 0x800
+LOCAL_HEADER_SIZE = 30
+# "Version needed to extract" per compression method
+METHOD_VERSIONS = {zipfile.ZIP_STORED: 20, zipfile.ZIP_DEFLATED: 20, zipfile.ZIP_BZIP2: 46, zipfile.ZIP_LZMA: 63}
+
+
+def compression_for(name):
+    """Returns ZIP_STORED for already-compressed formats and ZIP_DEFLATED otherwise."""
+    extension = os.path.splitext(name)[1].lstrip('.').lower()
+    return zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+class _Member:
+    """A member ready to be written: its checksum, sizes and (compressed) data."""
+
+    def __init__(self, name, method, crc, size, compressed_size, data):
+        self.name = name
+        self.method = method
+        self.crc = crc
+        self.size = size
+        self.compressed_size = compressed_size
+        self.data = data
+
+
+def _prepare(name, source, level, spool_size):
+    """Reads source (a seekable binary file) and returns it as a _Member."""
+    source.seek(0)
+    crc, size = 0, 0
+    if compression_for(name) == zipfile.ZIP_STORED:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+        source.seek(0)
+        return _Member(name, zipfile.ZIP_STORED, crc, size, size, source)
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        data.write(compressor.compress(chunk))
+    data.write(compressor.flush())
+    compressed_size = data.tell()
+    if compressed_size >= size:
+        # Deflate did not help (random data, unknown compressed formats): store it.
+        data.close()
+        source.seek(0)
+        return _Member(name, zipfile.ZIP_STORED, crc, size, size, source)
+    data.seek(0)
+    return _Member(name, zipfile.ZIP_DEFLATED, crc, size, compressed_size, data)
+
+
+class _Slice:
+    """Reads `length` bytes of a file from `offset`, as a file object of its own."""
+
+    def __init__(self, f, offset, length):
+        self._f = f
+        self._position = offset
+        self._left = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self._left:
+            size = self._left
+        self._f.seek(self._position)
+        data = self._f.read(size)
+        self._position += len(data)
+        self._left -= len(data)
+        return data
+
+
+def copy_members(f, infos):
+    """
+    Returns members for ``stream`` that copy the given ZipInfo entries of the
+    archive open as binary file f, still compressed.
+    """
+    members = []
+    for info in infos:
+        f.seek(info.header_offset)
+        header = f.read(LOCAL_HEADER_SIZE)
+        if len(header) != LOCAL_HEADER_SIZE or header[:4] != b'PK\x03\x04':
+            raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        data_offset = info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length
+        members.append(_Member(info.filename, info.compress_type, info.CRC, info.file_size, info.compress_size,
+                               _Slice(f, data_offset, info.compress_size)))
+    return members
+
+
+def _dos_time(timestamp):
+    """Returns the (time, date) pair of a timestamp in MS-DOS format."""
+    t = time.localtime(timestamp)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((max(t.tm_year, 1980) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def _local_header(member, dos_time, dos_date):
+    name = member.name
+    zip64 = member.size > ZIP64_LIMIT or member.compressed_size > ZIP64_LIMIT
+    extra = struct.pack('<HHQQ', 1, 16, member.size, member.compressed_size) if zip64 else b''
+    version = max(45 if zip64 else 20, METHOD_VERSIONS.get(member.method, 20))
+    flags = 0 if name.isascii() else UTF8_FLAG
+    return struct.pack('<IHHHHHIIIHH', 0x04034b50, version, flags, member.method,
+                       dos_time, dos_date, member.crc,
+                       ZIP64_LIMIT if zip64 else member.compressed_size,
+                       ZIP64_LIMIT if zip64 else member.size,
+                       len(name.encode('utf-8')), len(extra)) + name.encode('utf-8') + extra
+
+
+def _central_header(member, offset, dos_time, dos_date):
+    name = member.name
+    values = [member.size, member.compressed_size, offset]
+    extra_values = [value for value in values if value > ZIP64_LIMIT]
+    extra = struct.pack(f'<HH{len(extra_values)}Q', 1, 8 * len(extra_values), *extra_values) if extra_values else b''
+    size, compressed_size, offset = (min(value, ZIP64_LIMIT) for value in values)
+    version = max(45 if extra_values else 20, METHOD_VERSIONS.get(member.method, 20))
+    flags = 0 if name.isascii() else UTF8_FLAG
+    return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, flags, member.method,
+                       dos_time, dos_date, member.crc, compressed_size, size,
+                       len(name.encode('utf-8')), len(extra), 0, 0, 0, 0o100644 << 16, offset) \
+        + name.encode('utf-8') + extra
+
+
+def _end_records(count, directory_offset, directory_size):
+    records = b''
+    if count > ZIP64_COUNT_LIMIT or directory_offset > ZIP64_LIMIT or directory_size > ZIP64_LIMIT:
+        zip64_offset = directory_offset + directory_size
+        records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                               count, count, directory_size, directory_offset)
+        records += struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1)
+    return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0,
+                                 min(count, ZIP64_COUNT_LIMIT), min(count, ZIP64_COUNT_LIMIT),
+                                 min(directory_size, ZIP64_LIMIT), min(directory_offset, ZIP64_LIMIT), 0)
+
+
+def stream(members, on_member=None):
+    """
+    Yields a ZIP archive of members, given as (name, seekable binary file)
+    pairs or as returned by copy_members, in order. on_member(index, count)
+    is called after each member.
+    """
+    from config import ZIP_COMPRESS_LEVEL, ZIP_WORKERS, ZIP_SPOOL_SIZE
+    members = list(members)
+    workers = ZIP_WORKERS or os.cpu_count() or 1
+    dos_time, dos_date = _dos_time(time.time())
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zip')
+    pending = deque()
+    directory = []
+    offset = 0
+    try:
+        queued = iter(members)
+        for index in range(len(members)):
+            # Compresses at most two members per worker ahead of the writer.
+            while len(pending) < 2 * workers:
+                item = next(queued, None)
+                if item is None:
+                    break
+                if isinstance(item, _Member):
+                    future = Future()
+                    future.set_result(item)
+                else:
+                    future = executor.submit(_prepare, item[0], item[1], ZIP_COMPRESS_LEVEL, ZIP_SPOOL_SIZE)
+                pending.append(future)
+            member = pending.popleft().result()
+            header = _local_header(member, dos_time, dos_date)
+            directory.append(_central_header(member, offset, dos_time, dos_date))
+            yield header
+            for chunk in iter(lambda: member.data.read(CHUNK_SIZE), b''):
+                yield chunk
+            if isinstance(member.data, tempfile.SpooledTemporaryFile):
+                member.data.close()
+            offset += len(header) + member.compressed_size
+            if on_member is not None:
+                on_member(index + 1, len(members))
+
+        directory_size = sum(len(entry) for entry in directory)
+        yield b''.join(directory)
+        yield _end_records(len(directory), offset, directory_size)
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for future in pending:
+            if not future.cancelled() and future.exception() is None:
+                member = future.result()
+                if isinstance(member.data, tempfile.SpooledTemporaryFile):
+                    member.data.close()
+
+
+def write(path, members, on_member=None):
+    """Writes a ZIP archive of members to path."""
+    with open(path, 'wb') as f:
+        for chunk in stream(members, on_member):
+            f.write(chunk)
+    return path
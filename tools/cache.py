@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed result cache for the tool functions.
+
+Results are keyed on a hash of (tool name, input bytes or URL/text, parameters)
+so repeated inputs skip the model inference or ffmpeg run entirely. Small
+outputs are also kept in a per-process memory tier; everything is stored in a
+size-bounded disk tier shared by all processes and evicted least recently used
+first.
+"""
+
+from collections import OrderedDict
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import uuid
+
+from registry import get_spec
+
+logger = logging.getLogger(__name__)
+
+# Shared with the job workers through share_counters(), which the pool's
+# initializer calls; the workers are spawned, so they get the context too.
+_counters = {name: multiprocessing.get_context('spawn').Value('i', 0)
+             for name in ('memory_hits', 'disk_hits', 'misses')}
+
+# Stands for the input's file name in the names of cached outputs
+SOURCE_PLACEHOLDER = '{source}'
+
+_memory = OrderedDict()
+_memory_bytes = 0
+_memory_lock = threading.Lock()
+
+
+def _settings():
+    from config import CACHE_ENABLED, CACHE_DIR, CACHE_MAX_BYTES, CACHE_MEMORY_MAX_BYTES, CACHE_MEMORY_ITEM_MAX_BYTES
+    return CACHE_ENABLED, CACHE_DIR, CACHE_MAX_BYTES, CACHE_MEMORY_MAX_BYTES, CACHE_MEMORY_ITEM_MAX_BYTES
+
+
+def counters():
+    """Returns the hit/miss counters, to be passed to share_counters() in a worker process."""
+    return _counters
+
+
+def share_counters(shared):
+    """Counts this process' hits and misses on another process' counters."""
+    global _counters
+    _counters = shared
+
+
+def _count(name):
+    with _counters[name].get_lock():
+        _counters[name].value += 1
+
+
+def _hash_file(digest, path):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+
+def make_key(tool, source, params):
+    """Returns the cache key for a tool invocation."""
+    digest = hashlib.sha256(tool.encode('utf-8'))
+    if isinstance(source, (list, tuple)):
+        # Member names end up in the output (e.g. zip entries), so they are part of the key.
+        for path in source:
+            digest.update(os.path.basename(path).encode('utf-8'))
+            _hash_file(digest, path)
+    elif isinstance(source, str) and os.path.isfile(source):
+        _hash_file(digest, source)
+    else:
+        digest.update(str(source).encode('utf-8'))
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _entry_dir(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def _remember(key, name, data):
+    global _memory_bytes
+    _, _, _, memory_max, item_max = _settings()
+    if len(data) > item_max:
+        return
+    with _memory_lock:
+        if key in _memory:
+            return
+        _memory[key] = (name, data)
+        _memory_bytes += len(data)
+        while _memory_bytes > memory_max and _memory:
+            _, (_, evicted) = _memory.popitem(last=False)
+            _memory_bytes -= len(evicted)
+
+
+def lookup(key, output_dir):
+    """Copies a cached result into output_dir and returns its path, or None."""
+    with _memory_lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            _memory.move_to_end(key)
+    if entry is not None:
+        name, data = entry
+        output_path = os.path.join(output_dir, name)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        _count('memory_hits')
+        return output_path
+
+    _, cache_dir, _, _, _ = _settings()
+    entry_dir = _entry_dir(cache_dir, key)
+    try:
+        name = os.listdir(entry_dir)[0]
+    except (FileNotFoundError, IndexError):
+        return None
+
+    cached_path = os.path.join(entry_dir, name)
+    output_path = os.path.join(output_dir, name)
+    try:
+        shutil.copyfile(cached_path, output_path)
+        os.utime(entry_dir)
+    except FileNotFoundError:
+        # Evicted by another process in the meantime.
+        return None
+    _count('disk_hits')
+    with open(output_path, 'rb') as f:
+        data = f.read(_settings()[4] + 1)
+    _remember(key, name, data)
+    return output_path
+
+
+def store(key, output_path, name=None):
+    """Adds a tool's output file to the cache, stored as name (default: its own name)."""
+    _, cache_dir, max_bytes, _, item_max = _settings()
+    if not os.path.isfile(output_path):
+        return
+    entry_dir = _entry_dir(cache_dir, key)
+    tmp_dir = os.path.join(cache_dir, 'tmp', uuid.uuid4().hex)
+    os.makedirs(tmp_dir)
+    name = name or os.path.basename(output_path)
+    shutil.copyfile(output_path, os.path.join(tmp_dir, name))
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process stored the same result first.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if os.path.getsize(output_path) <= item_max:
+        with open(output_path, 'rb') as f:
+            _remember(key, name, f.read())
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir, max_bytes):
+    """Deletes least recently used entries until the disk tier fits max_bytes."""
+    entries = []
+    total = 0
+    for prefix in os.listdir(cache_dir):
+        if prefix == 'tmp':
+            continue
+        for key in os.listdir(os.path.join(cache_dir, prefix)):
+            entry_dir = os.path.join(cache_dir, prefix, key)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+                entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+            except FileNotFoundError:
+                continue
+            total += size
+
+    for _, size, entry_dir in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+
+
+def stats():
+    """Returns the hit/miss counters and the current size of both tiers."""
+    _, cache_dir, max_bytes, memory_max, _ = _settings()
+    disk_bytes = 0
+    for root, _, files in os.walk(cache_dir):
+        disk_bytes += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    result = {name: counter.value for name, counter in _counters.items()}
+    result.update({
+        "memory_bytes": _memory_bytes,
+        "memory_max_bytes": memory_max,
+        "disk_bytes": disk_bytes,
+        "disk_max_bytes": max_bytes,
+    })
+    return result
+
+
+def _source_stem(source):
+    """Returns the file name (without extension) of a single-file source, or None."""
+    if isinstance(source, str) and os.path.isfile(source):
+        return os.path.splitext(os.path.basename(source))[0] or None
+    return None
+
+
+def _cache_name(output_path, stem):
+    """
+    Returns the name to cache an output under. Outputs are named after their
+    input, which is not part of the key, so the input's name is replaced by a
+    placeholder that lookups fill in with the current input's name. Only a
+    name of the form "<stem>.<ext>" or "<prefix>_<stem>.<ext>" is treated as
+    named after the input, so a stem that also occurs in the prefix is left alone.
+    """
+    name = os.path.basename(output_path)
+    base, extension = os.path.splitext(name)
+    if stem and (base == stem or base.endswith('_' + stem)):
+        return base[:len(base) - len(stem)] + SOURCE_PLACEHOLDER + extension
+    return name
+
+
+def _restore_name(output_path, stem):
+    """Renames a cached output copied into place after the current input."""
+    name = os.path.basename(output_path)
+    if SOURCE_PLACEHOLDER not in name:
+        return output_path
+    restored = os.path.join(os.path.dirname(output_path), name.replace(SOURCE_PLACEHOLDER, stem or 'output'))
+    os.replace(output_path, restored)
+    return restored
+
+
+def cached(tool, version=None):
+    """Decorates a process_<tool> function with the result cache.
+
+    ``version`` is an optional callable returning extra key material, e.g. the
+    model name, so a configuration change does not serve stale results.
+    Tools declared with ``"cache": false`` in tools.json always run.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(source, output_dir, *args, **params):
+            if args:
+                # Keyed by parameter name, so positional and keyword calls share entries.
+                params = dict(list(signature.bind(source, output_dir, *args, **params).arguments.items())[2:])
+            enabled, cache_dir, _, _, _ = _settings()
+            spec = get_spec(tool)
+            if not enabled or (spec is not None and not spec.cache):
+                return function(source, output_dir, **params)
+
+            key_params = dict(params, _version=version()) if version else params
+            key = make_key(tool, source, key_params)
+            stem = _source_stem(source)
+            try:
+                output_path = lookup(key, output_dir)
+                if output_path is not None:
+                    return _restore_name(output_path, stem)
+            except OSError as e:
+                logger.error(f"Cache lookup failed for {tool}: {e}")
+
+            _count('misses')
+            output_path = function(source, output_dir, **params)
+            try:
+                store(key, output_path, _cache_name(output_path, stem))
+            except OSError as e:
+                logger.error(f"Cache store failed for {tool}: {e}")
+            return output_path
+        return wrapper
+    return decorator
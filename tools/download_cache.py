@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Single-flight, on-disk cache for downloads.
+
+Popular links are requested by many users within minutes. Downloads are keyed
+on a canonical id (e.g. the extractor's video id rather than the URL text), and
+a per-key file lock makes sure only one process downloads a given key at a
+time: everyone else waits for that download and then gets the same file,
+hard-linked into their own output directory. Downloads of different keys
+never wait for each other, and a key's lock file is removed once its
+download has been linked. Entries expire after a TTL and
+the cache is kept under a size bound, least recently used first. Failures are
+remembered briefly so waiters do not retry a broken link one after another.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from tools import ToolError, progress
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; downloads are then not deduplicated.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+META_FILE = 'meta.json'
+ERROR_FILE = 'error.json'
+
+
+def _settings():
+    from config import DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_TTL, DOWNLOAD_CACHE_MAX_BYTES, DOWNLOAD_CACHE_ERROR_TTL
+    return DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_TTL, DOWNLOAD_CACHE_MAX_BYTES, DOWNLOAD_CACHE_ERROR_TTL
+
+
+def _hash(key):
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _lookup(entry_dir, ttl):
+    """Returns the cached file of an entry, or None if it is missing or expired."""
+    try:
+        with open(os.path.join(entry_dir, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - meta['created_at'] > ttl:
+        return None
+    path = os.path.join(entry_dir, meta['filename'])
+    return path if os.path.isfile(path) else None
+
+
+def _check_error(entry_dir, error_ttl):
+    """Raises the error of a recent failed download of this entry, if any."""
+    try:
+        with open(entry_dir + '.' + ERROR_FILE, 'r', encoding='utf-8') as f:
+            error = json.load(f)
+    except (OSError, ValueError):
+        return
+    if time.time() - error['failed_at'] < error_ttl:
+        raise ToolError(error['message'], error['status_code'])
+
+
+def _link(path, output_dir):
+    """Hard-links (or copies) a cached file into output_dir and returns the new path."""
+    output_path = os.path.join(output_dir, os.path.basename(path))
+    try:
+        os.link(path, output_path)
+    except OSError:
+        shutil.copyfile(path, output_path)
+    # Marks the entry as recently used for eviction.
+    os.utime(os.path.dirname(path))
+    return output_path
+
+
+def _store(cache_dir, entry_dir, key, downloaded_path):
+    """Moves a finished download into the cache, replacing an expired entry; returns its path."""
+    staging = tempfile.mkdtemp(prefix='.entry-', dir=cache_dir)
+    filename = os.path.basename(downloaded_path)
+    shutil.move(downloaded_path, os.path.join(staging, filename))
+    with open(os.path.join(staging, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"key": key, "filename": filename, "created_at": time.time()}, f, ensure_ascii=False)
+    if os.path.exists(entry_dir):
+        shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(staging, entry_dir)
+    return os.path.join(entry_dir, filename)
+
+
+def _wait_for_lock(lock_file):
+    """Takes the exclusive lock, staying responsive to cancellation while waiting."""
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            progress.check()
+            time.sleep(0.2)
+
+
+def _lock(lock_path):
+    """
+    Opens and locks a key's lock file. The holder removes the file when it is
+    done, so a waiter may end up holding a lock on a file that is gone and
+    opens the current one again.
+    """
+    while True:
+        lock_file = open(lock_path, 'a')
+        try:
+            _wait_for_lock(lock_file)
+            try:
+                current = os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path))
+            except FileNotFoundError:
+                current = False
+        except BaseException:
+            lock_file.close()
+            raise
+        if current:
+            return lock_file
+        lock_file.close()
+
+
+def _unlock(lock_path, lock_file):
+    """Removes a key's lock file while still holding the lock, then releases it."""
+    try:
+        os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+    lock_file.close()
+
+
+def fetch(key, output_dir, download):
+    """
+    Returns the file cached for key, linked into output_dir. If it is missing
+    or expired, ``download(tmp_dir)`` is called to produce it, at most once at
+    a time per key across all processes.
+    """
+    cache_dir, ttl, _, error_ttl = _settings()
+    digest = _hash(key)
+    entry_dir = os.path.join(cache_dir, digest)
+    path = _lookup(entry_dir, ttl)
+    if path is not None:
+        return _link(path, output_dir)
+
+    lock_dir = os.path.join(cache_dir, 'locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_path = os.path.join(lock_dir, f"{digest}.lock")
+    lock_file = _lock(lock_path) if fcntl is not None else None
+    try:
+        # Whoever held the lock may have just downloaded it.
+        path = _lookup(entry_dir, ttl)
+        if path is None:
+            _check_error(entry_dir, error_ttl)
+            tmp_dir = tempfile.mkdtemp(prefix='.download-', dir=cache_dir)
+            try:
+                path = _store(cache_dir, entry_dir, key, download(tmp_dir))
+            except ToolError as e:
+                if not isinstance(e, progress.Cancelled):
+                    with open(entry_dir + '.' + ERROR_FILE, 'w', encoding='utf-8') as f:
+                        json.dump({"message": e.message, "status_code": e.status_code, "failed_at": time.time()}, f)
+                raise
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        output_path = _link(path, output_dir)
+    finally:
+        if lock_file is not None:
+            _unlock(lock_path, lock_file)
+    evict()
+    return output_path
+
+
+def evict():
+    """Removes expired entries, then the least recently used ones above the size bound."""
+    cache_dir, ttl, max_bytes, error_ttl = _settings()
+    now = time.time()
+    entries = []
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        if name.endswith('.' + ERROR_FILE):
+            if now - os.path.getmtime(path) > error_ttl:
+                os.remove(path)
+            continue
+        if name == 'locks' or name.startswith('.'):
+            continue
+        if _lookup(path, ttl) is None:
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
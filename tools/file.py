@@ -3,47 +3,158 @@
 File management tools for the Telegram bot.
 """
 
-from flask import jsonify, send_from_directory
+from contextlib import ExitStack
+from flask import Response, jsonify
+from tools import ToolError, archive, progress
+from tools.cache import cached
+from tools.workspace import Workspace, detach, unique_names
 from werkzeug.utils import secure_filename
+import json
 import zipfile
 import shutil
 import os
 
-def zip_file(app, files):
-    """Zips a list of files."""
-    if not files or files[0].filename == '':
-        return jsonify({"error": "No selected files"}), 400
+@cached('zip_file')
+def process_zip_file(input_paths, output_dir):
+    """Zips the files at input_paths into a single archive (see tools/archive.py)."""
+    zip_path = os.path.join(output_dir, "archive.zip")
+    with ExitStack() as stack:
+        members = [(os.path.basename(path), stack.enter_context(open(path, 'rb'))) for path in input_paths]
+        archive.write(zip_path, members, on_member=lambda done, total: progress.report(done / total, 'zip'))
+    return zip_path
 
-    zip_filename = "archive.zip"
-    zip_path = os.path.join(app.config['UPLOAD_FOLDER'], zip_filename)
+# Members smaller than this are not held to UNZIP_MAX_RATIO; short runs of text compress very well.
+RATIO_MIN_SIZE = 1024 * 1024
 
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for file in files:
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            zipf.write(file_path, filename)
-            os.remove(file_path)
+def _open_zip(zip_path):
+    try:
+        return zipfile.ZipFile(zip_path, 'r')
+    except (zipfile.BadZipFile, OSError):
+        raise ToolError("Please upload a zip file", 400)
 
-    return send_from_directory(app.config['UPLOAD_FOLDER'], zip_filename)
+def _ratio(info):
+    return round(info.file_size / info.compress_size, 1) if info.compress_size else None
 
-def unzip_file(app, file):
-    """Unzips a zip file."""
-    if file.filename == '' or not file.filename.endswith('.zip'):
-        return jsonify({"error": "Please upload a zip file"}), 400
+def list_members(zip_path):
+    """Lists an archive's members from its central directory, without inflating anything."""
+    with _open_zip(zip_path) as zip_ref:
+        infos = zip_ref.infolist()
+    members = [{"name": info.filename, "size": info.file_size, "compressed_size": info.compress_size,
+                "ratio": _ratio(info), "is_dir": info.is_dir()} for info in infos]
+    return {"count": len(members), "total_size": sum(info.file_size for info in infos), "members": members}
+
+def _parse_members(members):
+    """Accepts member names as a list, a JSON list or one name per line."""
+    if members in (None, ''):
+        return None
+    if isinstance(members, str):
+        if members.lstrip().startswith('['):
+            try:
+                members = json.loads(members)
+            except ValueError:
+                raise ToolError("members must be a JSON list or one name per line.", 400)
+        else:
+            members = members.splitlines()
+    if not isinstance(members, list) or not all(isinstance(name, str) for name in members):
+        raise ToolError("members must be a JSON list or one name per line.", 400)
+    return [name for name in members if name]
+
+def select_members(zip_ref, members=None):
+    """
+    Returns the ZipInfo of the requested members (all files by default),
+    rejecting the request before anything is inflated if they exceed
+    UNZIP_MAX_MEMBERS, UNZIP_MAX_BYTES in total or UNZIP_MAX_RATIO.
+    """
+    from config import UNZIP_MAX_MEMBERS, UNZIP_MAX_BYTES, UNZIP_MAX_RATIO
+    names = _parse_members(members)
+    files = [info for info in zip_ref.infolist() if not info.is_dir()]
+    if names is not None:
+        by_name = {info.filename: info for info in files}
+        missing = [name for name in names if name not in by_name]
+        if missing:
+            raise ToolError(f"Not in the archive: {', '.join(missing[:5])}", 404)
+        files = [by_name[name] for name in dict.fromkeys(names)]
+    if not files:
+        raise ToolError("The archive has no files.", 400)
+
+    if len(files) > UNZIP_MAX_MEMBERS:
+        raise ToolError(f"The archive has more than {UNZIP_MAX_MEMBERS} files.", 413)
+    if sum(info.file_size for info in files) > UNZIP_MAX_BYTES:
+        raise ToolError(f"The archive unpacks to more than {UNZIP_MAX_BYTES // (1024 * 1024)} MB.", 413)
+    for info in files:
+        if info.flag_bits & 0x1:
+            raise ToolError("Encrypted archives are not supported.", 400)
+        if info.file_size > RATIO_MIN_SIZE and (not info.compress_size or _ratio(info) > UNZIP_MAX_RATIO):
+            raise ToolError(f"{info.filename} is compressed suspiciously well (possible zip bomb).", 413)
+    return files
 
-    filename = secure_filename(file.filename)
-    zip_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(zip_path)
+@cached('unzip_file')
+def process_unzip_file(zip_path, output_dir, members=None):
+    """
+    Returns the requested members of the archive at zip_path (all files by
+    default): a single member is extracted on its own, several are copied
+    into a new archive still compressed, so nothing is inflated and deflated again.
+    """
+    with _open_zip(zip_path) as zip_ref:
+        files = select_members(zip_ref, members)
+        if len(files) == 1:
+            output_path = os.path.join(output_dir, os.path.basename(files[0].filename) or 'member')
+            with zip_ref.open(files[0]) as source, open(output_path, 'wb') as f:
+                shutil.copyfileobj(source, f, archive.CHUNK_SIZE)
+            return output_path
 
-    extract_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'unzipped_files')
-    if os.path.exists(extract_dir):
-        shutil.rmtree(extract_dir)
-    os.makedirs(extract_dir)
+        output_path = os.path.join(output_dir, 'unzipped_archive.zip')
+        with open(zip_path, 'rb') as f:
+            archive.write(output_path, archive.copy_members(f, files),
+                          on_member=lambda done, total: progress.report(done / total, 'unzip'))
+        return output_path
+
+def zip_file(app, files):
+    """Zips a list of files, streaming the archive straight from the uploads."""
+    files = [file for file in files if file.filename]
+    if not files:
+        return jsonify({"error": "No selected files"}), 400
+    names = unique_names([secure_filename(file.filename) or 'upload' for file in files])
+    members = [(name, detach(file)) for name, file in zip(names, files)]
+
+    def chunks():
+        try:
+            yield from archive.stream(members)
+        finally:
+            for _, stream in members:
+                stream.close()
+    return Response(chunks(), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename="archive.zip"'})
+
+def unzip_file(app, file, members=None):
+    """Unzips a zip file: streams the chosen members (all by default) without extracting the rest."""
+    if file.filename == '' or not file.filename.lower().endswith('.zip'):
+        return jsonify({"error": "Please upload a zip file"}), 400
+    with Workspace(app.config['WORKSPACE_FOLDER']) as workspace:
+        zip_path = workspace.save(file)
+        try:
+            with _open_zip(zip_path) as zip_ref:
+                files = select_members(zip_ref, members)
+        except ToolError as e:
+            return jsonify({"error": e.message}), e.status_code
 
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_dir)
+        if len(files) == 1:
+            def chunks():
+                with zipfile.ZipFile(zip_path) as zip_ref, zip_ref.open(files[0]) as source:
+                    yield from iter(lambda: source.read(archive.CHUNK_SIZE), b'')
+            return workspace.send_stream(chunks(), os.path.basename(files[0].filename) or 'member')
 
-    shutil.make_archive(os.path.join(app.config['UPLOAD_FOLDER'], 'unzipped_archive'), 'zip', extract_dir)
+        def chunks():
+            with open(zip_path, 'rb') as f:
+                yield from archive.stream(archive.copy_members(f, files))
+        return workspace.send_stream(chunks(), 'unzipped_archive.zip', mimetype='application/zip')
 
-    return send_from_directory(app.config['UPLOAD_FOLDER'], 'unzipped_archive.zip')
+def list_zip(app, file):
+    """Lists the members of a zip file (names, sizes, compression ratios) from its central directory."""
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+    with Workspace(app.config['WORKSPACE_FOLDER']) as workspace:
+        try:
+            return jsonify(list_members(workspace.save(file)))
+        except ToolError as e:
+            return jsonify({"error": e.message}), e.status_code
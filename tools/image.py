@@ -3,80 +3,132 @@
 Image processing tools for the Telegram bot.
 """
 
-from flask import jsonify, send_from_directory
-from werkzeug.utils import secure_filename
+from flask import jsonify, send_file
 from rembg import remove
 from PIL import Image
+from tools import ToolError, preview, sessions, upscale
+from tools.cache import cached
+from tools.workspace import Workspace, unique_path
+import io
 import os
-import subprocess
+import zipfile
+
+@cached('remove_bg', version=sessions.resolve_model)
+def process_remove_bg(input_path, output_dir):
+    """Removes the background from the image at input_path."""
+    output_path = os.path.join(output_dir, f"removed_bg_{os.path.basename(input_path)}")
+    with open(input_path, 'rb') as i:
+        with open(output_path, 'wb') as o:
+            input_data = i.read()
+            output_data = remove(input_data, session=sessions.get_session())
+            o.write(output_data)
+    return output_path
+
+@cached('remove_bg_batch', version=sessions.resolve_model)
+def process_remove_bg_batch(input_paths, output_dir):
+    """Removes the background from several images and zips the results."""
+    images = [Image.open(path) for path in input_paths]
+    results = sessions.remove_batch(images)
+
+    zip_path = os.path.join(output_dir, "removed_bg.zip")
+    with zipfile.ZipFile(zip_path, 'w') as zipf:
+        for path, result in zip(input_paths, results):
+            # a.jpg and a.png would both become removed_bg_a.png.
+            output_path = unique_path(output_dir, f"removed_bg_{os.path.splitext(os.path.basename(path))[0]}.png")
+            result.save(output_path)
+            zipf.write(output_path, os.path.basename(output_path))
+    return zip_path
+
+@cached('upscale_4k', version=upscale.cache_version)
+def process_upscale_4k(input_path, output_dir, target_size=None):
+    """Upscales the image at input_path with Real-ESRGAN to a longest side of target_size."""
+    from config import UPSCALE_TARGET_SIZE, UPSCALE_MAX_TARGET_SIZE
+    try:
+        target_size = int(target_size or UPSCALE_TARGET_SIZE)
+    except ValueError:
+        raise ToolError("Invalid target size.", 400)
+    if not 0 < target_size <= UPSCALE_MAX_TARGET_SIZE:
+        raise ToolError(f"Target size must be between 1 and {UPSCALE_MAX_TARGET_SIZE}.", 400)
+
+    result = upscale.upscale(input_path, target_size)
+    output_path = os.path.join(output_dir, f"upscaled_{os.path.splitext(os.path.basename(input_path))[0]}.png")
+    result.save(output_path)
+    return output_path
+
+def process_preview_crop(input_path, output_dir, left, top, right, bottom):
+    """Renders a low-resolution JPEG preview of the crop box on the image at input_path."""
+    # Not result-cached: hashing the full-resolution input would cost more
+    # than rendering from the decoded proxy (see tools/preview.py).
+    output_path = os.path.join(output_dir, f"preview_{os.path.splitext(os.path.basename(input_path))[0]}.jpg")
+    with open(output_path, 'wb') as f:
+        f.write(preview.render(input_path, left, top, right, bottom))
+    return output_path
+
+@cached('crop_image')
+def process_crop_image(input_path, output_dir, left, top, right, bottom):
+    """Crops the image at input_path with the given dimensions."""
+    img = Image.open(input_path)
+    cropped_img = img.crop((left, top, right, bottom))
+
+    output_path = os.path.join(output_dir, f"cropped_{os.path.basename(input_path)}")
+    cropped_img.save(output_path)
+    return output_path
 
 def remove_bg(app, file):
     """Removes the background from an image."""
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
-    if file:
-        filename = secure_filename(file.filename)
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(input_path)
-
-        output_filename = f"removed_bg_{filename}"
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-
-        with open(input_path, 'rb') as i:
-            with open(output_path, 'wb') as o:
-                input_data = i.read()
-                output_data = remove(input_data)
-                o.write(output_data)
-
-        return send_from_directory(app.config['UPLOAD_FOLDER'], output_filename)
-
-def upscale_4k(app, file):
-    """Upscales an image to 4K using Real-ESRGAN."""
+    with Workspace(app.config['WORKSPACE_FOLDER']) as workspace:
+        input_path = workspace.save(file)
+        output_path = process_remove_bg(input_path, workspace.path)
+        return workspace.send(output_path)
+
+def remove_bg_batch(app, files):
+    """Removes the background from a batch of images and returns a zip."""
+    if not files or files[0].filename == '':
+        return jsonify({"error": "No selected files"}), 400
+    with Workspace(app.config['WORKSPACE_FOLDER']) as workspace:
+        input_paths = [workspace.save(file) for file in files]
+        zip_path = process_remove_bg_batch(input_paths, workspace.path)
+        return workspace.send(zip_path)
+
+def upscale_4k(app, file, target_size=None):
+    """Upscales an image to 4K (or target_size) using Real-ESRGAN."""
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
-    if file:
-        filename = secure_filename(file.filename)
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(input_path)
-
-        output_filename = f"upscaled_{filename}"
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-
+    with Workspace(app.config['WORKSPACE_FOLDER']) as workspace:
+        input_path = workspace.save(file)
         try:
-            subprocess.run(['realesrgan-ncnn-vulkan', '-i', input_path, '-o', output_path], check=True)
-            return send_from_directory(app.config['UPLOAD_FOLDER'], output_filename)
-        except (subprocess.CalledProcessError, FileNotFoundError) as e:
-            return jsonify({"error": "Real-ESRGAN not found or failed to process image."}), 500
+            output_path = process_upscale_4k(input_path, workspace.path, target_size=target_size)
+        except ToolError as e:
+            return jsonify({"error": e.message}), e.status_code
+        return workspace.send(output_path)
+
+def _is_previewable(app, filepath):
+    """Whether filepath lies inside CROP_FOLDER or the workspace folder."""
+    from config import CROP_FOLDER
+    path = os.path.realpath(filepath)
+    for folder in (CROP_FOLDER, app.config['WORKSPACE_FOLDER']):
+        folder = os.path.realpath(folder)
+        if os.path.commonpath([path, folder]) == folder:
+            return True
+    return False
 
 def preview_crop(app, filepath, left, top, right, bottom):
     """Generates a preview of the cropped image."""
-    img = Image.open(filepath)
-    # Add a red border to the preview
-    preview_img = Image.new('RGB', img.size, (255, 0, 0))
-    preview_img.paste(img, (0, 0))
-
-    cropped_preview = preview_img.crop((left, top, right, bottom))
-
-    preview_filename = f"preview_{os.path.basename(filepath)}"
-    preview_path = os.path.join(app.config['UPLOAD_FOLDER'], preview_filename)
-    cropped_preview.save(preview_path)
-
-    return send_from_directory(app.config['UPLOAD_FOLDER'], preview_filename)
+    if filepath and not _is_previewable(app, filepath):
+        return jsonify({"error": "File not allowed"}), 403
+    if not filepath or not os.path.isfile(filepath):
+        return jsonify({"error": "File not found"}), 404
+    # Small enough to answer from memory, without a workspace on disk.
+    data = preview.render(filepath, left, top, right, bottom)
+    return send_file(io.BytesIO(data), mimetype='image/jpeg', download_name='preview.jpg')
 
 def crop_image(app, file, left, top, right, bottom):
     """Crops an image with the given dimensions."""
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
-    if file:
-        filename = secure_filename(file.filename)
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(input_path)
-
-        img = Image.open(input_path)
-        cropped_img = img.crop((left, top, right, bottom))
-
-        output_filename = f"cropped_{filename}"
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-        cropped_img.save(output_path)
-
-        return send_from_directory(app.config['UPLOAD_FOLDER'], output_filename)
+    with Workspace(app.config['WORKSPACE_FOLDER']) as workspace:
+        input_path = workspace.save(file)
+        output_path = process_crop_image(input_path, workspace.path, left, top, right, bottom)
+        return workspace.send(output_path)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Import-on-first-use for the heavy tool modules.
+
+tools.image pulls in rembg and onnxruntime, tools.video yt_dlp and ffmpeg, so
+importing them at startup makes every restart pay seconds of import time
+before the first request. ``load`` imports a module the first time it is
+needed and records how long that took; ``warm_up`` does the same for a list
+of modules on a background thread so the server answers right away while
+they load. ``report`` returns the recorded timings.
+"""
+
+from collections import OrderedDict
+import importlib
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_started = time.perf_counter()
+_timings = OrderedDict()
+_lock = threading.Lock()
+_ready = threading.Event()
+
+
+def _record(name, seconds):
+    with _lock:
+        _timings.setdefault(name, round(seconds, 3))
+
+
+def load(module_name):
+    """Returns the module, importing it on first use."""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _record(module_name, time.perf_counter() - started)
+    return module
+
+
+def mark(phase):
+    """Records the seconds from startup until a named phase, e.g. 'app ready'."""
+    _record(phase, time.perf_counter() - _started)
+
+
+def warm_up_rembg():
+    """Creates and warms the rembg session; also usable as a worker-process initializer."""
+    started = time.perf_counter()
+    load('tools.sessions').warm_up()
+    _record('rembg session', time.perf_counter() - started)
+
+
+def warm_up(module_names, rembg=False):
+    """Imports the modules (and optionally warms rembg) on a daemon thread."""
+    def run():
+        for module_name in module_names:
+            try:
+                load(module_name)
+            except Exception as e:
+                logger.error(f"Could not preload {module_name}: {e}")
+        if rembg:
+            try:
+                warm_up_rembg()
+            except Exception as e:
+                logger.error(f"Could not warm up rembg: {e}")
+        mark('warm-up done')
+        _ready.set()
+        logger.info(f"Startup timings: {report()}")
+
+    thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def report():
+    """Returns the startup timings and whether the background warm-up finished."""
+    with _lock:
+        timings = dict(_timings)
+    return {"ready": _ready.is_set(), "uptime": round(time.perf_counter() - _started, 3), "timings": timings}
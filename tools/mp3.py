@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+MPEG-1 Layer III frame helpers for joining separately encoded MP3 segments.
+
+An MP3 encoder delays its output by a few hundred samples and pads the last
+frame; the Xing/LAME header in front of the audio frames records both so
+decoders can trim them. Separately encoded segments carry that delay and
+padding at every boundary. To join them gaplessly, each segment is encoded
+from a frame-aligned position with some pre-roll and only the frames a single
+continuous encode would have produced are kept: ``split_frames`` cuts the
+encoded data into frames, ``read_info`` reads the delay and padding of a
+segment, and ``set_padding`` writes the joined stream's own values into the
+header of the final file.
+"""
+
+import struct
+
+FRAME_SAMPLES = 1152
+SAMPLE_RATES = (44100, 48000, 32000)
+# kbit/s by bitrate index
+BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+# Decoder delay the LAME padding field accounts for on top of the encoder delay
+DECODER_DELAY = 529
+
+XING_FLAGS = 0x0F  # frames, bytes, TOC and quality fields present
+LAME_TAG_OFFSET = 120  # from the Xing marker, past its four fields
+LAME_TAG_SIZE = 36
+
+
+def _crc16(data, crc=0):
+    """CRC-16/ARC, the checksum of the LAME tag."""
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def frame_length(header):
+    """Returns the length of the MPEG-1 Layer III frame with this 4-byte header, or None."""
+    value = struct.unpack('>I', header)[0]
+    # 11 sync bits, MPEG-1, Layer III; the CRC protection bit may be either.
+    if value & 0xFFFE0000 != 0xFFFA0000:
+        return None
+    bitrate_index, rate_index, padding = (value >> 12) & 15, (value >> 10) & 3, (value >> 9) & 1
+    if bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    return 144 * BITRATES[bitrate_index] * 1000 // SAMPLE_RATES[rate_index] + padding
+
+
+def split_frames(data, start=0):
+    """Returns the frames of MPEG-1 Layer III data from offset start, as a list of bytes."""
+    frames = []
+    position = start
+    while position + 4 <= len(data):
+        length = frame_length(data[position:position + 4])
+        if length is None or position + length > len(data):
+            raise ValueError(f"No MP3 frame at offset {position}")
+        frames.append(data[position:position + length])
+        position += length
+    return frames
+
+
+def first_frame_offset(data):
+    """Returns the offset of the first frame, past an ID3v2 tag if there is one."""
+    if data[:3] != b'ID3' or len(data) < 10:
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    # Flag 0x10: a 10-byte footer follows the tag.
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+
+def _xing_offset(frame):
+    """Returns the offset of the Xing/Info marker in a frame, or None if it has none."""
+    mono = (frame[3] >> 6) & 3 == 3
+    protected = not frame[1] & 1
+    offset = 4 + (17 if mono else 32) + (2 if protected else 0)
+    if frame[offset:offset + 4] not in (b'Xing', b'Info'):
+        return None
+    if struct.unpack('>I', frame[offset + 4:offset + 8])[0] & XING_FLAGS != XING_FLAGS:
+        return None
+    if len(frame) < offset + LAME_TAG_OFFSET + LAME_TAG_SIZE:
+        return None
+    return offset
+
+
+def read_info(frame):
+    """
+    Returns (audio frame count, encoder delay, padding) from the Xing/LAME
+    header frame, or None if frame is an audio frame.
+    """
+    offset = _xing_offset(frame)
+    if offset is None:
+        return None
+    frames = struct.unpack('>I', frame[offset + 8:offset + 12])[0]
+    packed = int.from_bytes(frame[offset + LAME_TAG_OFFSET + 21:offset + LAME_TAG_OFFSET + 24], 'big')
+    return frames, packed >> 12, packed & 0xFFF
+
+
+def set_padding(path, delay, padding):
+    """Writes the encoder delay and padding into the LAME tag of the MP3 file at path."""
+    with open(path, 'r+b') as f:
+        head = f.read(64 * 1024)
+        start = first_frame_offset(head)
+        length = frame_length(head[start:start + 4])
+        frame = bytearray(head[start:start + length]) if length else bytearray()
+        offset = _xing_offset(frame) if frame else None
+        if offset is None:
+            raise ValueError("The MP3 file has no LAME header")
+        tag = offset + LAME_TAG_OFFSET
+        frame[tag + 21:tag + 24] = ((delay << 12) | padding).to_bytes(3, 'big')
+        # The tag's checksum covers the frame up to the checksum itself.
+        frame[tag + 34:tag + 36] = struct.pack('>H', _crc16(frame[:tag + 34]))
+        f.seek(start)
+        f.write(frame)
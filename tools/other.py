@@ -1,20 +1,176 @@
 # -*- coding: utf-8 -*-
 """
 Other miscellaneous tools for the Telegram bot.
+
+QR codes are rendered in memory and kept in a small per-process LRU cache
+keyed on (text, error correction, box size, format), so repeated requests
+never touch the disk. Besides PNG they can be rendered as SVG, which is much
+smaller and faster to produce. Bulk requests (one code per line of a CSV or
+text list) are rendered on a process pool and returned as a ZIP; bulk jobs,
+which already run in a worker process, render in-process.
 """
 
-from flask import jsonify, send_from_directory
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from flask import Response, jsonify, send_file
+from tools import ToolError, archive, progress
+from werkzeug.utils import secure_filename
 import qrcode
+import qrcode.image.svg
+import atexit
+import csv
+import io
+import multiprocessing
 import os
+import threading
+
+ERROR_CORRECTION = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H,
+}
+MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+MAX_BOX_SIZE = 50
+# Below this many codes a bulk request is rendered in-process
+BULK_PARALLEL_MIN = 32
+
+_codes = OrderedDict()
+_lock = threading.Lock()
+_pool = None
+
+def qr_options(error_correction=None, box_size=None, format=None):
+    """Validates the QR parameters and returns them as (error correction, box size, format)."""
+    error_correction = str(error_correction or 'M').upper()
+    if error_correction not in ERROR_CORRECTION:
+        raise ToolError("error_correction must be one of L, M, Q or H.", 400)
+    try:
+        box_size = int(10 if box_size in (None, '') else box_size)
+    except (TypeError, ValueError):
+        raise ToolError("box_size must be a whole number.", 400)
+    if not 1 <= box_size <= MAX_BOX_SIZE:
+        raise ToolError(f"box_size must be between 1 and {MAX_BOX_SIZE}.", 400)
+    format = str(format or 'png').lower()
+    if format not in MIMETYPES:
+        raise ToolError("format must be png or svg.", 400)
+    return error_correction, box_size, format
+
+def _render(text, error_correction, box_size, format):
+    qr = qrcode.QRCode(error_correction=ERROR_CORRECTION[error_correction], box_size=box_size, border=4)
+    try:
+        qr.add_data(text)
+        qr.make(fit=True)
+    except qrcode.exceptions.DataOverflowError:
+        raise ToolError("The text is too long for a QR code.")
+    buffer = io.BytesIO()
+    if format == 'svg':
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        qr.make_image().save(buffer)
+    return buffer.getvalue()
+
+def render(text, error_correction='M', box_size=10, format='png'):
+    """Returns the QR code for text as PNG or SVG bytes, from the cache when possible."""
+    from config import QR_CACHE_ITEMS
+    key = (text, error_correction, box_size, format)
+    with _lock:
+        data = _codes.get(key)
+        if data is not None:
+            _codes.move_to_end(key)
+            return data
+
+    data = _render(text, error_correction, box_size, format)
+    with _lock:
+        _codes[key] = data
+        _codes.move_to_end(key)
+        while len(_codes) > QR_CACHE_ITEMS:
+            _codes.popitem(last=False)
+    return data
+
+def _render_item(item):
+    text, options = item
+    return render(text, *options)
+
+def _get_pool():
+    """
+    Returns the bulk rendering pool, creating it on first use, or None inside
+    a worker process (e.g. a job), which renders in-process rather than
+    starting a pool of its own.
+    """
+    global _pool
+    if multiprocessing.parent_process() is not None:
+        return None
+    with _lock:
+        if _pool is None:
+            from config import QR_BULK_WORKERS
+            # Spawned rather than forked: the server holds threads (model sessions,
+            # ZIP writers) whose locks a forked worker could inherit held.
+            _pool = ProcessPoolExecutor(max_workers=QR_BULK_WORKERS or os.cpu_count() or 1,
+                                        mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(_pool.shutdown, cancel_futures=True)
+        return _pool
 
-def generate_qr(app, text):
+def parse_list(text):
+    """Parses a bulk list: one code per line, as CSV "text[,file name]"."""
+    from config import QR_BULK_MAX_CODES
+    rows = [row for row in csv.reader(text.splitlines()) if row and row[0].strip()]
+    if not rows:
+        raise ToolError("No text provided")
+    if len(rows) > QR_BULK_MAX_CODES:
+        raise ToolError(f"At most {QR_BULK_MAX_CODES} codes can be generated at once.", 413)
+    return [(row[0].strip(), row[1].strip() if len(row) > 1 else '') for row in rows]
+
+def render_bulk(text, error_correction=None, box_size=None, format=None):
+    """Renders every code of a bulk list; returns (file name, file) members for a ZIP."""
+    options = qr_options(error_correction, box_size, format)
+    rows = parse_list(text)
+    items = [(content, options) for content, _ in rows]
+    pool = _get_pool() if len(items) >= BULK_PARALLEL_MIN else None
+    if pool is None:
+        codes = [_render_item(item) for item in items]
+    else:
+        codes = list(pool.map(_render_item, items, chunksize=16))
+
+    members = []
+    for index, ((_, name), data) in enumerate(zip(rows, codes), 1):
+        stem = secure_filename(os.path.splitext(name)[0]) if name else ''
+        members.append((f"{index:04d}_{stem}.{options[2]}" if stem else f"{index:04d}.{options[2]}", io.BytesIO(data)))
+    return members
+
+def process_generate_qr(text, output_dir, error_correction=None, box_size=None, format=None):
+    """Renders a QR code for text into output_dir."""
+    options = qr_options(error_correction, box_size, format)
+    path = os.path.join(output_dir, f"qr_code.{options[2]}")
+    with open(path, 'wb') as f:
+        f.write(render(text, *options))
+    return path
+
+def process_generate_qr_bulk(text, output_dir, error_correction=None, box_size=None, format=None):
+    """Renders a QR code for every line of a CSV/text list into a ZIP in output_dir."""
+    members = render_bulk(text, error_correction, box_size, format)
+    return archive.write(os.path.join(output_dir, 'qr_codes.zip'), members,
+                         on_member=lambda done, total: progress.report(done / total, 'zip'))
+
+def generate_qr(app, text, error_correction=None, box_size=None, format=None):
     """Generates a QR code from text."""
     if not text:
         return jsonify({"error": "No text provided"}), 400
+    try:
+        options = qr_options(error_correction, box_size, format)
+        data = render(text, *options)
+    except ToolError as e:
+        return jsonify({"error": e.message}), e.status_code
+    return send_file(io.BytesIO(data), mimetype=MIMETYPES[options[2]], download_name=f"qr_code.{options[2]}")
 
-    img = qrcode.make(text)
-    filename = "qr_code.png"
-    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    img.save(path)
-
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+def generate_qr_bulk(app, file, text=None, error_correction=None, box_size=None, format=None):
+    """Generates a ZIP of QR codes from an uploaded CSV/text list or the text field."""
+    if file.filename:
+        text = file.read().decode('utf-8-sig', 'replace')
+    if not text:
+        return jsonify({"error": "No text provided"}), 400
+    try:
+        members = render_bulk(text, error_correction, box_size, format)
+    except ToolError as e:
+        return jsonify({"error": e.message}), e.status_code
+    return Response(archive.stream(members), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename="qr_codes.zip"'})
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Crop preview engine.
+
+Interactive cropping renders a new preview on every button press. Decoding the
+full-resolution image each time dominates that cost, so each process decodes a
+source once into a downscaled proxy, keeps the proxies in a small LRU cache
+keyed on the file, and renders low-resolution JPEG previews from the proxy.
+Only the final crop works on the full-resolution image.
+"""
+
+from collections import OrderedDict
+from PIL import Image
+import io
+import os
+import threading
+
+# Fill colour for the parts of the crop box outside the image
+BORDER_COLOR = (255, 0, 0)
+
+_proxies = OrderedDict()
+_lock = threading.Lock()
+
+
+def _settings():
+    from config import PREVIEW_MAX_SIDE, PREVIEW_QUALITY, PREVIEW_CACHE_ITEMS
+    return PREVIEW_MAX_SIDE, PREVIEW_QUALITY, PREVIEW_CACHE_ITEMS
+
+
+def _decode(input_path, max_side):
+    """Decodes the image at input_path straight into a proxy at most max_side wide or high."""
+    with Image.open(input_path) as img:
+        full_size = img.size
+        # For JPEGs this makes the decoder downscale while decoding.
+        img.draft('RGB', (max_side, max_side))
+        proxy = img.convert('RGB')
+    proxy.thumbnail((max_side, max_side))
+    return proxy, full_size
+
+
+def get_proxy(input_path):
+    """Returns (proxy image, full-resolution size) for a file, decoding it on first use."""
+    max_side, _, max_items = _settings()
+    stat = os.stat(input_path)
+    key = (os.path.abspath(input_path), stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        entry = _proxies.get(key)
+        if entry is not None:
+            _proxies.move_to_end(key)
+            return entry
+
+    entry = _decode(input_path, max_side)
+    with _lock:
+        _proxies[key] = entry
+        _proxies.move_to_end(key)
+        while len(_proxies) > max_items:
+            _proxies.popitem(last=False)
+    return entry
+
+
+def render(input_path, left, top, right, bottom):
+    """Renders the crop box of the image at input_path as low-resolution JPEG bytes."""
+    _, quality, _ = _settings()
+    proxy, (width, height) = get_proxy(input_path)
+    scale_x = proxy.width / width
+    scale_y = proxy.height / height
+
+    canvas = Image.new('RGB', (max(1, round((right - left) * scale_x)), max(1, round((bottom - top) * scale_y))),
+                       BORDER_COLOR)
+    canvas.paste(proxy, (-round(left * scale_x), -round(top * scale_y)))
+
+    buffer = io.BytesIO()
+    canvas.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Progress reporting and cancellation for long-running tools.
+
+A tool calls ``report(fraction, stage)`` as it works (yt-dlp progress hooks,
+ffmpeg ``-progress`` output, upscaling tile counts). The call goes to the
+Reporter installed by whoever runs the tool, and raises Cancelled once that
+run has been cancelled, so the tool stops at its next report and frees the
+worker. Tools that wait on a subprocess use ``run_process`` so the process is
+killed on cancellation.
+
+Runs without a reporter (e.g. the synchronous server routes) are unaffected:
+``report`` is then a no-op.
+
+Job runs use a DirectoryReporter: progress is written to a small JSON file in
+the job directory and cancellation is requested by creating a marker file, so
+both work across the worker-process boundary.
+"""
+
+from contextlib import contextmanager
+import contextvars
+import json
+import os
+import subprocess
+import time
+
+from tools import ToolError
+
+PROGRESS_FILE = 'progress.json'
+CANCEL_FILE = 'cancel'
+
+_current = contextvars.ContextVar('progress_reporter', default=None)
+
+
+class Cancelled(ToolError):
+    """Raised inside a tool when its run has been cancelled."""
+
+    def __init__(self):
+        super().__init__("Cancelled", 499)
+
+    def __reduce__(self):
+        return (Cancelled, ())
+
+
+class Reporter:
+    """Receives one run's progress; on_update(fraction, stage) is called at most every interval seconds."""
+
+    def __init__(self, on_update=None, is_cancelled=None, interval=0.5):
+        self.on_update = on_update
+        self.is_cancelled = is_cancelled
+        self.interval = interval
+        self._last = 0
+
+    def update(self, fraction, stage=None):
+        now = time.monotonic()
+        if now - self._last < self.interval and fraction < 1:
+            return
+        self._last = now
+        if self.is_cancelled is not None and self.is_cancelled():
+            raise Cancelled()
+        if self.on_update is not None:
+            self.on_update(min(max(fraction, 0.0), 1.0), stage)
+
+    def check(self):
+        if self.is_cancelled is not None and self.is_cancelled():
+            raise Cancelled()
+
+
+class DirectoryReporter(Reporter):
+    """Publishes progress to, and reads cancellation from, a job directory."""
+
+    def __init__(self, directory, interval=0.5):
+        super().__init__(self._write, lambda: os.path.exists(os.path.join(directory, CANCEL_FILE)), interval)
+        self.directory = directory
+
+    def _write(self, fraction, stage):
+        path = os.path.join(self.directory, PROGRESS_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({"progress": round(fraction, 3), "stage": stage}, f)
+        os.replace(path + '.tmp', path)
+
+
+def read(directory):
+    """Returns the last progress published in a job directory as {"progress", "stage"}."""
+    try:
+        with open(os.path.join(directory, PROGRESS_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"progress": None, "stage": None}
+
+
+def request_cancel(directory):
+    """Asks the run using this job directory to stop at its next progress report."""
+    open(os.path.join(directory, CANCEL_FILE), 'a').close()
+
+
+@contextmanager
+def tracking(reporter):
+    """Installs reporter for the tool calls made inside the block."""
+    token = _current.set(reporter)
+    try:
+        yield reporter
+    finally:
+        _current.reset(token)
+
+
+def report(fraction, stage=None):
+    """Publishes the current tool's progress (0..1); raises Cancelled if it was cancelled."""
+    reporter = _current.get()
+    if reporter is not None:
+        reporter.update(fraction, stage)
+
+
+def check():
+    """Raises Cancelled if the current tool run was cancelled."""
+    reporter = _current.get()
+    if reporter is not None:
+        reporter.check()
+
+
+def run_process(args, poll_interval=0.5, **kwargs):
+    """Runs a subprocess to completion, killing it if the current run is cancelled."""
+    process = subprocess.Popen(args, **kwargs)
+    try:
+        while True:
+            try:
+                return process.wait(timeout=poll_interval)
+            except subprocess.TimeoutExpired:
+                check()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
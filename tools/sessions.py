@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent rembg model sessions.
+
+Loading the ONNX model and initialising onnxruntime dominates the cost of a
+background removal, so each process keeps one session per model and reuses it
+for every request. ``warm_up`` can be used as a worker-process initializer to
+pay that cost at startup instead of on the first request.
+"""
+
+from rembg import new_session, remove
+from PIL import Image
+import numpy as np
+import io
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+MODEL_ALIASES = {
+    'u2net': 'u2net',
+    'u2netp': 'u2netp',
+    'silueta': 'silueta',
+    'isnet': 'isnet-general-use',
+}
+
+# model -> (mean, std, input size) used by rembg to normalise its input; these
+# mirror the predict() of rembg's U2netSession, U2netpSession, SiluetaSession
+# and DisSession and must follow them when rembg is upgraded
+MODEL_INPUTS = {
+    'u2net': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'u2netp': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'silueta': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'isnet-general-use': ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+_sessions = {}
+_lock = threading.Lock()
+
+def resolve_model(model_name=None):
+    """Returns the rembg model name for a configured model or alias."""
+    from config import REMBG_MODEL
+    model_name = model_name or REMBG_MODEL
+    if model_name not in MODEL_ALIASES:
+        raise ValueError(f"Unsupported rembg model: {model_name}")
+    return MODEL_ALIASES[model_name]
+
+def get_session(model_name=None):
+    """Returns this process' session for the model, creating it on first use."""
+    model_name = resolve_model(model_name)
+    session = _sessions.get(model_name)
+    if session is not None:
+        return session
+
+    with _lock:
+        if model_name not in _sessions:
+            from config import REMBG_THREADS
+            if REMBG_THREADS:
+                # rembg reads the onnxruntime intra/inter-op thread count from here.
+                os.environ['OMP_NUM_THREADS'] = str(REMBG_THREADS)
+            _sessions[model_name] = new_session(model_name)
+        return _sessions[model_name]
+
+def warm_up(model_name=None):
+    """Loads the model and runs one dummy inference so the next call is hot."""
+    session = get_session(model_name)
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (255, 255, 255)).save(buffer, format='PNG')
+    remove(buffer.getvalue(), session=session)
+    logger.info(f"rembg session warmed up in process {os.getpid()}")
+    return session
+
+def _run_batch(session, images, mean, std, size):
+    """Runs one forward pass over images and returns their raw masks."""
+    inputs = [session.normalize(img, mean, std, size) for img in images]
+    model_input = session.inner_session.get_inputs()[0]
+    if isinstance(model_input.shape[0], int):
+        # Exported with a fixed batch dimension (1): one pass per image.
+        return np.concatenate([session.inner_session.run(None, item)[0][:, 0, :, :] for item in inputs])
+    batch = np.concatenate([item[model_input.name] for item in inputs], axis=0)
+    return session.inner_session.run(None, {model_input.name: batch})[0][:, 0, :, :]
+
+def remove_batch(images, model_name=None, batch_size=None):
+    """Removes the background from several PIL images, batching the inference."""
+    from config import REMBG_BATCH_SIZE
+    model_name = resolve_model(model_name)
+    session = get_session(model_name)
+    mean, std, size = MODEL_INPUTS[model_name]
+    batch_size = batch_size or REMBG_BATCH_SIZE
+
+    results = []
+    images = [img.convert('RGB') for img in images]
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        for img, pred in zip(chunk, _run_batch(session, chunk, mean, std, size)):
+            low, high = pred.min(), pred.max()
+            pred = (pred - low) / (high - low) if high > low else np.zeros_like(pred)
+            mask = Image.fromarray((pred * 255).astype('uint8'), mode='L').resize(img.size, Image.LANCZOS)
+            cutout = img.convert('RGBA')
+            cutout.putalpha(mask)
+            results.append(cutout)
+    return results
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Super-resolution backends for upscale_4k.
+
+``ncnn`` shells out to realesrgan-ncnn-vulkan, which needs a Vulkan GPU.
+``onnx`` runs a Real-ESRGAN ONNX model on onnxruntime on the CPU: the image is
+processed in overlapping tiles so peak memory stays bounded, tiles run in
+parallel on a thread pool (onnxruntime releases the GIL), and the session is
+created once per process and kept resident.
+
+Either way the result is resized to the requested target size, so "4K" means
+a longest side of UPSCALE_TARGET_SIZE rather than a fixed x4: images that are
+already that large are returned unchanged, and inputs larger than
+target_size / UPSCALE_MODEL_SCALE are shrunk to that before the model runs.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image
+import numpy as np
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+
+from tools import ToolError, progress
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_executor = None
+_lock = threading.Lock()
+
+
+def resolve_backend():
+    """Returns the configured backend, resolving "auto" to ncnn when its binary is installed."""
+    from config import UPSCALE_BACKEND
+    if UPSCALE_BACKEND == 'auto':
+        return 'ncnn' if shutil.which('realesrgan-ncnn-vulkan') else 'onnx'
+    if UPSCALE_BACKEND not in ('ncnn', 'onnx'):
+        raise ValueError(f"Unsupported UPSCALE_BACKEND: {UPSCALE_BACKEND}")
+    return UPSCALE_BACKEND
+
+
+def cache_version():
+    """Extra result-cache key material: results differ between backends and models."""
+    from config import UPSCALE_MODEL_PATH
+    backend = resolve_backend()
+    return f"{backend}:{os.path.basename(UPSCALE_MODEL_PATH)}" if backend == 'onnx' else backend
+
+
+def get_session():
+    """Returns this process' onnxruntime session and tile pool, creating them on first use."""
+    global _session, _executor
+    if _session is not None:
+        return _session, _executor
+
+    with _lock:
+        if _session is None:
+            import onnxruntime
+            from config import UPSCALE_MODEL_PATH, UPSCALE_WORKERS
+            if not os.path.isfile(UPSCALE_MODEL_PATH):
+                raise ToolError(f"Upscaling model not found: {UPSCALE_MODEL_PATH}")
+            workers = UPSCALE_WORKERS or os.cpu_count() or 1
+            options = onnxruntime.SessionOptions()
+            # Parallelism comes from running tiles concurrently, one core each.
+            options.intra_op_num_threads = 1 if workers > 1 else 0
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upscale')
+            _session = onnxruntime.InferenceSession(UPSCALE_MODEL_PATH, options,
+                                                    providers=['CPUExecutionProvider'])
+            logger.info(f"Upscaling session loaded in process {os.getpid()} ({workers} tile workers)")
+        return _session, _executor
+
+
+def _tile_boxes(width, height, tile):
+    for top in range(0, height, tile):
+        for left in range(0, width, tile):
+            yield left, top, min(left + tile, width), min(top + tile, height)
+
+
+def _run_tile(session, pixels, box, tile, overlap, scale):
+    """Upscales one tile, read with `overlap` pixels of context on every side."""
+    left, top, right, bottom = box
+    height, width = pixels.shape[1:]
+    pad_left, pad_top = max(left - overlap, 0), max(top - overlap, 0)
+    pad_right, pad_bottom = min(right + overlap, width), min(bottom + overlap, height)
+    patch = pixels[:, pad_top:pad_bottom, pad_left:pad_right]
+
+    # Every patch has the same shape, so models exported with fixed input sizes work too.
+    size = tile + 2 * overlap
+    patch = np.pad(patch, ((0, 0), (0, size - patch.shape[1]), (0, size - patch.shape[2])), mode='edge')
+    output = session.run(None, {session.get_inputs()[0].name: patch[np.newaxis]})[0][0]
+
+    out_top, out_left = (top - pad_top) * scale, (left - pad_left) * scale
+    output = output[:, out_top:out_top + (bottom - top) * scale, out_left:out_left + (right - left) * scale]
+    return (np.clip(output, 0, 1) * 255).round().astype(np.uint8)
+
+
+def _upscale_onnx(img):
+    """Runs the ONNX model over img in overlapping tiles and returns the upscaled image."""
+    from config import UPSCALE_MODEL_SCALE, UPSCALE_TILE_SIZE, UPSCALE_TILE_OVERLAP
+    session, executor = get_session()
+    scale, tile, overlap = UPSCALE_MODEL_SCALE, UPSCALE_TILE_SIZE, UPSCALE_TILE_OVERLAP
+
+    pixels = np.asarray(img.convert('RGB'), dtype=np.float32).transpose(2, 0, 1) / 255.0
+    height, width = pixels.shape[1:]
+    # Only the uint8 result is kept at full output size.
+    result = np.empty((height * scale, width * scale, 3), dtype=np.uint8)
+
+    def run(box):
+        left, top, right, bottom = box
+        output = _run_tile(session, pixels, box, tile, overlap, scale)
+        result[top * scale:bottom * scale, left * scale:right * scale] = output.transpose(1, 2, 0)
+
+    futures = [executor.submit(run, box) for box in _tile_boxes(width, height, tile)]
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            progress.report(done / len(futures), 'upscale')
+    finally:
+        # On failure or cancellation, drop the tiles that have not started.
+        for future in futures:
+            future.cancel()
+    return Image.fromarray(result, 'RGB')
+
+
+def _upscale_ncnn(img):
+    """Upscales img with realesrgan-ncnn-vulkan and returns the upscaled image."""
+    with tempfile.TemporaryDirectory(prefix='upscale_') as tmp_dir:
+        input_path = os.path.join(tmp_dir, 'input.png')
+        output_path = os.path.join(tmp_dir, 'upscaled.png')
+        img.save(input_path)
+        try:
+            returncode = progress.run_process(['realesrgan-ncnn-vulkan', '-i', input_path, '-o', output_path])
+        except FileNotFoundError:
+            returncode = None
+        if returncode != 0:
+            raise ToolError("Real-ESRGAN not found or failed to process image.")
+        with Image.open(output_path) as img:
+            img.load()
+            return img
+
+
+def target_dimensions(size, target_size):
+    """Returns the output size for an image of `size` whose longest side should be target_size."""
+    width, height = size
+    factor = target_size / max(width, height)
+    return max(1, round(width * factor)), max(1, round(height * factor))
+
+
+def upscale(input_path, target_size):
+    """Upscales the image at input_path so its longest side is target_size; returns a PIL image."""
+    img = Image.open(input_path)
+    if max(img.size) >= target_size:
+        return img
+    size = target_dimensions(img.size, target_size)
+
+    # The model always upscales x UPSCALE_MODEL_SCALE: shrink larger inputs to
+    # about target_size / scale first instead of downscaling a bigger output.
+    from config import UPSCALE_MODEL_SCALE
+    source = img.convert('RGB')
+    source_side = math.ceil(target_size / UPSCALE_MODEL_SCALE)
+    if max(source.size) > source_side:
+        source = source.resize(target_dimensions(source.size, source_side), Image.LANCZOS)
+
+    if resolve_backend() == 'ncnn':
+        upscaled = _upscale_ncnn(source)
+    else:
+        upscaled = _upscale_onnx(source)
+    if upscaled.size != size:
+        upscaled = upscaled.resize(size, Image.LANCZOS)
+
+    if img.mode in ('RGBA', 'LA') and upscaled.mode != 'RGBA':
+        # The models work on RGB; the alpha channel is resized conventionally.
+        upscaled = upscaled.convert('RGBA')
+        upscaled.putalpha(img.getchannel('A').resize(size, Image.LANCZOS))
+    return upscaled
@@ -3,42 +3,538 @@
 Video processing tools for the Telegram bot.
 """
 
-from flask import jsonify, send_from_directory
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Response, jsonify
+from tools import ToolError, download_cache, mp3, progress
+from tools.cache import cached
+from tools.workspace import Workspace, detach
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
 import yt_dlp
 import ffmpeg
+import contextvars
+import functools
+import io
+import math
 import os
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
 
-def download_video(app, video_url):
-    """Downloads a video from a given URL."""
-    if not video_url:
-        return jsonify({"error": "No URL provided"}), 400
+# Query parameters that only track where a link was shared
+TRACKING_PARAMS = ('si', 'feature', 'fbclid', 'gclid', 'igshid', 'igsh', 'ref', 'share_id')
+# Pipe read/write size for streamed conversions
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def _download_hook(status):
+    """yt-dlp progress hook: reports the downloaded fraction."""
+    if status['status'] == 'downloading':
+        total = status.get('total_bytes') or status.get('total_bytes_estimate')
+        if total:
+            progress.report(status.get('downloaded_bytes', 0) / total, 'download')
+
+def probe_duration(input_path):
+    """Returns the media duration in seconds, or None if ffprobe cannot tell or is not installed."""
+    try:
+        return float(ffmpeg.probe(input_path)['format']['duration'])
+    except (ffmpeg.Error, OSError, KeyError, ValueError):
+        return None
+
+def probe_sample_rate(input_path):
+    """Returns the sample rate of the first audio stream, or None if ffprobe cannot tell."""
+    try:
+        streams = ffmpeg.probe(input_path, select_streams='a:0')['streams']
+        return int(streams[0]['sample_rate'])
+    except (ffmpeg.Error, OSError, IndexError, KeyError, ValueError):
+        return None
+
+def run_ffmpeg(stream, duration=None, stage='convert'):
+    """
+    Runs an ffmpeg-python stream, reporting progress from ffmpeg's -progress
+    output against duration. The process is killed if the run is cancelled.
+    """
+    args = stream.global_args('-progress', 'pipe:1', '-nostats', '-loglevel', 'error').overwrite_output().compile()
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            for line in process.stdout:
+                key, _, value = line.decode('ascii', 'replace').strip().partition('=')
+                # out_time_us (out_time_ms in older versions) is in microseconds.
+                if duration and key in ('out_time_us', 'out_time_ms') and value.isdigit():
+                    progress.report(int(value) / 1e6 / duration, stage)
+            process.wait()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise ToolError(stderr.read().decode('utf8', 'replace') or f"ffmpeg exited with {process.returncode}")
+
+def _format_size(fmt, duration):
+    """Returns a format's size in bytes, estimated from its bitrate if yt-dlp does not know it."""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not size and fmt.get('tbr') and duration:
+        size = fmt['tbr'] * 1000 / 8 * duration
+    return size
+
+# As in yt-dlp, a missing codec field means unknown, not absent: only 'none'
+# rules a stream out, so formats without codec fields count as combined.
+def _has_video(fmt):
+    return fmt.get('vcodec') != 'none'
+
+def _has_audio(fmt):
+    return fmt.get('acodec') != 'none'
+
+def choose_format(info, max_bytes, audio_only=False):
+    """
+    Picks the best yt-dlp format selector for info whose size fits max_bytes:
+    a single audio stream in audio-only mode, otherwise the highest
+    resolution among progressive formats and video+audio pairs. Returns None
+    if no format with a known size fits.
+    """
+    duration = info.get('duration')
+    formats = [(fmt, _format_size(fmt, duration)) for fmt in info.get('formats') or [info]]
+    formats = [(fmt, size) for fmt, size in formats if size and size <= max_bytes]
+    audios = [(fmt, size) for fmt, size in formats if _has_audio(fmt) and not _has_video(fmt)]
+
+    if audio_only:
+        if not audios:
+            return None
+        fmt, _ = max(audios, key=lambda item: (item[0].get('abr') or 0, item[0].get('ext') == 'm4a'))
+        return fmt['format_id']
 
+    # (height, bitrate, prefers mp4) -> selector; Telegram plays mp4 inline.
+    candidates = []
+    for fmt, size in formats:
+        if _has_video(fmt) and _has_audio(fmt):
+            candidates.append(((fmt.get('height') or 0, fmt.get('tbr') or 0, fmt.get('ext') == 'mp4'), fmt['format_id']))
+    for video, video_size in formats:
+        if not _has_video(video) or _has_audio(video):
+            continue
+        fitting = [(audio, size) for audio, size in audios if video_size + size <= max_bytes]
+        if fitting:
+            audio, _ = max(fitting, key=lambda item: (item[0].get('abr') or 0, item[0].get('ext') == 'm4a'))
+            score = (video.get('height') or 0, (video.get('tbr') or 0) + (audio.get('tbr') or 0), video.get('ext') == 'mp4')
+            candidates.append((score, f"{video['format_id']}+{audio['format_id']}"))
+    return max(candidates)[1] if candidates else None
+
+def normalise_url(video_url):
+    """Lower-cases the scheme and host, drops the fragment and tracking parameters, sorts the query."""
+    parts = urlsplit(video_url.strip())
+    query = sorted((key, value) for key, value in parse_qsl(parts.query)
+                   if key not in TRACKING_PARAMS and not key.startswith('utm_'))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+@functools.lru_cache(maxsize=4096)
+def canonical_key(video_url):
+    """
+    Returns "<extractor>:<video id>" for URLs a yt-dlp extractor recognises,
+    so different links to the same video share one download, or the
+    normalised URL otherwise. Resolved offline from the extractors' URL patterns.
+    """
+    for extractor in yt_dlp.extractor.gen_extractor_classes():
+        if extractor.ie_key() == 'Generic' or not extractor.suitable(video_url):
+            continue
+        try:
+            video_id = extractor.get_temp_id(video_url)
+        except Exception:
+            video_id = None
+        if video_id:
+            return f"{extractor.ie_key()}:{video_id}"
+        break
+    return normalise_url(video_url)
+
+def process_download_video(video_url, output_dir, audio_only=False):
+    """
+    Downloads the video at video_url into output_dir, in the best format that
+    fits VIDEO_MAX_BYTES (or only its audio with audio_only). Concurrent
+    requests for the same video share one download (see tools/download_cache.py).
+    """
+    from config import VIDEO_MAX_BYTES, VIDEO_MAX_HEIGHT
+    audio_only = str(audio_only).lower() in ('1', 'true', 'yes', 'on')
+    key = f"{canonical_key(video_url)}|{'audio' if audio_only else 'video'}|{VIDEO_MAX_BYTES}|{VIDEO_MAX_HEIGHT}"
+    return download_cache.fetch(key, output_dir,
+                                lambda tmp_dir: _download(video_url, tmp_dir, audio_only, VIDEO_MAX_BYTES,
+                                                          VIDEO_MAX_HEIGHT))
+
+def unknown_size_format(audio_only, max_height):
+    """Returns the selector for videos whose format sizes are unknown: the best under max_height."""
+    if audio_only:
+        return 'bestaudio/best'
+    return f"best[height<={max_height}]/bestvideo[height<={max_height}]+bestaudio/best"
+
+def _download(video_url, output_dir, audio_only, max_bytes, max_height):
+    """Downloads the best format of the video at video_url that fits max_bytes into output_dir."""
     ydl_opts = {
-        'outtmpl': os.path.join(app.config['UPLOAD_FOLDER'], '%(title)s.%(ext)s'),
+        'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
+        'progress_hooks': [_download_hook],
+        # Guards formats whose size was only estimated.
+        'max_filesize': max_bytes,
+        'merge_output_format': 'mp4',
     }
 
+    too_large = f"No format of this video fits in {max_bytes // (1024 * 1024)} MB."
     try:
+        # Pre-flight: pick the format before downloading anything.
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=True)
-            filename = ydl.prepare_filename(info)
-            return send_from_directory(app.config['UPLOAD_FOLDER'], os.path.basename(filename))
+            info = ydl.extract_info(video_url, download=False)
+        selector = choose_format(info, max_bytes, audio_only)
+        if selector is None:
+            if any(_format_size(fmt, info.get('duration')) for fmt in info.get('formats') or [info]):
+                raise ToolError(too_large, 413)
+            # Sizes unknown: max_filesize still aborts oversized downloads.
+            selector = unknown_size_format(audio_only, max_height)
+
+        # Download the extracted info directly, without extracting it again.
+        with yt_dlp.YoutubeDL(dict(ydl_opts, format=selector)) as ydl:
+            info = ydl.process_ie_result(info, download=True)
+            downloads = info.get('requested_downloads') or []
+            path = downloads[0].get('filepath') if downloads else ydl.prepare_filename(info)
+        if not path or not os.path.isfile(path):
+            raise ToolError(too_large, 413)
+        return path
+    except (progress.Cancelled, ToolError):
+        raise
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        # yt-dlp may wrap the Cancelled raised in the hook.
+        progress.check()
+        raise ToolError(str(e))
 
-def to_mp3(app, file):
-    """Converts a video file to MP3."""
-    if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
-    if file:
-        filename = secure_filename(file.filename)
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(input_path)
+def mp3_options(bitrate=None, quality=None):
+    """
+    Returns the ffmpeg output options for MP3: constant bitrate (e.g. "192k")
+    or a libmp3lame VBR preset from 0 (best) to 9 (smallest). Without either,
+    MP3_BITRATE is used if set, MP3_VBR_QUALITY otherwise. Video is dropped.
+    """
+    from config import MP3_BITRATE, MP3_VBR_QUALITY, MP3_THREADS
+    if bitrate in (None, '') and quality in (None, ''):
+        bitrate, quality = MP3_BITRATE, MP3_VBR_QUALITY
+    options = {'vn': None, 'acodec': 'libmp3lame', 'threads': MP3_THREADS}
+    if bitrate:
+        bitrate = str(bitrate).lower()
+        if not re.fullmatch(r'\d{2,3}k', bitrate):
+            raise ToolError("bitrate must look like 128k, 192k or 320k.", 400)
+        options['b:a'] = bitrate
+    else:
+        try:
+            quality = int(quality)
+        except (TypeError, ValueError):
+            raise ToolError("quality must be a whole number between 0 and 9.", 400)
+        if not 0 <= quality <= 9:
+            raise ToolError("quality must be a whole number between 0 and 9.", 400)
+        options['q:a'] = quality
+    return options
+
+def mp3_cache_version():
+    """Extra result-cache key material: the default encoder settings."""
+    from config import MP3_BITRATE, MP3_VBR_QUALITY
+    return f"{MP3_BITRATE}:{MP3_VBR_QUALITY}"
+
+@cached('to_mp3', version=mp3_cache_version)
+def process_to_mp3(input_path, output_dir, bitrate=None, quality=None):
+    """
+    Converts the video at input_path to MP3, encoding only its audio stream.
+    Inputs longer than MP3_SEGMENT_THRESHOLD seconds are encoded in parallel
+    segments (see _segmented_mp3).
+    """
+    from config import MP3_SEGMENT_THRESHOLD
+    output_path = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(input_path))[0]}.mp3")
+    options = mp3_options(bitrate, quality)
+    duration = probe_duration(input_path)
+    if MP3_SEGMENT_THRESHOLD and duration and duration >= MP3_SEGMENT_THRESHOLD:
+        sample_rate = probe_sample_rate(input_path)
+        if sample_rate in mp3.SAMPLE_RATES:
+            _segmented_mp3(input_path, output_path, duration, sample_rate, options)
+            return output_path
+    run_ffmpeg(ffmpeg.input(input_path).output(output_path, **options), duration)
+    return output_path
+
+def _encode_segment(input_path, output_path, start, length, options):
+    """Encodes `length` seconds (or the rest) of input_path from `start` into its own MP3 file."""
+    # No -ss for the first segment: on MP4/AAC input even "-ss 0" drops the decoder's first samples.
+    timing = {'ss': start} if start else {}
+    if length is not None:
+        timing['t'] = length
+    args = (ffmpeg.input(input_path, **timing)
+            .output(output_path, **options)
+            .global_args('-nostats', '-loglevel', 'error')
+            .overwrite_output()
+            .compile())
+    with tempfile.TemporaryFile() as stderr:
+        returncode = progress.run_process(args, stdout=subprocess.DEVNULL, stderr=stderr)
+        if returncode != 0:
+            stderr.seek(0)
+            raise ToolError(stderr.read().decode('utf8', 'replace') or f"ffmpeg exited with {returncode}")
+
+def _segmented_mp3(input_path, output_path, duration, sample_rate, options):
+    """
+    Splits the audio into MP3_SEGMENT_SECONDS slices aligned to MP3 frames,
+    encodes them with one ffmpeg process each (MP3_SEGMENT_WORKERS at a time)
+    and joins them gaplessly, without re-encoding (see tools/mp3.py).
 
-        output_filename = f"{os.path.splitext(filename)[0]}.mp3"
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+    Every slice but the first is encoded from MP3_SEGMENT_PREROLL frames
+    earlier, so the encoder has settled by the first frame that is kept, and
+    with the bit reservoir off, so no kept frame depends on a dropped one.
+    Only the frames a single encode of the whole input would have produced
+    are kept, and the LAME header of the result carries the encoder delay and
+    padding of the joined stream.
+    """
+    from config import MP3_SEGMENT_SECONDS, MP3_SEGMENT_WORKERS, MP3_SEGMENT_PREROLL
+    frame_seconds = mp3.FRAME_SAMPLES / sample_rate
+    slice_frames = max(1, round(MP3_SEGMENT_SECONDS / frame_seconds))
+    # Slices start on frames that lie entirely inside the input.
+    firsts = list(range(0, max(int(duration / frame_seconds), 1), slice_frames))
+    # (first frame kept, first frame encoded, frames encoded or None for the rest)
+    slices = []
+    for index, first in enumerate(firsts):
+        encoded_from = max(first - MP3_SEGMENT_PREROLL, 0)
+        last = index == len(firsts) - 1
+        # One frame past the slice, so the encoder does not flush into its last kept frame.
+        slices.append((first, encoded_from, None if last else first + slice_frames + 1 - encoded_from))
+    segment_options = dict(options, threads=1, ar=sample_rate, reservoir=0, id3v2_version=0)
+    workers = MP3_SEGMENT_WORKERS or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory(prefix='segments_', dir=os.path.dirname(output_path)) as tmp_dir:
+        paths = [os.path.join(tmp_dir, f"{i:05d}.mp3") for i in range(len(slices))]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mp3') as executor:
+            # Each task runs in a copy of this context so the encoders see cancellation too.
+            futures = [executor.submit(contextvars.copy_context().run, _encode_segment, input_path, path,
+                                       encoded_from * frame_seconds, length and length * frame_seconds,
+                                       segment_options)
+                       for path, (_, encoded_from, length) in zip(paths, slices)]
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    future.result()
+                    progress.report(done / len(futures) * 0.95, 'convert')
+            finally:
+                for future in futures:
+                    future.cancel()
 
+        joined_path = os.path.join(tmp_dir, 'joined.mp3')
+        frame_count = 0
+        with open(joined_path, 'wb') as joined:
+            for path, (first, encoded_from, length) in zip(paths, slices):
+                with open(path, 'rb') as f:
+                    frames = mp3.split_frames(f.read())
+                info = mp3.read_info(frames[0]) if frames else None
+                if info is None:
+                    raise ToolError("ffmpeg wrote an MP3 segment without a LAME header.")
+                skip = first - encoded_from
+                kept = frames[1 + skip:] if length is None else frames[1 + skip:1 + skip + slice_frames]
+                if length is not None and len(kept) < slice_frames:
+                    raise ToolError("The audio ended before the duration ffprobe reported.")
+                joined.writelines(kept)
+                frame_count += len(kept)
+                if first == 0:
+                    delay = info[1]
+                if length is None:
+                    # Samples of the input: everything encoded by the last segment, after its start.
+                    encoded_frames, _, padding = info
+                    samples = (encoded_from + encoded_frames) * mp3.FRAME_SAMPLES - info[1] - padding
+
+        padding = frame_count * mp3.FRAME_SAMPLES - delay - samples
+        if not 0 <= padding < 1 << 12:
+            raise ToolError("Could not join the MP3 segments.")
+        # Copying the frames into place has ffmpeg write the Xing header (frame
+        # count, size, seek table); only the delay and padding are filled in here.
+        run_ffmpeg(ffmpeg.input(joined_path, f='mp3').output(output_path, c='copy'))
+        mp3.set_padding(output_path, delay, padding)
+    progress.report(1, 'convert')
+
+def _feed(source, process, failures):
+    """
+    Copies source into ffmpeg's stdin and closes it. If reading the upload
+    fails, ffmpeg is killed so the output is not silently cut short.
+    """
+    try:
+        shutil.copyfileobj(source, process.stdin, STREAM_CHUNK_SIZE)
+    except BrokenPipeError:
+        # ffmpeg stopped reading; its exit status tells why.
+        pass
+    except Exception as e:
+        failures.append(e)
+        process.kill()
+    finally:
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+
+def _drain(source, lines, limit=65536):
+    """Keeps the first limit bytes of ffmpeg's stderr in memory so its pipe never fills up."""
+    size = 0
+    for line in source:
+        if size < limit:
+            lines.append(line)
+            size += len(line)
+
+class _Prefixed:
+    """A non-seekable upload with the bytes already read from it put back in front."""
+
+    def __init__(self, prefix, stream):
+        self._prefix = io.BytesIO(prefix)
+        self._stream = stream
+
+    def read(self, size=-1):
+        data = self._prefix.read(size)
+        if size is None or size < 0:
+            return data + self._stream.read()
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+
+    def close(self):
+        self._stream.close()
+
+def check_pipe_input(stream, limit=1024 * 1024):
+    """
+    Checks whether an upload is an MP4/MOV whose moov atom (its index) comes
+    after the media data, which ffmpeg cannot decode from a pipe because it
+    would have to seek back. Only the top-level atom headers are read.
+    Returns (stream to read the whole upload from, whether it needs seeking).
+    """
+    seekable = getattr(stream, 'seekable', lambda: False)()
+    start = stream.tell() if seekable else 0
+    head = bytearray()
+
+    def read(size):
+        data = stream.read(size)
+        if not seekable:
+            head.extend(data)
+        return data
+
+    needs_seeking = False
+    first = True
+    while True:
+        header = read(8)
+        if len(header) < 8:
+            break
+        size, kind = struct.unpack('>I4s', header)
+        # Every MP4/MOV starts with ftyp (or, in old QuickTime files, wide/free/mdat/moov).
+        if first and kind not in (b'ftyp', b'wide', b'free', b'mdat', b'moov'):
+            break
+        first = False
+        if kind in (b'moov', b'mdat'):
+            needs_seeking = kind == b'mdat'
+            break
+        header_size = 8
+        if size == 1:
+            large = read(8)
+            if len(large) < 8:
+                break
+            size, header_size = struct.unpack('>Q', large)[0], 16
+        if size < header_size:
+            break
+        if seekable:
+            stream.seek(size - header_size, os.SEEK_CUR)
+        elif len(head) + size - header_size > limit:
+            break
+        else:
+            read(size - header_size)
+
+    if seekable:
+        stream.seek(start)
+        return stream, needs_seeking
+    return _Prefixed(bytes(head), stream), needs_seeking
+
+def stream_mp3(stream, filename, bitrate=None, quality=None):
+    """
+    Pipes a video from a file-like stream through ffmpeg and returns a Flask
+    response streaming the MP3 as ffmpeg produces it. Nothing is written to
+    disk; the first bytes reach the client while the rest is still encoding.
+    The stream is closed once the response is done.
+    """
+    args = (ffmpeg.input('pipe:0')
+            .output('pipe:1', format='mp3', **mp3_options(bitrate, quality))
+            .global_args('-nostats', '-loglevel', 'error')
+            .compile())
+    process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    errors, failures = [], []
+    threads = [threading.Thread(target=_feed, args=(stream, process, failures), daemon=True),
+               threading.Thread(target=_drain, args=(process.stderr, errors), daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    def stop():
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        for thread in threads:
+            thread.join()
+        stream.close()
+
+    def check():
+        """Raises if the upload could not be read or ffmpeg failed."""
+        if failures:
+            raise ToolError(f"Could not read the upload: {failures[0]}")
+        if process.returncode:
+            message = b''.join(errors).decode('utf8', 'replace').strip()
+            raise ToolError(message or f"ffmpeg exited with {process.returncode}")
+
+    # Fails with a proper status if ffmpeg cannot read the input at all.
+    first = process.stdout.read1(STREAM_CHUNK_SIZE)
+    if not first:
+        stop()
+        check()
+        raise ToolError("The file has no audio to convert.", 400)
+
+    def generate():
+        try:
+            yield first
+            for chunk in iter(lambda: process.stdout.read1(STREAM_CHUNK_SIZE), b''):
+                yield chunk
+            process.wait()
+            for thread in threads:
+                thread.join()
+            # Raising here aborts the response, so a failed conversion never looks complete.
+            check()
+        finally:
+            # Also runs when the client disconnects mid-stream.
+            stop()
+
+    name = secure_filename(os.path.splitext(filename)[0]) or 'converted'
+    return Response(generate(), mimetype='audio/mpeg',
+                    headers={'Content-Disposition': f'attachment; filename="{name}.mp3"'})
+
+def download_video(app, video_url, audio_only=False):
+    """Downloads a video (or only its audio) from a given URL."""
+    if not video_url:
+        return jsonify({"error": "No URL provided"}), 400
+    with Workspace(app.config['WORKSPACE_FOLDER']) as workspace:
+        try:
+            output_path = process_download_video(video_url, workspace.path, audio_only=audio_only)
+        except ToolError as e:
+            return jsonify({"error": e.message}), e.status_code
+        return workspace.send(output_path)
+
+def to_mp3(app, file, bitrate=None, quality=None):
+    """
+    Converts a video file to MP3, streamed through ffmpeg's pipes when
+    MP3_STREAMING is on. Streaming only serves direct HTTP clients of this
+    route: it skips the result cache and the segmented encoder, and the bot
+    converts through the job API (process_to_mp3) for progress and cancelling.
+    """
+    from config import MP3_STREAMING
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+    if MP3_STREAMING:
+        stream, needs_seeking = check_pipe_input(detach(file))
+        if not needs_seeking:
+            try:
+                return stream_mp3(stream, file.filename, bitrate=bitrate, quality=quality)
+            except ToolError as e:
+                return jsonify({"error": e.message}), e.status_code
+        # Not "fast start": ffmpeg needs the file on disk to seek to its index.
+        file = FileStorage(stream=stream, filename=file.filename)
+    with Workspace(app.config['WORKSPACE_FOLDER']) as workspace:
+        input_path = workspace.save(file)
+        file.close()
         try:
-            ffmpeg.input(input_path).output(output_path).run()
-            return send_from_directory(app.config['UPLOAD_FOLDER'], output_filename)
-        except ffmpeg.Error as e:
-            return jsonify({"error": e.stderr.decode('utf8')}), 500
+            output_path = process_to_mp3(input_path, workspace.path, bitrate=bitrate, quality=quality)
+        except ToolError as e:
+            return jsonify({"error": e.message}), e.status_code
+        return workspace.send(output_path)
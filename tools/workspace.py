@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Per-request scratch directories for the tool routes.
+
+Every tool invocation gets its own directory, so concurrent requests never
+share file names. The directory is removed when the request fails or, once
+the output has been handed to Flask, after the response has been streamed.
+"""
+
+from flask import Response, send_file
+from werkzeug.utils import secure_filename
+import io
+import os
+import shutil
+import tempfile
+
+
+def detach(file):
+    """
+    Takes an uploaded file's stream out of the request and returns it. Flask
+    closes the request's files when the view returns, before a streamed
+    response is consumed; a detached stream stays open and the caller closes it.
+    """
+    stream = file.stream
+    file.stream = io.BytesIO()
+    return stream
+
+
+def _unique_name(filename, taken):
+    """Returns filename, or the first of "1_<filename>", "2_<filename>", ... that taken() rejects."""
+    name, index = filename, 0
+    while taken(name):
+        index += 1
+        name = f"{index}_{filename}"
+    return name
+
+
+def unique_path(directory, filename):
+    """
+    Returns the path of filename in directory, prefixed with "1_", "2_", ...
+    when that name is already taken, so same-named uploads do not overwrite
+    each other.
+    """
+    return os.path.join(directory, _unique_name(filename, lambda name: os.path.exists(os.path.join(directory, name))))
+
+
+def unique_names(filenames):
+    """Returns the file names made unique the way unique_path does, for files kept in memory."""
+    names = []
+    for filename in filenames:
+        names.append(_unique_name(filename, names.__contains__))
+    return names
+
+
+class Workspace:
+    """A scratch directory that lives for the duration of one request."""
+
+    def __init__(self, root):
+        os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix='tool_', dir=root)
+        self._handed_off = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._handed_off:
+            self.remove()
+        return False
+
+    def save(self, file):
+        """Saves an uploaded file into the workspace and returns its path."""
+        path = unique_path(self.path, secure_filename(file.filename) or 'upload')
+        file.save(path)
+        return path
+
+    def send(self, output_path, **kwargs):
+        """Streams output_path back and removes the workspace afterwards."""
+        kwargs.setdefault('download_name', os.path.basename(output_path))
+        response = send_file(os.path.abspath(output_path), **kwargs)
+        response.call_on_close(self.remove)
+        self._handed_off = True
+        return response
+
+    def send_stream(self, chunks, filename, mimetype='application/octet-stream'):
+        """Streams an iterable of bytes back as filename and removes the workspace afterwards."""
+        response = Response(chunks, mimetype=mimetype,
+                            headers={'Content-Disposition': f'attachment; filename="{secure_filename(filename) or "download"}"'})
+        response.call_on_close(self.remove)
+        self._handed_off = True
+        return response
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)